@@ -0,0 +1,28 @@
+"""
+Algorand accounts of the ASA Staking dApp: key pairs and logic signature
+escrows, shared by asa_staking.py and ledger_simulator.py.
+"""
+
+import dataclasses
+
+from algosdk import account, mnemonic
+from algosdk.future.transaction import LogicSig
+
+
+@dataclasses.dataclass
+class Account:
+    address: str
+    # Kept out of the repr, and so of logs and tracebacks
+    private_key: str = dataclasses.field(repr=False)
+    lsig: LogicSig = None
+
+    def mnemonic(self) -> str:
+        return mnemonic.from_private_key(self.private_key)
+
+    def is_lsig(self):
+        return not self.private_key and self.lsig
+
+    @classmethod
+    def create_account(cls):
+        private_key, address = account.generate_account()
+        return cls(private_key=private_key, address=address)
@@ -13,38 +13,114 @@ _ASA decimals positions_. Check ASA Decimals with command: info.
 must enter `<funding-amount>=100000` (as result of 100 * 10^3).
 
 Usage:
-  asa_staking.py create <purestake-api-token> <mnemonic> <asset-id> <locking-blocks> <funding-amount> [--test]
-  asa_staking.py info <purestake-api-token> <app-id> [--test]
-  asa_staking.py join <purestake-api-token> <mnemonic> <app-id> [--test]
-  asa_staking.py booking <purestake-api-token> <mnemonic> <app-id> <booking-amount> [--test]
-  asa_staking.py status <purestake-api-token> <account> <app-id> [--test]
-  asa_staking.py withdraw <purestake-api-token> <mnemonic> <app-id> [--test]
+  asa_staking.py create <purestake-api-token> <mnemonic> <asset-id> <locking-blocks> <funding-amount> [--optimized] [--metrics=<file>] [--test]
+  asa_staking.py create-registry <purestake-api-token> <mnemonic> [--metrics=<file>] [--test]
+  asa_staking.py add-pool <purestake-api-token> <mnemonic> <app-id> <asset-id> <locking-blocks> <reward-percent> <funding-amount> [--metrics=<file>] [--test]
+  asa_staking.py fund-pool <purestake-api-token> <mnemonic> <app-id> <funding-amount> --pool=<pool-id> [--metrics=<file>] [--test]
+  asa_staking.py info <purestake-api-token> <app-id> [--pool=<pool-id>] [--max-age=<sec>] [--index=<file>] [--metrics=<file>] [--test]
+  asa_staking.py join <purestake-api-token> <mnemonic> <app-id> [--pool=<pool-id>] [--metrics=<file>] [--test]
+  asa_staking.py booking <purestake-api-token> <mnemonic> <app-id> <booking-amount> [--pool=<pool-id>] [--metrics=<file>] [--test]
+  asa_staking.py booking-batch <purestake-api-token> <batch-file> [--metrics=<file>] [--test]
+  asa_staking.py status <purestake-api-token> <account> <app-id> [--pool=<pool-id>] [--max-age=<sec>] [--index=<file>] [--metrics=<file>] [--test]
+  asa_staking.py status-all <purestake-api-token> <app-id> [--pool=<pool-id>] [--metrics=<file>] [--test]
+  asa_staking.py withdraw <purestake-api-token> <mnemonic> <app-id> [--pool=<pool-id>] [--metrics=<file>] [--test]
+  asa_staking.py watch <purestake-api-token> <account> <app-id> [--pool=<pool-id>] [--withdraw=<mnemonic>] [--metrics=<file>] [--test]
+  asa_staking.py scheduler <purestake-api-token> <batch-file> [--schedule=<file>] [--metrics=<file>] [--test]
+  asa_staking.py sync <purestake-api-token> [<app-ids>...] [--from=<round>] [--once] [--index=<file>] [--metrics=<file>] [--test]
+  asa_staking.py save-params <purestake-api-token> <params-file> [--test]
+  asa_staking.py prepare <purestake-api-token> <batch-file> <signed-file> [--params=<file>] [--index=<file>] [--test]
+  asa_staking.py submit <purestake-api-token> <signed-files>... [--metrics=<file>] [--test]
+  asa_staking.py simulate <funding-amount> <locking-blocks> [--history=<file>] [--rate=<bookings>] [--amount=<units>] [--delay=<blocks>] [--horizon=<blocks>] [--scenarios=<n>] [--seed=<n>]
+  asa_staking.py simulate <purestake-api-token> <app-id> <funding-amount> <locking-blocks> [--pool=<pool-id>] [--delay=<blocks>] [--horizon=<blocks>] [--scenarios=<n>] [--seed=<n>] [--test]
+  asa_staking.py profile-contracts [<baseline-file>] [--save]
   asa_staking.py [--help]
 
 Commands:
-  create      Create new decentalized ASA staking application.
-  info        Decentalized ASA staking application info.
-  join        Join a decentalized ASA staking application.
-  booking     Book and deposit a staking amount.
-  status      Check your staking status.
-  withdraw    Withdraw staked amount with rewards.
+  create            Create new decentalized ASA staking application.
+  create-registry   Create a pool registry, serving many staking pools.
+  add-pool          Add and fund a staking pool to a pool registry.
+  fund-pool         Add funds to a staking pool of a pool registry.
+  info              Decentalized ASA staking application info.
+  join              Join a decentalized ASA staking application.
+  booking           Book and deposit a staking amount.
+  booking-batch     Book and deposit staking amounts for many accounts.
+  status            Check your staking status.
+  status-all        Stream the staking status of every account (JSONL).
+  withdraw          Withdraw staked amount with rewards.
+  watch             Wait for your withdrawal to unlock, block by block.
+  scheduler         Withdraw for many accounts as soon as bookings unlock.
+  sync              Follow the blocks, indexing staking dApps in SQLite.
+  save-params       Save the suggested params, to prepare groups offline.
+  prepare           Build and sign the groups of a batch, with no submission.
+  submit            Submit signed batch files, confirming every group.
+  simulate          Project escrow funds and payouts, to size a dApp.
+  profile-contracts Size and cost profile of the staking contracts.
 
 Options:
-  -t --test   Use Algorand TestNet.
+  -t --test            Use Algorand TestNet.
+  -o --optimized       Create the dApp with the optimized TEAL v8 approval.
+  -p --pool=<pool-id>  Staking pool of a pool registry.
+  -m --max-age=<sec>   Read from the index, if synced within these seconds.
+  -i --index=<file>    SQLite index file (default: ~/.cache/asa_staking).
+  -f --from=<round>    Index from this round, instead of the current state.
+  --once               Stop syncing once caught up with the last round.
+  --metrics=<file>     Dump metrics at exit (.json, else Prometheus text).
+  --params=<file>      Prepare with saved params, instead of algod ones.
+  --schedule=<file>    Scheduler state (default: ~/.cache/asa_staking).
+  --history=<file>     Past bookings (round, amount) to model arrivals on.
+  --rate=<bookings>    Synthetic arrivals: mean bookings per block.
+  --amount=<units>     Synthetic arrivals: mean booking amount.
+  --delay=<blocks>     Mean delay of the withdrawals after unlock (default: 0).
+  --horizon=<blocks>   Blocks to simulate (default: 200000).
+  --scenarios=<n>      Monte Carlo scenarios (default: 10000).
+  --seed=<n>           Seed of the simulation.
+  --withdraw=<mnemonic>
+                       Withdraw once unlocked (mnemonic, or its keyfile).
+  -s --save            Save the contracts profile as baseline.
   -h --help
 """
 
 
+import os
+import csv
+import copy
 import json
 import sys
+import time
+import atexit
+import sqlite3
+import tempfile
 import base64
+import random
+import heapq
+import hashlib
+import weakref
+import threading
+import http.client
+import contextlib
+from io import BytesIO
+from urllib import parse
+from collections import defaultdict
 import dataclasses
+from concurrent.futures import (
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+)
+
+import msgpack
 
-from docopt import docopt
+from docopt import docopt, DocoptExit
 
 from algosdk import encoding, mnemonic, account, util, kmd
+from algosdk import constants as algosdk_constants
 from algosdk.v2client import algod, indexer
-from algosdk.error import AlgodHTTPError, IndexerHTTPError
+from algosdk.error import (
+    AlgodHTTPError,
+    ConfirmationTimeoutError,
+    IndexerHTTPError,
+    TransactionRejectedError,
+)
 from algosdk.future.transaction import (
     AssetTransferTxn,
     ApplicationCreateTxn,
@@ -55,37 +131,66 @@ from algosdk.future.transaction import (
     OnComplete,
     PaymentTxn,
     StateSchema,
+    SuggestedParams,
     Transaction,
     calculate_group_id,
-    wait_for_confirmation,
     write_to_file,
 )
-from pyteal import (
-    And,
-    App,
-    Assert,
-    Btoi,
-    Bytes,
-    Cond,
-    Ge,
-    Global,
-    Gtxn,
-    If,
-    Int,
-    Mode,
-    Mul,
-    OnComplete as PyTealOnComplete,
-    Return,
-    Seq,
-    Txn,
-    TxnType,
-    compileTeal
+
+from accounts import Account
+from teal_vm import (
+    TealAssemblyError,
+    TealReject,
+    assemble,
+    decode_txn,
+    eval_teal,
+    profile_program,
+    profile_summary,
+    teal_version,
+    txn_id,
 )
 
 # --- Config
 MAX_CONNECTION_ATTEMPTS = 10
-CONNECTION_ATTEMPT_DELAY_SEC = 2
+RETRY_BACKOFF_BASE_SEC = 0.25
+RETRY_BACKOFF_MAX_SEC = 8
+RETRY_BUDGET_MIN = 10
+RETRY_BUDGET_RATIO = 0.2
+RETRY_HTTP_STATUSES = (429, 500, 502, 503, 504)
+HTTP_POOL_SIZE = 8
+HTTP_TIMEOUT_SEC = 90
 FUND_ACCOUNT_ALGOS = 100_000
+SUGGESTED_PARAMS_TTL_SEC = 5
+MAX_SUBMIT_WORKERS = HTTP_POOL_SIZE
+MAX_WAIT_ROUNDS = 1000
+SIGNING_WORKERS = os.cpu_count() or 1
+SIGNING_MIN_PARALLEL_GROUPS = 256
+SIGNING_CHUNKS_PER_WORKER = 4
+FAST_FORWARD_BATCH = 64
+INDEXER_PAGE_SIZE = 1000
+COMPILE_CACHE_DIR = os.path.join(
+    os.path.expanduser('~'), '.cache', 'asa_staking', 'teal')
+ESCROW_CACHE_DIR = os.path.join(
+    os.path.expanduser('~'), '.cache', 'asa_staking', 'escrow')
+REGISTRY_ESCROW_ALGOS = 200_000
+ESCROW_ASSET_ALGOS = 100_000
+INDEX_DB_FILE = os.path.join(
+    os.path.expanduser('~'), '.cache', 'asa_staking', 'index.sqlite3')
+INDEX_MAX_AGE_SEC = 30
+INDEX_SNAPSHOT_ATTEMPTS = 30
+SCHEDULE_FILE = os.path.join(
+    os.path.expanduser('~'), '.cache', 'asa_staking', 'schedule.json')
+# Rounds between two reads of the accounts with no withdrawal scheduled
+SCHEDULE_RESCAN_ROUNDS = 20
+# Failed withdrawals back off doubling the rounds, up to this
+SCHEDULE_MAX_RETRY_ROUNDS = 64
+SIMULATE_SCENARIOS = 10_000
+SIMULATE_HORIZON_BLOCKS = 200_000
+SIMULATE_PAYOUT_WINDOW_BLOCKS = 1000
+# Bookings drawn at once: bounds the memory of a chunk of scenarios
+SIMULATE_CHUNK_BOOKINGS = 2_000_000
+METRICS_BUCKETS_SEC = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
 
 # --- PyTEAL
 TEAL_VERSION = 2
@@ -100,6 +205,28 @@ LOCAL_BYTES = 0
 
 
 def withdrawal_approval():
+    # PyTeal is slow to import: load it only to generate the programs
+    from pyteal import (
+        And,
+        App,
+        Assert,
+        Btoi,
+        Bytes,
+        Cond,
+        Ge,
+        Global,
+        Gtxn,
+        If,
+        Int,
+        Mode,
+        Mul,
+        OnComplete as PyTealOnComplete,
+        Return,
+        Seq,
+        Txn,
+        TxnType,
+        compileTeal
+    )
 
     on_creation = Seq([
         App.globalPut(Bytes("Creator"), Txn.sender()),
@@ -246,10 +373,23 @@ def withdrawal_approval():
 
 
 def withdrawal_clear():
+    from pyteal import Int, Mode, compileTeal
     return compileTeal(Int(1), Mode.Application, version=2)
 
 
 def withdrawal_escrow(app_id: int, asa_id: int):
+    from pyteal import (
+        And,
+        Cond,
+        Global,
+        Gtxn,
+        Int,
+        Mode,
+        OnComplete as PyTealOnComplete,
+        Txn,
+        TxnType,
+        compileTeal
+    )
 
     fee = Int(1000)
 
@@ -281,22 +421,637 @@ def withdrawal_escrow(app_id: int, asa_id: int):
     return compileTeal(program, Mode.Signature, version=TEAL_VERSION)
 
 
-@dataclasses.dataclass
-class Account:
-    address: str
-    private_key: str
-    lsig: LogicSig = None
+# --- Pool registry
+# One registry app and one escrow serve many staking pools. Each pool is a
+# global "Pool" + itob(pool_id) record, packing four uint64: AssetID,
+# WithdrawalProcessingRounds, RewardPercent and WithdrawalBookableAmount.
+# Each booking is a local "Booking" + itob(pool_id) record, packing the
+# WithdrawalBookingRound and the WithdrawalBookedAmount.
+REGISTRY_POOLS = 32
+REGISTRY_BOOKINGS = 4
+
+# GLOBAL SCHEMA: PoolCount; Creator, AssetEscrow and the pool records
+REGISTRY_GLOBAL_INTS = 1
+REGISTRY_GLOBAL_BYTES = 2 + REGISTRY_POOLS
+
+# LOCAL SCHEMA: the bookings of an account, one per pool
+REGISTRY_LOCAL_INTS = 0
+REGISTRY_LOCAL_BYTES = REGISTRY_BOOKINGS
+
+POOL_RECORD_FIELDS = (
+    'AssetID',
+    'WithdrawalProcessingRounds',
+    'RewardPercent',
+    'WithdrawalBookableAmount',
+)
 
-    def mnemonic(self) -> str:
-        return mnemonic.from_private_key(self.private_key)
+BOOKING_RECORD_FIELDS = (
+    'WithdrawalBookingRound',
+    'WithdrawalBookedAmount',
+)
 
-    def is_lsig(self):
-        return not self.private_key and self.lsig
 
-    @classmethod
-    def create_account(cls):
-        private_key, address = account.generate_account()
-        return cls(private_key=private_key, address=address)
+def registry_approval():
+    from pyteal import (
+        And,
+        App,
+        Assert,
+        Btoi,
+        Bytes,
+        Concat,
+        Cond,
+        Div,
+        Ge,
+        Global,
+        Gtxn,
+        If,
+        Int,
+        Itob,
+        Len,
+        Mode,
+        Mul,
+        Not,
+        OnComplete as PyTealOnComplete,
+        Return,
+        Seq,
+        Substring,
+        Txn,
+        TxnType,
+        compileTeal
+    )
+
+    def record_field(record, fields, name):
+        index = fields.index(name)
+        return Btoi(Substring(record, Int(8 * index), Int(8 * index + 8)))
+
+    def reward(pool_record, amount):
+        return Div(
+            Mul(amount, record_field(
+                pool_record, POOL_RECORD_FIELDS, 'RewardPercent')),
+            Int(100)
+        )
+
+    pool_id = Itob(Btoi(Gtxn[0].application_args[1]))
+    pool_key = Concat(Bytes("Pool"), pool_id)
+    booking_key = Concat(Bytes("Booking"), pool_id)
+
+    pool = App.globalGetEx(Int(0), pool_key)
+    pool_booking = App.localGetEx(Int(0), Int(0), booking_key)
+    asset_escrow = App.globalGetEx(Int(0), Bytes("AssetEscrow"))
+
+    def bookable_amount(pool_record):
+        return record_field(
+            pool_record, POOL_RECORD_FIELDS, 'WithdrawalBookableAmount')
+
+    def with_bookable_amount(pool_record, amount):
+        return Concat(Substring(pool_record, Int(0), Int(24)), Itob(amount))
+
+    is_creator = App.globalGet(Bytes("Creator")) == Gtxn[0].sender()
+
+    on_creation = Seq([
+        App.globalPut(Bytes("Creator"), Txn.sender()),
+        App.globalPut(Bytes("PoolCount"), Int(0)),
+        Return(Int(1))
+    ])
+
+    handle_optin = Return(Int(1))
+
+    handle_closeout = Return(Int(1))
+
+    handle_updateapp = Return(Int(0))
+
+    handle_deleteapp = If(
+        # Condition
+        App.globalGet(Bytes("Creator")) == Txn.sender(),
+        # Then
+        Return(Int(1)),
+        # Else
+        Return(Int(0))
+    )
+
+    # The escrow is set once, then holds the funds of every pool
+    registry_setup = Seq([
+        asset_escrow,
+        Assert(
+            And(
+                is_creator,
+                Not(asset_escrow.hasValue()),
+                Gtxn[0].application_args.length() == Int(2),
+                Len(Gtxn[0].application_args[1]) == Int(32)
+            )
+        ),
+        App.globalPut(Bytes("AssetEscrow"), Gtxn[0].application_args[1]),
+        Return(Int(1))
+    ])
+
+    asset_optin = Seq([
+        Assert(
+            And(
+                is_creator,
+                Gtxn[1].type_enum() == TxnType.AssetTransfer,
+                Gtxn[1].sender() == App.globalGet(Bytes("AssetEscrow")),
+                Gtxn[1].asset_receiver() == Gtxn[1].sender(),
+                Gtxn[1].asset_amount() == Int(0)
+            )
+        ),
+        Return(Int(1))
+    ])
+
+    funding = And(
+        is_creator,
+        Gtxn[1].type_enum() == TxnType.AssetTransfer,
+        Gtxn[1].sender() == Gtxn[0].sender(),
+        Gtxn[1].asset_receiver() == App.globalGet(Bytes("AssetEscrow")),
+        Gtxn[1].asset_amount() > Int(0)
+    )
+
+    add_pool = Seq([
+        Assert(
+            And(
+                funding,
+                Gtxn[0].application_args.length() == Int(3),
+                App.globalGet(Bytes("PoolCount")) < Int(REGISTRY_POOLS)
+            )
+        ),
+        App.globalPut(
+            Concat(Bytes("Pool"), Itob(App.globalGet(Bytes("PoolCount")))),
+            Concat(
+                Itob(Gtxn[1].xfer_asset()),
+                Itob(Btoi(Gtxn[0].application_args[1])),
+                Itob(Btoi(Gtxn[0].application_args[2])),
+                Itob(Gtxn[1].asset_amount())
+            )
+        ),
+        App.globalPut(Bytes("PoolCount"),
+                      App.globalGet(Bytes("PoolCount")) + Int(1)),
+        Return(Int(1))
+    ])
+
+    fund_pool = Seq([
+        pool,
+        Assert(
+            And(
+                funding,
+                pool.hasValue(),
+                Gtxn[1].xfer_asset() == record_field(
+                    pool.value(), POOL_RECORD_FIELDS, 'AssetID')
+            )
+        ),
+        App.globalPut(pool_key, with_bookable_amount(
+            pool.value(),
+            bookable_amount(pool.value()) + Gtxn[1].asset_amount())),
+        Return(Int(1))
+    ])
+
+    booking = Seq([
+        pool,
+        pool_booking,
+        Assert(
+            And(
+                pool.hasValue(),
+                Not(pool_booking.hasValue()),
+                Gtxn[1].type_enum() == TxnType.AssetTransfer,
+                Gtxn[1].xfer_asset() == record_field(
+                    pool.value(), POOL_RECORD_FIELDS, 'AssetID'),
+                Gtxn[1].sender() == Gtxn[0].sender(),
+                Gtxn[1].asset_receiver() == App.globalGet(
+                    Bytes("AssetEscrow")),
+                Gtxn[1].asset_amount() > Int(0),
+                reward(pool.value(), Gtxn[1].asset_amount())
+                <= bookable_amount(pool.value())
+            )
+        ),
+        App.localPut(Int(0), booking_key, Concat(
+            Itob(Global.round()), Itob(Gtxn[1].asset_amount()))),
+        App.globalPut(pool_key, with_bookable_amount(
+            pool.value(),
+            bookable_amount(pool.value())
+            - reward(pool.value(), Gtxn[1].asset_amount()))),
+        Return(Int(1))
+    ])
+
+    booked_amount = record_field(
+        pool_booking.value(), BOOKING_RECORD_FIELDS, 'WithdrawalBookedAmount')
+
+    withdrawal = Seq([
+        pool,
+        pool_booking,
+        Assert(
+            And(
+                pool.hasValue(),
+                pool_booking.hasValue(),
+                Ge(
+                    Global.round(),
+                    record_field(pool_booking.value(), BOOKING_RECORD_FIELDS,
+                                 'WithdrawalBookingRound')
+                    + record_field(pool.value(), POOL_RECORD_FIELDS,
+                                   'WithdrawalProcessingRounds')
+                ),
+                Gtxn[1].type_enum() == TxnType.AssetTransfer,
+                Gtxn[1].xfer_asset() == record_field(
+                    pool.value(), POOL_RECORD_FIELDS, 'AssetID'),
+                Gtxn[1].sender() == App.globalGet(Bytes("AssetEscrow")),
+                Gtxn[1].asset_amount() == booked_amount + reward(
+                    pool.value(), booked_amount)
+            )
+        ),
+        App.localDel(Int(0), booking_key),
+        Return(Int(1))
+    ])
+
+    handle_noop = Cond(
+        [And(
+            Global.group_size() == Int(1),
+            Gtxn[0].application_args[0] == Bytes("Setup")
+        ), registry_setup],
+        [And(
+            Global.group_size() == Int(2),
+            Gtxn[0].application_args[0] == Bytes("AssetOptIn")
+        ), asset_optin],
+        [And(
+            Global.group_size() == Int(2),
+            Gtxn[0].application_args[0] == Bytes("AddPool")
+        ), add_pool],
+        [And(
+            Global.group_size() == Int(2),
+            Gtxn[0].application_args[0] == Bytes("FundPool")
+        ), fund_pool],
+        [And(
+            Global.group_size() == Int(2),
+            Gtxn[0].application_args[0] == Bytes("Booking")
+        ), booking],
+        [And(
+            Global.group_size() == Int(2),
+            Gtxn[0].application_args[0] == Bytes("Withdrawal")
+        ), withdrawal]
+    )
+
+    program = Cond(
+        [Txn.application_id() == Int(0), on_creation],
+        [Txn.on_completion() == PyTealOnComplete.OptIn, handle_optin],
+        [Txn.on_completion() == PyTealOnComplete.CloseOut, handle_closeout],
+        [Txn.on_completion() == PyTealOnComplete.UpdateApplication,
+         handle_updateapp],
+        [Txn.on_completion() == PyTealOnComplete.DeleteApplication,
+         handle_deleteapp],
+        [And(
+            Txn.on_completion() == PyTealOnComplete.NoOp,
+            Txn.group_index() == Int(0)
+        ), handle_noop]
+    )
+    return compileTeal(program, Mode.Application, version=TEAL_VERSION)
+
+
+def registry_escrow(app_id: int):
+    from pyteal import (
+        And,
+        Global,
+        Gtxn,
+        Int,
+        Mode,
+        OnComplete as PyTealOnComplete,
+        Txn,
+        TxnType,
+        compileTeal
+    )
+
+    fee = Int(1000)
+
+    # Opt-ins and withdrawals alike are checked by the registry app
+    program = And(
+        Global.group_size() == Int(2),
+        Txn.group_index() == Int(1),
+        Gtxn[0].type_enum() == TxnType.ApplicationCall,
+        Gtxn[0].application_id() == Int(app_id),
+        Gtxn[0].on_completion() == PyTealOnComplete.NoOp,
+        Gtxn[1].type_enum() == TxnType.AssetTransfer,
+        Gtxn[1].fee() <= fee,
+        Gtxn[1].asset_close_to() == Global.zero_address(),
+        Gtxn[1].rekey_to() == Global.zero_address()
+    )
+
+    return compileTeal(program, Mode.Signature, version=TEAL_VERSION)
+
+
+# --- Optimized TEAL
+# Hand-written TEAL v8 version of withdrawal_approval(), for the same state
+# schema and escrow. OnCompletion is dispatched by `switch` and the NoOp
+# calls by `match`, constants come from explicit blocks (no algod constants
+# reordering, so it assembles offline) and repeated state reads are cached
+# in scratch space. check_equivalence.py verifies that it accepts and
+# rejects the same groups as withdrawal_approval().
+OPTIMIZED_APPROVAL_BRANCHES = [
+    'create',
+    ('no-op', ['setup', 'Booking', 'Withdrawal']),
+    'opt-in',
+    'close-out',
+    'clear-state',
+    'update',
+    'delete',
+]
+
+WITHDRAWAL_APPROVAL_OPTIMIZED = """#pragma version 8
+intcblock 0 1 2 4
+bytecblock "WithdrawalBookingRound" "Creator" "AssetEscrow" "WithdrawalBookedAmount" "AssetID" "WithdrawalBookableAmount" "WithdrawalProcessingRounds"
+txn ApplicationID
+bz create
+txn OnCompletion
+switch noop approve approve reject reject delete
+err
+create:
+bytec_1 // "Creator"
+txn Sender
+app_global_put
+approve:
+intc_1 // 1
+return
+reject:
+intc_0 // 0
+return
+delete:
+bytec_1 // "Creator"
+app_global_get
+txn Sender
+==
+return
+noop:
+// Every staking call is the first of a group of two
+global GroupSize
+intc_2 // 2
+==
+txn GroupIndex
+!
+&&
+assert
+bytec_1 // "Creator"
+app_global_get
+txn Sender
+==
+bnz setup
+pushbytes "Booking"
+pushbytes "Withdrawal"
+txna ApplicationArgs 0
+match booking withdrawal
+err
+setup:
+txn NumAppArgs
+intc_2 // 2
+==
+gtxn 1 TypeEnum
+intc_3 // axfer
+==
+&&
+gtxn 1 AssetReceiver
+txna ApplicationArgs 0
+==
+&&
+gtxn 1 AssetAmount
+intc_0 // 0
+>
+&&
+bz reject
+bytec_2 // "AssetEscrow"
+txna ApplicationArgs 0
+app_global_put
+bytec 6 // "WithdrawalProcessingRounds"
+txna ApplicationArgs 1
+btoi
+app_global_put
+bytec 4 // "AssetID"
+gtxn 1 XferAsset
+app_global_put
+bytec 5 // "WithdrawalBookableAmount"
+gtxn 1 AssetAmount
+app_global_put
+intc_1 // 1
+return
+booking:
+intc_0 // sender
+bytec_0 // "WithdrawalBookingRound"
+app_local_get
+bnz reject
+gtxn 1 TypeEnum
+intc_3 // axfer
+==
+gtxn 1 XferAsset
+bytec 4 // "AssetID"
+app_global_get
+==
+&&
+gtxn 1 Sender
+txn Sender
+==
+&&
+gtxn 1 AssetReceiver
+bytec_2 // "AssetEscrow"
+app_global_get
+==
+&&
+gtxn 1 AssetAmount
+store 0 // booking amount
+load 0
+bytec 5 // "WithdrawalBookableAmount"
+app_global_get
+dup
+store 1 // bookable amount
+<=
+&&
+assert
+intc_0 // sender
+bytec_0 // "WithdrawalBookingRound"
+global Round
+app_local_put
+intc_0 // sender
+bytec_3 // "WithdrawalBookedAmount"
+load 0
+app_local_put
+bytec 5 // "WithdrawalBookableAmount"
+load 1
+load 0
+-
+app_global_put
+intc_1 // 1
+return
+withdrawal:
+intc_0 // sender
+bytec_0 // "WithdrawalBookingRound"
+app_local_get
+dup
+store 0 // booking round
+intc_0 // 0
+>
+intc_0 // sender
+bytec_3 // "WithdrawalBookedAmount"
+app_local_get
+dup
+store 1 // booked amount
+intc_0 // 0
+>
+&&
+global Round
+load 0
+bytec 6 // "WithdrawalProcessingRounds"
+app_global_get
++
+>=
+&&
+gtxn 1 XferAsset
+bytec 4 // "AssetID"
+app_global_get
+==
+&&
+gtxn 1 Sender
+bytec_2 // "AssetEscrow"
+app_global_get
+==
+&&
+gtxn 1 AssetAmount
+load 1
+intc_2 // 2
+*
+==
+&&
+assert
+intc_0 // sender
+bytec_0 // "WithdrawalBookingRound"
+intc_0 // 0
+app_local_put
+intc_0 // sender
+bytec_3 // "WithdrawalBookedAmount"
+intc_0 // 0
+app_local_put
+intc_1 // 1
+return
+"""
+
+
+# From TEAL v6 algod requires the approval and clear programs of an app to
+# have the same version: the optimized approval comes with a v8 clear
+WITHDRAWAL_CLEAR_OPTIMIZED = """#pragma version 8
+pushint 1
+return
+"""
+
+
+def withdrawal_approval_optimized():
+    return WITHDRAWAL_APPROVAL_OPTIMIZED
+
+
+def withdrawal_clear_optimized():
+    return WITHDRAWAL_CLEAR_OPTIMIZED
+
+# --- Prebuilt programs
+# TEAL of the PyTeal programs above, shipped in ARTIFACTS_DIR so that no
+# PyTeal is needed to create a dApp or rebuild its escrow. An artifact is
+# used only if its SHA-256 is the one pinned here, else the program is
+# generated with PyTeal. Rebuild with `build_artifacts.py` after changing
+# the PyTeal programs.
+ARTIFACTS_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'artifacts')
+
+PROGRAM_ARTIFACTS = {
+    'withdrawal_approval.teal':
+        'ac9f09a0848e54f39cf917b9769fa28f8f39c3279d11a733ba2f243724fdec7f',
+    'withdrawal_clear.teal':
+        '2cf6acadf8439aca64f2235ee417c3c49e3c6c4cb7c6a00e16a21bd7cb0572db',
+    'withdrawal_escrow.teal':
+        'feacd397f606795fabe01048034537cb826be983009b836d3b278510f600231e',
+    'registry_approval.teal':
+        'd347aff71a3b85f2aaa3a13f55fd9bfcea14a393466f0aab159c1a21e5c26f3e',
+    'registry_escrow.teal':
+        'f25c43aeec16e8523f39aa7f135e5cb21fcecf0866aa36ed4ad9a525483763aa',
+}
+
+
+def program_artifact(name: str, artifacts_dir=ARTIFACTS_DIR):
+    """TEAL of a prebuilt program, if present and matching its hash."""
+    try:
+        with open(os.path.join(artifacts_dir, name), 'rb') as f:
+            artifact = f.read()
+    except OSError:
+        return None
+    if hashlib.sha256(artifact).hexdigest() != PROGRAM_ARTIFACTS[name]:
+        return None
+    source_code = artifact.decode()
+    if teal_version(source_code) != TEAL_VERSION:
+        return None
+    return source_code
+
+
+def approval_teal() -> str:
+    return (program_artifact('withdrawal_approval.teal')
+            or withdrawal_approval())
+
+
+def clear_teal() -> str:
+    return program_artifact('withdrawal_clear.teal') or withdrawal_clear()
+
+
+def escrow_teal(app_id: int, asa_id: int) -> str:
+    template = program_artifact('withdrawal_escrow.teal')
+    if template is None:
+        return withdrawal_escrow(app_id, asa_id)
+    return template.replace('TMPL_APP_ID', str(app_id)).replace(
+        'TMPL_ASSET_ID', str(asa_id))
+
+
+def registry_approval_teal() -> str:
+    return (program_artifact('registry_approval.teal')
+            or registry_approval())
+
+
+def registry_escrow_teal(app_id: int) -> str:
+    template = program_artifact('registry_escrow.teal')
+    if template is None:
+        return registry_escrow(app_id)
+    return template.replace('TMPL_APP_ID', str(app_id))
+
+
+# --- Contracts profile
+# Size and cost of the dApp programs, profiled by teal_vm. Escrow programs
+# are profiled for App and ASA IDs of TestNet size.
+PROFILE_APP_ID = 100_000_001
+PROFILE_ASSET_ID = 100_000_002
+
+# Cond branches of the programs, in order. A (name, branches) tuple is a
+# branch dispatching a nested Cond.
+APPROVAL_BRANCHES = [
+    'create',
+    'opt-in',
+    'close-out',
+    'update',
+    'delete',
+    ('no-op', ['setup', 'Booking', 'Withdrawal']),
+]
+
+ESCROW_BRANCHES = ['opt-in', 'withdrawal']
+
+REGISTRY_APPROVAL_BRANCHES = [
+    'create',
+    'opt-in',
+    'close-out',
+    'update',
+    'delete',
+    ('no-op', ['Setup', 'AssetOptIn', 'AddPool', 'FundPool', 'Booking',
+               'Withdrawal']),
+]
+
+
+def profile_contracts() -> dict:
+    """Profile of the staking and pool registry programs."""
+    return {
+        'withdrawal_approval': profile_program(
+            withdrawal_approval(), APPROVAL_BRANCHES),
+        'withdrawal_approval_optimized': profile_program(
+            withdrawal_approval_optimized(), OPTIMIZED_APPROVAL_BRANCHES),
+        'withdrawal_clear': profile_program(withdrawal_clear()),
+        'withdrawal_escrow': profile_program(
+            withdrawal_escrow(PROFILE_APP_ID, PROFILE_ASSET_ID),
+            ESCROW_BRANCHES),
+        'registry_approval': profile_program(
+            registry_approval(), REGISTRY_APPROVAL_BRANCHES),
+        'registry_escrow': profile_program(registry_escrow(PROFILE_APP_ID)),
+    }
 
 
 def sign(signer: Account, txn: Transaction):
@@ -312,14 +1067,124 @@ def sign_send_wait(algod_client: algod.AlgodClient, signer: Account,
                    txn: Transaction, debug=False):
     """Sign a transaction, submit it, and wait for its confirmation."""
     signed_txn = sign(signer, txn)
-    tx_id = signed_txn.transaction.get_txid()
 
     if debug:
         write_to_file([signed_txn], "/tmp/txn.signed", overwrite=True)
 
-    algod_client.send_transactions([signed_txn])
-    wait_for_confirmation(algod_client, tx_id)
-    return algod_client.pending_transaction_info(tx_id)
+    return send_wait(algod_client, [signed_txn])
+
+
+def send_wait(algod_client: algod.AlgodClient, signed_txns: list):
+    """Submit signed transactions (a single one or a group) and wait for
+    their confirmation, returning the round they were confirmed in."""
+    tracker = ConfirmationTracker(algod_client)
+    confirmation = tracker.track_signed(signed_txns[0])
+    algod_client.send_transactions(signed_txns)
+    tracker.wait()
+    return confirmation.result()['confirmed-round']
+
+
+def block_tx_ids(block: dict) -> list[str]:
+    """IDs of the transactions in a (msgpack decoded) block. Blocks strip
+    the genesis fields from their transactions: restore them to hash."""
+    tx_ids = []
+    for stxn in block.get('txns', []):
+        txn = dict(stxn['txn'])
+        txn['gh'] = block['gh']
+        if stxn.get('hgi'):
+            txn['gen'] = block['gen']
+        tx_ids.append(txn_id(txn))
+    return tx_ids
+
+
+class ConfirmationTracker:
+    """Confirm many transactions by following the new blocks.
+
+    Each new round is fetched once and resolves every tracked transaction it
+    contains, so the HTTP calls grow with the rounds waited, not with the
+    transactions in flight. Transactions still pending after a round are
+    looked up in the node pool, failing at once if it dropped them.
+    Confirmations are exposed as futures, resolving to
+    `{'confirmed-round': round}`.
+    """
+
+    def __init__(self, algod_client: algod.AlgodClient, start_round=None):
+        self.algod_client = algod_client
+        if start_round is None:
+            start_round = get_last_round(algod_client)
+        # Rounds up to start_round are not scanned: create the tracker
+        # before submitting the transactions.
+        self.last_round = start_round
+        self.pending = {}
+
+    def track(self, tx_id: str, last_valid=None, callback=None) -> Future:
+        """Track a transaction ID, optionally calling `callback(future)`
+        once resolved."""
+        confirmation = Future()
+        if callback:
+            confirmation.add_done_callback(callback)
+        self.pending[tx_id] = (confirmation, last_valid)
+        return confirmation
+
+    def track_signed(self, signed_txn, callback=None) -> Future:
+        return self.track(
+            signed_txn.get_txid(),
+            signed_txn.transaction.last_valid_round,
+            callback,
+        )
+
+    def process_round(self, round_num: int):
+        block = msgpack.unpackb(
+            self.algod_client.block_info(
+                round_num=round_num, response_format='msgpack'),
+            raw=False, strict_map_key=False,
+        )['block']
+        for tx_id in block_tx_ids(block):
+            if tx_id in self.pending:
+                confirmation, _ = self.pending.pop(tx_id)
+                confirmation.set_result({'confirmed-round': round_num})
+
+        for tx_id, (confirmation, last_valid) in list(self.pending.items()):
+            if last_valid is not None and round_num >= last_valid:
+                del self.pending[tx_id]
+                confirmation.set_exception(TransactionRejectedError(
+                    f"Transaction {tx_id} expired at round {last_valid}"))
+
+        self.last_round = round_num
+        params_cache(self.algod_client).observe_round(round_num)
+
+    def check_pool(self):
+        """Fail the tracked transactions dropped from the node pool, rather
+        than waiting for them until their last valid round."""
+        for tx_id, (confirmation, _) in list(self.pending.items()):
+            try:
+                pool_error = self.algod_client.pending_transaction_info(
+                    tx_id).get('pool-error')
+            except AlgodHTTPError:
+                continue
+            if pool_error:
+                del self.pending[tx_id]
+                confirmation.set_exception(TransactionRejectedError(
+                    f"Transaction {tx_id} dropped from the pool: "
+                    f"{pool_error}"))
+
+    def wait(self, wait_rounds=MAX_WAIT_ROUNDS):
+        """Follow the new blocks until every tracked transaction resolves."""
+        timeout_round = self.last_round + wait_rounds
+        while self.pending and self.last_round < timeout_round:
+            last_round = self.algod_client.status_after_block(
+                self.last_round)['last-round']
+            for round_num in range(self.last_round + 1, last_round + 1):
+                self.process_round(round_num)
+                if not self.pending:
+                    break
+            if self.pending:
+                self.check_pool()
+
+        for tx_id, (confirmation, _) in self.pending.items():
+            confirmation.set_exception(ConfirmationTimeoutError(
+                f"Wait for transaction id {tx_id} timed out"))
+        self.pending.clear()
 
 
 def group_and_sign(signers: list[Account], txns: list[Transaction], debug=False):
@@ -338,69 +1203,232 @@ def group_and_sign(signers: list[Account], txns: list[Transaction], debug=False)
     return signed_group
 
 
+class SuggestedParamsCache:
+    """Round-scoped cache of the algod suggested params.
+
+    Params are fetched once and reused until a newer round is observed or the
+    TTL expires, whichever comes first.
+    """
+
+    def __init__(self, algod_client: algod.AlgodClient,
+                 ttl=SUGGESTED_PARAMS_TTL_SEC):
+        self.algod_client = algod_client
+        self.ttl = ttl
+        self.params = None
+        self.fetched_at = 0.0
+
+    def get(self) -> SuggestedParams:
+        if (self.params is None
+                or time.monotonic() - self.fetched_at > self.ttl):
+            self.refresh()
+        # Callers may tweak fees on their own copy
+        return copy.copy(self.params)
+
+    def refresh(self) -> SuggestedParams:
+        """Force a new fetch of the suggested params."""
+        self.params = self.algod_client.suggested_params()
+        self.fetched_at = time.monotonic()
+        return self.params
+
+    def observe_round(self, last_round: int):
+        """Invalidate the cached params once the chain moved past them."""
+        if self.params is not None and last_round > self.params.first:
+            self.params = None
+
+
+_params_caches = weakref.WeakKeyDictionary()
+
+
+def params_cache(algod_client: algod.AlgodClient) -> SuggestedParamsCache:
+    """The SuggestedParamsCache shared by all calls on an algod client."""
+    if algod_client not in _params_caches:
+        _params_caches[algod_client] = SuggestedParamsCache(algod_client)
+    return _params_caches[algod_client]
+
+
+def suggested_params(algod_client: algod.AlgodClient,
+                     refresh=False) -> SuggestedParams:
+    cache = params_cache(algod_client)
+    if refresh:
+        cache.refresh()
+    return cache.get()
+
+
 def fund(algod_client: algod.AlgodClient, faucet: Account, receiver: Account, amount=FUND_ACCOUNT_ALGOS):
-    params = algod_client.suggested_params()
+    params = suggested_params(algod_client)
     txn = PaymentTxn(faucet.address, params, receiver.address, amount)
     return sign_send_wait(algod_client, faucet, txn)
 
 
 def get_last_round(algod_client: algod.AlgodClient) -> int:
-    return algod_client.status()["last-round"]
+    last_round = algod_client.status()["last-round"]
+    params_cache(algod_client).observe_round(last_round)
+    return last_round
 
 
-def wait_until_round(algod_client: algod.AlgodClient, admin: Account, r: int):
+def wait_until_round(algod_client: algod.AlgodClient, admin: Account, r: int,
+                     fast=False):
     print(f" --- Waiting until round: {r}.")
+    if fast:
+        return fast_forward(algod_client, admin, r)
     while get_last_round(algod_client) < r:
         fund(algod_client, admin, admin, amount=0)
 
 
-def to_lsig(algod_client: algod.AlgodClient, teal, debug=False):
+def fast_forward(algod_client: algod.AlgodClient, account: Account,
+                 target_round: int, batch_size=FAST_FORWARD_BATCH):
+    """Burn rounds on local dev mode networks, where every transaction makes
+    a new block: batches of pre-signed zero payments, made unique by random
+    notes, are submitted without waiting until the target round is reached.
+    """
+    last_round = get_last_round(algod_client)
+    while last_round < target_round:
+        params = suggested_params(algod_client)
+        batch = [
+            PaymentTxn(
+                sender=account.address,
+                sp=params,
+                receiver=account.address,
+                amt=0,
+                note=b'fast-forward:' + os.urandom(8),
+            ).sign(account.private_key)
+            for _ in range(min(target_round - last_round, batch_size))
+        ]
+        for signed_txn in batch:
+            algod_client.send_transactions([signed_txn])
+
+        previous_round, last_round = last_round, get_last_round(algod_client)
+        if last_round == previous_round:
+            # Not in dev mode: blocks do not follow transactions
+            last_round = algod_client.status_after_block(
+                last_round)['last-round']
+
+
+def to_lsig(algod_client: algod.AlgodClient, teal, debug=False,
+            offline=True):
     if debug:  
         with open('/tmp/program.teal', 'w') as f:
             f.write(teal)
 
-    compiled = algod_client.compile(teal)
-    lsig = LogicSig(base64.decodebytes(compiled["result"].encode()))
+    lsig = LogicSig(compile_program(algod_client, teal, offline=offline))
     return Account(address=lsig.address(), lsig=lsig, private_key=None)
 
 
-def generate_blocks(algod_client: algod.AlgodClient, num_blocks: int, account: Account):
+def generate_blocks(algod_client: algod.AlgodClient, num_blocks: int,
+                    account: Account, fast=False):
+    if fast:
+        return fast_forward(
+            algod_client, account, get_last_round(algod_client) + num_blocks)
     for i in range(num_blocks):
         txn = PaymentTxn(
             sender=account.address,
-            sp=algod_client.suggested_params(),
+            sp=suggested_params(algod_client),
             receiver=account.address,
             amt=0,
         )
         sign_send_wait(algod_client, account, txn)
 
 
-def compile_program(algod_client: algod.AlgodClient, source_code):
+def teal_cache_key(source_code: str) -> str:
+    """Content address of a TEAL program: hash of its version and source."""
+    digest = hashlib.sha256()
+    digest.update(f"{teal_version(source_code)}\n".encode())
+    digest.update(source_code.encode())
+    return digest.hexdigest()
+
+
+def compile_program(algod_client: algod.AlgodClient, source_code,
+                    cache_dir=COMPILE_CACHE_DIR, offline=True):
+    """Compile TEAL to bytecode, offline when possible, else through algod
+    reusing the on-disk cache. Not `offline`, the bytecode is algod's, from
+    the cache or algod, whenever there is an algod client."""
+    if offline or algod_client is None:
+        try:
+            return assemble(source_code)
+        except TealAssemblyError:
+            if algod_client is None:
+                raise
+
+    cache_file = None
+    if cache_dir:
+        cache_file = os.path.join(cache_dir, teal_cache_key(source_code))
+        try:
+            with open(cache_file, 'rb') as f:
+                program = f.read()
+            if program:
+                return program
+        except OSError:
+            pass
+
     compile_response = algod_client.compile(source_code)
-    return base64.b64decode(compile_response["result"])
+    program = base64.b64decode(compile_response["result"])
 
+    if cache_file:
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            # A temporary file of its own: processes compiling the same
+            # program at once must not write over each other
+            with tempfile.NamedTemporaryFile(
+                    dir=cache_dir, delete=False) as f:
+                f.write(program)
+            os.replace(f.name, cache_file)
+        except OSError:
+            pass
+    return program
+
+
+def create_application(algod_client: algod.AlgodClient, creator: Account, debug=False,
+                       optimized=False, registry=False):
+
+    app_create_txn = application_create_txn(
+        algod_client, creator, suggested_params(algod_client),
+        optimized=optimized, registry=registry, debug=debug)
+
+    sign_send_wait(algod_client, creator, app_create_txn)
+    transaction_response = algod_client.pending_transaction_info(
+        app_create_txn.get_txid())
+    return transaction_response["application-index"]
 
-def create_application(algod_client: algod.AlgodClient, creator: Account, debug=False):
 
-    global_schema = StateSchema(GLOBAL_INTS, GLOBAL_BYTES)
-    local_schema = StateSchema(LOCAL_INTS, LOCAL_BYTES)
+def application_create_txn(algod_client: algod.AlgodClient, creator: Account,
+                           params: SuggestedParams, optimized=False,
+                           registry=False, debug=False):
+    """Staking dApp (or pool registry) creation transaction. Programs are
+    compiled by algod, so the deployed bytecode is its own: the offline
+    assembler is only a fallback, with no algod client."""
+    if registry:
+        global_schema = StateSchema(
+            REGISTRY_GLOBAL_INTS, REGISTRY_GLOBAL_BYTES)
+        local_schema = StateSchema(REGISTRY_LOCAL_INTS, REGISTRY_LOCAL_BYTES)
+    else:
+        global_schema = StateSchema(GLOBAL_INTS, GLOBAL_BYTES)
+        local_schema = StateSchema(LOCAL_INTS, LOCAL_BYTES)
 
-    approval_program_teal = withdrawal_approval()
-    approval_program = compile_program(algod_client, approval_program_teal)
+    if registry:
+        approval_program_teal = registry_approval_teal()
+    elif optimized:
+        approval_program_teal = withdrawal_approval_optimized()
+    else:
+        approval_program_teal = approval_teal()
+    approval_program = compile_program(
+        algod_client, approval_program_teal, offline=False)
     if debug:
         with open('/tmp/approval_program.teal', 'w') as f:
             f.write(approval_program_teal)
 
-    clear_program_teal = withdrawal_clear()
-    clear_program = compile_program(algod_client, clear_program_teal)
+    if optimized and not registry:
+        clear_program_teal = withdrawal_clear_optimized()
+    else:
+        clear_program_teal = clear_teal()
+    clear_program = compile_program(
+        algod_client, clear_program_teal, offline=False)
     if debug:
         with open('/tmp/clear_program.teal', 'w') as f:
             f.write(clear_program_teal)
 
     on_complete = OnComplete.NoOpOC
-    params = algod_client.suggested_params()
 
-    app_create_txn = ApplicationCreateTxn(
+    return ApplicationCreateTxn(
         sender=creator.address,
         sp=params,
         on_complete=on_complete,
@@ -410,12 +1438,9 @@ def create_application(algod_client: algod.AlgodClient, creator: Account, debug=
         local_schema=local_schema,
     )
 
-    transaction_response = sign_send_wait(algod_client, creator, app_create_txn)
-    return transaction_response["application-index"]
-
 
 def optin_to_asset(algod_client: algod.AlgodClient, account: Account, asa_id: int, note=None):
-    params = algod_client.suggested_params()
+    params = suggested_params(algod_client)
     optin_txn = AssetTransferTxn(
         sender=account.address,
         sp=params,
@@ -428,7 +1453,7 @@ def optin_to_asset(algod_client: algod.AlgodClient, account: Account, asa_id: in
 
 
 def optin_to_application(algod_client: algod.AlgodClient, account: Account, app_id: int):
-    params = algod_client.suggested_params()
+    params = suggested_params(algod_client)
     optin_txn = ApplicationOptInTxn(
         sender=account.address,
         sp=params,
@@ -441,168 +1466,921 @@ def asa_info(algod_client: algod.AlgodClient, asa_id: int):
     return algod_client.asset_info(asa_id)
 
 
-def info(algod_client: algod.AlgodClient, app_id: int):
+def _state_keys(*names: str) -> dict:
+    """Raw (base64) state keys, mapped to their names."""
+    return {base64.b64encode(name.encode()).decode(): name for name in names}
 
-    global_state = algod_client.application_info(app_id)['params']['global-state']
 
-    settings = {
-        'asa_id': next(int(item['value']['uint'])
-        for item in global_state if item['key'] == 'QXNzZXRJRA=='),
-        'escrow': next(encoding.encode_address(base64.b64decode(item['value']['bytes']))
-        for item in global_state if item['key'] == 'QXNzZXRFc2Nyb3c='),
-        'locking_blocks': next(int(item['value']['uint'])
-        for item in global_state if item['key'] == 'V2l0aGRyYXdhbFByb2Nlc3NpbmdSb3VuZHM='),
-        'bookable_funds': next(int(item['value']['uint'])
-        for item in global_state if item['key'] == 'V2l0aGRyYXdhbEJvb2thYmxlQW1vdW50'),
-    }
+APP_STATE_KEYS = _state_keys(
+    'Creator',
+    'AssetID',
+    'AssetEscrow',
+    'WithdrawalProcessingRounds',
+    'WithdrawalBookableAmount',
+)
 
-    asset = asa_info(algod_client, settings['asa_id'])
-    asset_decimals = asset['params']['decimals']
+BOOKING_STATE_KEYS = _state_keys(
+    'WithdrawalBookingRound',
+    'WithdrawalBookedAmount',
+)
 
-    summary = f"""
-    * ======================== STAKING dAPP SUMMARY ======================== *
+REGISTRY_STATE_KEYS = _state_keys(
+    'Creator',
+    'AssetEscrow',
+    'PoolCount',
+)
 
-       APP ID:\t{app_id}
-       ASA ID:\t{settings['asa_id']} (DECIMALS: {asset_decimals})
-       ESCROW:\t{settings['escrow']}
 
-       LOCKING BLOCKS:\t⏳ {settings['locking_blocks']}
-       BOOKABLE FUNDS:\t💰 {settings['bookable_funds'] / 10 ** asset_decimals}
+def _record_key(prefix: str, pool_id: int) -> str:
+    """Raw (base64) state key of a pool registry record."""
+    key = prefix.encode() + pool_id.to_bytes(8, 'big')
+    return base64.b64encode(key).decode()
 
-    * ====================================================================== *
-    """
-    return settings, summary
 
+def _decode_record(record: bytes, fields: tuple) -> dict:
+    """Decode the uint64 fields packed in a pool registry record."""
+    if len(record) != 8 * len(fields):
+        raise StakingStateError(f"Invalid record of {len(record)} bytes")
+    return {name: int.from_bytes(record[8 * i:8 * i + 8], 'big')
+            for i, name in enumerate(fields)}
 
-def status(algod_client: algod.AlgodClient, address: str, app_id: int):
 
-    local_state = algod_client.account_info(address)['apps-local-state']
+class StakingStateError(Exception):
+    """Application or account state is not a staking dApp state."""
 
-    settings, summary = info(algod_client, app_id)
 
-    booking_status = {}
-    for app in local_state:
-        if app['id'] == app_id:
-            booking_status = {
-                'amount': next(item['value']['uint']
-                    for item in app['key-value'] if item['key'] == 'V2l0aGRyYXdhbEJvb2tlZEFtb3VudA=='),
-                'round': next(item['value']['uint']
-                    for item in app['key-value'] if item['key'] == 'V2l0aGRyYXdhbEJvb2tpbmdSb3VuZA=='),
-            }
-    if booking_status:
-        remaning_rounds = settings['locking_blocks'] \
-            - (get_last_round(algod_client) - booking_status['round'])
+class PoolRegistryError(StakingStateError):
+    """A pool registry application used with no pool."""
 
-        if remaning_rounds > 0:
-            withdrawal_status = str(remaning_rounds) + ' BLOCKS 🔒⏳'
-        elif booking_status['amount'] > 0:
-            withdrawal_status = "Withdrawal ready! ️🔐⌛"
-        else:
-            withdrawal_status = "Withdrawal already executed! 🔓💸"
 
-        asset = asa_info(algod_client, settings['asa_id'])
-        asset_decimals = asset['params']['decimals']
+def decode_state(key_values: list, keys: dict) -> dict:
+    """Decode the known keys of a raw key-value state array in one pass."""
+    state = {}
+    for item in key_values:
+        name = keys.get(item['key'])
+        if name is not None:
+            value = item['value']
+            if value['type'] == 2:
+                state[name] = value['uint']
+            else:
+                state[name] = base64.b64decode(value.get('bytes', ''))
+    return state
 
-        booking_summary = f"""
-        * ======================= BOOKED STAKING SUMMARY ======================= *
 
-           APP ID:\t{app_id}
-           ASA ID:\t{settings['asa_id']} (DECIMALS: {asset_decimals})
+def _require_keys(state: dict, keys: dict, what: str):
+    missing = [name for name in keys.values() if name not in state]
+    if missing:
+        raise StakingStateError(f"{what} has no {', '.join(missing)}")
 
-           BOOKED AMOUNT:\t{booking_status['amount']  / 10 ** asset_decimals}
-           REMANING LOCK:\t{withdrawal_status}
 
-        * ====================================================================== *
-        """
+@dataclasses.dataclass
+class StakingAppState:
+    app_id: int
+    creator: str
+    asa_id: int
+    escrow: str
+    locking_blocks: int
+    bookable_funds: int
+    pool_id: int = None
+    reward_percent: int = 100
+    # Deployed approval program, when read from algod
+    approval_program: bytes = dataclasses.field(
+        default=None, repr=False, compare=False)
 
-        return booking_status, booking_summary
+    @classmethod
+    def from_global_state(cls, app_id: int, global_state: list):
+        state = decode_state(global_state, APP_STATE_KEYS)
+        if 'PoolCount' in decode_state(global_state, REGISTRY_STATE_KEYS):
+            raise PoolRegistryError(
+                f"App ID {app_id} is a pool registry: choose a --pool")
+        _require_keys(state, APP_STATE_KEYS,
+                      f"App ID {app_id} is not a staking dApp: global state")
+        return cls(
+            app_id=app_id,
+            creator=encoding.encode_address(state['Creator']),
+            asa_id=state['AssetID'],
+            escrow=encoding.encode_address(state['AssetEscrow']),
+            locking_blocks=state['WithdrawalProcessingRounds'],
+            bookable_funds=state['WithdrawalBookableAmount'],
+        )
 
-    else:
-        quit(f"\n⚠️  Account {address} not booked for App ID: {app_id}")
+    @classmethod
+    def from_pool_record(cls, app_id: int, pool_id: int, global_state: list):
+        keys = dict(REGISTRY_STATE_KEYS)
+        keys[_record_key('Pool', pool_id)] = 'Pool'
+        state = decode_state(global_state, keys)
+        if 'Pool' not in state:
+            raise StakingStateError(f"App ID {app_id} has no pool {pool_id}")
+        _require_keys(state, REGISTRY_STATE_KEYS,
+                      f"App ID {app_id} is not a pool registry: global state")
+        pool = _decode_record(state['Pool'], POOL_RECORD_FIELDS)
+        return cls(
+            app_id=app_id,
+            creator=encoding.encode_address(state['Creator']),
+            asa_id=pool['AssetID'],
+            escrow=encoding.encode_address(state['AssetEscrow']),
+            locking_blocks=pool['WithdrawalProcessingRounds'],
+            bookable_funds=pool['WithdrawalBookableAmount'],
+            pool_id=pool_id,
+            reward_percent=pool['RewardPercent'],
+        )
 
+    def app_args(self, method: bytes) -> list:
+        """Arguments of a staking call: pool calls name their pool."""
+        if self.pool_id is None:
+            return [method]
+        return [method, self.pool_id]
 
-def asa_staking_init(
-    algod_client: algod.AlgodClient,
-    creator: Account,
-    asa_id: int,
-    locking_blocks: int,
-    asa_funding_amount: int
-) -> int:
+    def reward(self, amount: int) -> int:
+        """Reward for a booked amount, reserved on the bookable funds."""
+        return amount * self.reward_percent // 100
 
-    app_id = create_application(algod_client, creator)
-    escrow = to_lsig(algod_client, withdrawal_escrow(app_id, asa_id))
-    print(f"[2/4] 🔐 Creating staking escrow {escrow.address}...")
-    fund(algod_client, creator, escrow, amount=300_000)
-    print(f"[3/4] 🗳  Staking escrow opt-in ASA {asa_id}...")
-    optin_to_asset(algod_client, escrow, asa_id)
 
-    params = algod_client.suggested_params()
-    set_escrow_txn = ApplicationNoOpTxn(
-        sender=creator.address,
-        sp=params,
-        index=app_id,
-        app_args=[encoding.decode_address(escrow.address), locking_blocks],
-    )
+@dataclasses.dataclass
+class StakingBooking:
+    app_id: int
+    round: int
+    amount: int
 
-    fund_escrow_txn = AssetTransferTxn(
-        sender=creator.address,
-        sp=params,
-        receiver=escrow.address,
-        amt=asa_funding_amount,
-        index=asa_id,
-    )
+    @classmethod
+    def from_local_state(cls, app_id: int, key_values: list,
+                         pool_id: int = None):
+        if pool_id is not None:
+            return cls.from_booking_record(app_id, key_values, pool_id)
+        state = decode_state(key_values, BOOKING_STATE_KEYS)
+        _require_keys(state, BOOKING_STATE_KEYS,
+                      f"App ID {app_id} local state")
+        return cls(
+            app_id=app_id,
+            round=state['WithdrawalBookingRound'],
+            amount=state['WithdrawalBookedAmount'],
+        )
 
-    signed_group = group_and_sign(
-        [creator, creator],
-        [set_escrow_txn, fund_escrow_txn],
-    )
+    @classmethod
+    def from_booking_record(cls, app_id: int, key_values: list,
+                            pool_id: int):
+        state = decode_state(key_values, {
+            _record_key('Booking', pool_id): 'Booking'})
+        if 'Booking' not in state:
+            raise StakingStateError(
+                f"App ID {app_id} local state has no pool {pool_id} booking")
+        booking = _decode_record(state['Booking'], BOOKING_RECORD_FIELDS)
+        return cls(
+            app_id=app_id,
+            round=booking['WithdrawalBookingRound'],
+            amount=booking['WithdrawalBookedAmount'],
+        )
 
-    print(f"[4/4] 💰 Funding staking escrow with {asa_funding_amount} of ASA {asa_id}...")
-    gtxn_id = algod_client.send_transactions(signed_group)
-    wait_for_confirmation(algod_client, gtxn_id)
-    return app_id
 
+def app_settings(algod_client: algod.AlgodClient, app_id: int,
+                 pool_id: int = None):
+    params = algod_client.application_info(app_id)['params']
+    global_state = params.get('global-state', [])
+    if pool_id is None:
+        settings = StakingAppState.from_global_state(app_id, global_state)
+    else:
+        settings = StakingAppState.from_pool_record(
+            app_id, pool_id, global_state)
+    settings.approval_program = base64.b64decode(params['approval-program'])
+    return settings
 
-def asa_stake_booking(
-    algod_client: algod.AlgodClient,
-    user: Account,
-    app_id: int,
-    booking_amount: int,
-):
-    settings, summary = info(algod_client, app_id)
 
-    if booking_amount > settings['bookable_funds']:
-        if settings['bookable_funds'] == 0:
-            quit("\n⚠️  No more funds availabe for booking!")
-        else:
-            quit(
-                f"\n⚠️  Only {settings['bookable_funds']} still available for "
+@dataclasses.dataclass
+class PoolRegistryState:
+    app_id: int
+    creator: str
+    escrow: str
+    pools: list
+
+    @classmethod
+    def from_global_state(cls, app_id: int, global_state: list):
+        state = decode_state(global_state, REGISTRY_STATE_KEYS)
+        _require_keys(state, REGISTRY_STATE_KEYS,
+                      f"App ID {app_id} is not a pool registry: global state")
+        return cls(
+            app_id=app_id,
+            creator=encoding.encode_address(state['Creator']),
+            escrow=encoding.encode_address(state['AssetEscrow']),
+            pools=[StakingAppState.from_pool_record(
+                app_id, pool_id, global_state)
+                for pool_id in range(state['PoolCount'])],
+        )
+
+
+def registry_info(algod_client: algod.AlgodClient, app_id: int):
+    global_state = algod_client.application_info(app_id)['params'].get(
+        'global-state', [])
+    registry = PoolRegistryState.from_global_state(app_id, global_state)
+
+    pools = '\n'.join(
+        f"       POOL {pool.pool_id}:\tASA {pool.asa_id}  "
+        f"⏳ {pool.locking_blocks}  🎁 {pool.reward_percent}%  "
+        f"💰 {pool.bookable_funds}"
+        for pool in registry.pools) or "       No pools yet."
+
+    summary = f"""
+    * ====================== STAKING POOLS REGISTRY ======================= *
+
+       APP ID:\t{app_id}
+       ESCROW:\t{registry.escrow}
+
+       POOLS (LOCKING BLOCKS, REWARD, BOOKABLE UNITS):
+{pools}
+
+    * ====================================================================== *
+    """
+    return registry, summary
+
+
+@dataclasses.dataclass
+class StakingSnapshot:
+    settings: StakingAppState
+    asset_decimals: int
+    last_round: int
+    booking: StakingBooking = None
+    # None if unknown
+    opted_in: bool = None
+
+
+def info(algod_client: algod.AlgodClient, app_id: int, pool_id: int = None,
+         snapshot: StakingSnapshot = None):
+
+    if snapshot is None:
+        settings = app_settings(algod_client, app_id, pool_id)
+        asset = asa_info(algod_client, settings.asa_id)
+        asset_decimals = asset['params']['decimals']
+    else:
+        settings = snapshot.settings
+        asset_decimals = snapshot.asset_decimals
+
+    summary = f"""
+    * ======================== STAKING dAPP SUMMARY ======================== *
+
+       APP ID:\t{app_id}{pool_line(settings)}
+       ASA ID:\t{settings.asa_id} (DECIMALS: {asset_decimals})
+       ESCROW:\t{settings.escrow}
+
+       LOCKING BLOCKS:\t⏳ {settings.locking_blocks}
+       REWARD:\t🎁 {settings.reward_percent}%
+       BOOKABLE FUNDS:\t💰 {settings.bookable_funds / 10 ** asset_decimals}
+
+    * ====================================================================== *
+    """
+    return settings, summary
+
+
+def pool_line(settings: StakingAppState, indent=' ' * 7) -> str:
+    """Summary line of the pool ID, for pool registry apps."""
+    if settings.pool_id is None:
+        return ''
+    return f"\n{indent}POOL ID:\t{settings.pool_id}"
+
+
+def account_booking(local_state: list, app_id: int, pool_id: int = None):
+    """The account booking for App ID (and pool), if any, from its apps
+    local state."""
+    for app in local_state:
+        if app['id'] == app_id:
+            try:
+                return StakingBooking.from_local_state(
+                    app_id, app.get('key-value', []), pool_id)
+            except StakingStateError:
+                # Opted in, never booked
+                return None
+    return None
+
+
+def staking_snapshot(algod_client: algod.AlgodClient, address: str,
+                     app_id: int, pool_id: int = None,
+                     last_round: int = None) -> StakingSnapshot:
+    """Fetch app, asset, account and last round concurrently: only the asset
+    lookup has to wait, for the app state. A known last round (e.g. of the
+    suggested params) saves its lookup."""
+    with ThreadPoolExecutor(2) as executor:
+        account_info = executor.submit(algod_client.account_info, address)
+        if last_round is None:
+            last_round = executor.submit(get_last_round, algod_client)
+        settings = app_settings(algod_client, app_id, pool_id)
+        asset = asa_info(algod_client, settings.asa_id)
+
+    if isinstance(last_round, Future):
+        last_round = last_round.result()
+    local_state = account_info.result()['apps-local-state']
+    return StakingSnapshot(
+        settings=settings,
+        asset_decimals=asset['params']['decimals'],
+        last_round=last_round,
+        booking=account_booking(local_state, app_id, pool_id),
+        opted_in=any(app['id'] == app_id for app in local_state),
+    )
+
+
+def status(algod_client: algod.AlgodClient, address: str, app_id: int,
+           snapshot: StakingSnapshot = None, pool_id: int = None):
+
+    if snapshot is None:
+        snapshot = staking_snapshot(algod_client, address, app_id, pool_id)
+    settings = snapshot.settings
+    booking_status = snapshot.booking
+
+    if booking_status:
+        remaning_rounds = remaining_lock(
+            settings, booking_status, snapshot.last_round)
+
+        if remaning_rounds > 0:
+            withdrawal_status = str(remaning_rounds) + ' BLOCKS 🔒⏳'
+        elif booking_status.amount > 0:
+            withdrawal_status = "Withdrawal ready! ️🔐⌛"
+        else:
+            withdrawal_status = "Withdrawal already executed! 🔓💸"
+
+        asset_decimals = snapshot.asset_decimals
+
+        booking_summary = f"""
+        * ======================= BOOKED STAKING SUMMARY ======================= *
+
+           APP ID:\t{app_id}{pool_line(settings, ' ' * 11)}
+           ASA ID:\t{settings.asa_id} (DECIMALS: {asset_decimals})
+
+           BOOKED AMOUNT:\t{booking_status.amount  / 10 ** asset_decimals}
+           REMANING LOCK:\t{withdrawal_status}
+
+        * ====================================================================== *
+        """
+
+        return booking_status, booking_summary
+
+    else:
+        pool = '' if pool_id is None else f" pool {pool_id}"
+        quit(f"\n⚠️  Account {address} not booked for App ID: {app_id}{pool}")
+
+
+def remaining_lock(settings: StakingAppState, booking: StakingBooking,
+                   last_round: int) -> int:
+    return settings.locking_blocks - (last_round - booking.round)
+
+
+def watch(algod_client: algod.AlgodClient, snapshot: StakingSnapshot):
+    """Follow the blocks until the booking of the snapshot unlocks, with no
+    further state reads: one long-poll per round. Yields the last round and
+    the blocks left, down to 0 once a withdrawal would be confirmed in the
+    unlock round (i.e. the next one)."""
+    unlock_round = snapshot.booking.round + snapshot.settings.locking_blocks
+    last_round = snapshot.last_round
+    while True:
+        blocks_left = max(unlock_round - (last_round + 1), 0)
+        yield last_round, blocks_left
+        if not blocks_left:
+            return
+        last_round = algod_client.status_after_block(
+            last_round)['last-round']
+        params_cache(algod_client).observe_round(last_round)
+
+
+def app_local_states(indexer_client: indexer.IndexerClient, app_id: int,
+                     page_size=INDEXER_PAGE_SIZE):
+    """Stream (address, apps local state, round) for the accounts opted in
+    App ID, following the Indexer pages: one page at a time is held in
+    memory."""
+    next_page = None
+    while True:
+        page = indexer_client.accounts(
+            application_id=app_id, limit=page_size, next_page=next_page)
+        for staker in page['accounts']:
+            yield (
+                staker['address'],
+                staker.get('apps-local-state', []),
+                page['current-round'],
+            )
+        next_page = page.get('next-token')
+        if not next_page or not page['accounts']:
+            break
+
+
+def app_stakers(indexer_client: indexer.IndexerClient, app_id: int,
+                page_size=INDEXER_PAGE_SIZE, pool_id: int = None):
+    """Stream (address, booking, round) for the accounts opted in App ID."""
+    for address, local_state, current_round in app_local_states(
+            indexer_client, app_id, page_size):
+        yield (
+            address,
+            account_booking(local_state, app_id, pool_id),
+            current_round,
+        )
+
+
+def status_all(algod_client: algod.AlgodClient,
+               indexer_client: indexer.IndexerClient, app_id: int,
+               pool_id: int = None):
+    """Staking status of every account in App ID (or in one of its pools),
+    as JSONL ready dicts."""
+    settings = app_settings(algod_client, app_id, pool_id)
+    for address, booking, last_round in app_stakers(
+            indexer_client, app_id, pool_id=pool_id):
+        row = {
+            'address': address,
+            'app_id': app_id,
+            'booked_amount': None,
+            'booking_round': None,
+            'remaining_blocks': None,
+            'status': 'not-booked',
+        }
+        if pool_id is not None:
+            row['pool_id'] = pool_id
+        if booking:
+            remaining_blocks = remaining_lock(settings, booking, last_round)
+            row.update({
+                'booked_amount': booking.amount,
+                'booking_round': booking.round,
+                'remaining_blocks': max(remaining_blocks, 0),
+            })
+            if remaining_blocks > 0:
+                row['status'] = 'locked'
+            elif booking.amount > 0:
+                row['status'] = 'ready'
+            else:
+                row['status'] = 'withdrawn'
+        yield row
+
+
+def asa_staking_init(
+    algod_client: algod.AlgodClient,
+    creator: Account,
+    asa_id: int,
+    locking_blocks: int,
+    asa_funding_amount: int,
+    optimized=False,
+) -> int:
+
+    with METRICS.phase('init_create_app'):
+        app_id = create_application(
+            algod_client, creator, optimized=optimized)
+    escrow, (escrow_funding, escrow_optin, escrow_setup) = setup_groups(
+        algod_client, suggested_params(algod_client), creator, app_id,
+        asa_id, locking_blocks, asa_funding_amount)
+    print(f"[2/4] 🔐 Creating staking escrow {escrow.address}...")
+    with METRICS.phase('init_create_escrow'):
+        send_wait(algod_client, escrow_funding)
+    print(f"[3/4] 🗳  Staking escrow opt-in ASA {asa_id}...")
+    with METRICS.phase('init_escrow_optin'):
+        send_wait(algod_client, escrow_optin)
+
+    print(f"[4/4] 💰 Funding staking escrow with {asa_funding_amount} of ASA {asa_id}...")
+    with METRICS.phase('init_fund_escrow'):
+        send_wait(algod_client, escrow_setup)
+    return app_id
+
+
+def setup_groups(
+    algod_client: algod.AlgodClient,
+    params: SuggestedParams,
+    creator: Account,
+    app_id: int,
+    asa_id: int,
+    locking_blocks: int,
+    asa_funding_amount: int,
+):
+    """Staking escrow, and the signed groups setting up the dApp, to submit
+    in order: escrow funding, escrow opt-in, Setup call + ASA funding."""
+    escrow = to_lsig(algod_client, escrow_teal(app_id, asa_id), offline=False)
+
+    escrow_funding_txn = PaymentTxn(
+        creator.address, params, escrow.address, 300_000)
+
+    escrow_optin_txn = AssetTransferTxn(
+        sender=escrow.address,
+        sp=params,
+        receiver=escrow.address,
+        amt=0,
+        index=asa_id,
+    )
+
+    set_escrow_txn = ApplicationNoOpTxn(
+        sender=creator.address,
+        sp=params,
+        index=app_id,
+        app_args=[encoding.decode_address(escrow.address), locking_blocks],
+    )
+
+    fund_escrow_txn = AssetTransferTxn(
+        sender=creator.address,
+        sp=params,
+        receiver=escrow.address,
+        amt=asa_funding_amount,
+        index=asa_id,
+    )
+
+    return escrow, [
+        [sign(creator, escrow_funding_txn)],
+        [sign(escrow, escrow_optin_txn)],
+        group_and_sign([creator, creator], [set_escrow_txn, fund_escrow_txn]),
+    ]
+
+
+def pool_registry_init(
+    algod_client: algod.AlgodClient,
+    creator: Account,
+) -> int:
+
+    with METRICS.phase('registry_create_app'):
+        app_id = create_application(algod_client, creator, registry=True)
+    escrow = to_lsig(
+        algod_client, registry_escrow_teal(app_id), offline=False)
+    print(f"[2/3] 🔐 Creating registry escrow {escrow.address}...")
+    with METRICS.phase('registry_create_escrow'):
+        fund(algod_client, creator, escrow, amount=REGISTRY_ESCROW_ALGOS)
+
+    print(f"[3/3] 📝 Setting up pool registry {app_id}...")
+    with METRICS.phase('registry_setup'):
+        sign_send_wait(algod_client, creator, ApplicationNoOpTxn(
+            sender=creator.address,
+            sp=suggested_params(algod_client),
+            index=app_id,
+            app_args=[b'Setup', encoding.decode_address(escrow.address)],
+        ))
+    return app_id
+
+
+def pool_registry_add_pool(
+    algod_client: algod.AlgodClient,
+    creator: Account,
+    app_id: int,
+    asa_id: int,
+    locking_blocks: int,
+    reward_percent: int,
+    asa_funding_amount: int,
+) -> int:
+
+    registry, summary = registry_info(algod_client, app_id)
+    escrow = to_lsig(algod_client, registry_escrow_teal(app_id))
+    if escrow.address != registry.escrow:
+        quit(f"\n⚠️  Unable to rebuild the escrow of registry {app_id}!\n")
+    pool_id = len(registry.pools)
+
+    escrow_assets = algod_client.account_info(escrow.address)['assets']
+    if all(asset['asset-id'] != asa_id for asset in escrow_assets):
+        print(f"[1/3] 🗳  Registry escrow opt-in ASA {asa_id}...")
+        fund(algod_client, creator, escrow, amount=ESCROW_ASSET_ALGOS)
+        params = suggested_params(algod_client)
+        send_wait(algod_client, group_and_sign([creator, escrow], [
+            ApplicationNoOpTxn(
+                sender=creator.address,
+                sp=params,
+                index=app_id,
+                app_args=[b'AssetOptIn'],
+            ),
+            AssetTransferTxn(
+                sender=escrow.address,
+                sp=params,
+                receiver=escrow.address,
+                amt=0,
+                index=asa_id,
+            ),
+        ]))
+    else:
+        print(f"[1/3] 🗳  Registry escrow already holds ASA {asa_id}")
+
+    print(f"[2/3] ⏳ Adding pool {pool_id}: {locking_blocks} locking blocks, "
+          f"{reward_percent}% reward...")
+    params = suggested_params(algod_client)
+    signed_group = group_and_sign([creator, creator], [
+        ApplicationNoOpTxn(
+            sender=creator.address,
+            sp=params,
+            index=app_id,
+            app_args=[b'AddPool', locking_blocks, reward_percent],
+        ),
+        AssetTransferTxn(
+            sender=creator.address,
+            sp=params,
+            receiver=escrow.address,
+            amt=asa_funding_amount,
+            index=asa_id,
+        ),
+    ])
+
+    print(f"[3/3] 💰 Funding pool {pool_id} with {asa_funding_amount} of ASA {asa_id}...")
+    send_wait(algod_client, signed_group)
+    return pool_id
+
+
+def pool_registry_fund_pool(
+    algod_client: algod.AlgodClient,
+    creator: Account,
+    app_id: int,
+    pool_id: int,
+    asa_funding_amount: int,
+):
+    settings = app_settings(algod_client, app_id, pool_id)
+    params = suggested_params(algod_client)
+    signed_group = group_and_sign([creator, creator], [
+        ApplicationNoOpTxn(
+            sender=creator.address,
+            sp=params,
+            index=app_id,
+            app_args=settings.app_args(b'FundPool'),
+        ),
+        AssetTransferTxn(
+            sender=creator.address,
+            sp=params,
+            receiver=settings.escrow,
+            amt=asa_funding_amount,
+            index=settings.asa_id,
+        ),
+    ])
+    send_wait(algod_client, signed_group)
+
+
+def asa_stake_booking(
+    algod_client: algod.AlgodClient,
+    user: Account,
+    app_id: int,
+    booking_amount: int,
+    pool_id: int = None,
+):
+    params = suggested_params(algod_client)
+    snapshot = staking_snapshot(algod_client, user.address, app_id, pool_id,
+                                last_round=params.first)
+    settings = snapshot.settings
+
+    if settings.reward(booking_amount) > settings.bookable_funds:
+        if settings.bookable_funds == 0:
+            quit("\n⚠️  No more funds availabe for booking!")
+        else:
+            quit(
+                f"\n⚠️  Only {settings.bookable_funds} still available for "
                 f"booking!")
 
-    params = algod_client.suggested_params()
+    signed_group = booking_group(
+        params, user, app_id, settings, booking_amount)
+
+    try:
+        prevalidate_group(snapshot, signed_group)
+    except GroupRejectedError as e:
+        quit(f"\n⚠️  Booking rejected: {e}!\n")
+
+    try:
+        with METRICS.phase('booking_submit'):
+            send_wait(algod_client, signed_group)
+    except (AlgodHTTPError, TransactionRejectedError,
+            ConfirmationTimeoutError) as e:
+        quit(f"\n⚠️  Booking rejected: {e}!\n")
 
+
+def booking_group(
+    params: SuggestedParams,
+    user: Account,
+    app_id: int,
+    settings: StakingAppState,
+    booking_amount: int,
+):
+    """Build and sign the Booking call + deposit group."""
+    return group_and_sign(*booking_txns(
+        params, user, app_id, settings, booking_amount))
+
+
+def booking_txns(
+    params: SuggestedParams,
+    user: Account,
+    app_id: int,
+    settings: StakingAppState,
+    booking_amount: int,
+):
+    """Signers and transactions of the Booking call + deposit group."""
     booking_call_txn = ApplicationNoOpTxn(
         sender=user.address,
         sp=params,
         index=app_id,
-        app_args=[b'Booking'],
+        app_args=settings.app_args(b'Booking'),
     )
 
     deposit_txn = AssetTransferTxn(
         sender=user.address,
         sp=params,
-        receiver=settings['escrow'],
+        receiver=settings.escrow,
         amt=booking_amount,
-        index=settings['asa_id'],
+        index=settings.asa_id,
     )
 
-    signed_group = group_and_sign(
-        [user, user],
-        [booking_call_txn, deposit_txn],
-    )
+    return [user, user], [booking_call_txn, deposit_txn]
+
+
+@dataclasses.dataclass
+class BookingBatchRow:
+    line: int
+    user: Account = None
+    app_id: int = None
+    amount: int = None
+    pool_id: int = None
+    signed_group: list = None
+    tx_id: str = None
+    confirmed_round: int = None
+    error: str = None
+
+
+class SecretError(ValueError):
+    """Invalid mnemonic or keyfile. The message never quotes the secret."""
+
+
+def account_from_secret(secret: str) -> Account:
+    """Account from a 25 words mnemonic, or from a keyfile storing it."""
+    secret = secret.strip()
+    if os.path.isfile(secret):
+        try:
+            with open(secret) as f:
+                secret = f.read().strip()
+        except OSError:
+            raise SecretError("Unable to read the keyfile") from None
+    words = secret.split()
+    if len(words) != 25:
+        raise SecretError(
+            f"Neither a keyfile nor a 25 words mnemonic ({len(words)} words)")
+    try:
+        private_key = mnemonic.to_private_key(' '.join(words))
+    except Exception:
+        # algosdk errors may quote the words: not even chained
+        private_key = None
+    if private_key is None:
+        raise SecretError("Invalid mnemonic")
+    return Account(account.address_from_private_key(private_key), private_key)
+
+
+def read_batch_records(batch_file: str) -> list[dict]:
+    """Records of a CSV (with header) or JSONL batch file."""
+    with open(batch_file, newline='') as f:
+        if batch_file.endswith('.jsonl'):
+            return [json.loads(line) for line in f if line.strip()]
+        return list(csv.DictReader(f))
+
+
+def read_booking_batch(batch_file: str) -> list[BookingBatchRow]:
+    """Read booking rows from a CSV (with header) or JSONL file, with fields:
+    `mnemonic` or `keyfile`, `app_id`, `amount` and, for pool registries,
+    `pool`."""
+    rows = []
+    for line, record in enumerate(read_batch_records(batch_file), start=1):
+        row = BookingBatchRow(line)
+        try:
+            row.user = account_from_secret(
+                record.get('mnemonic') or record['keyfile'])
+            row.app_id = int(record['app_id'])
+            row.amount = int(record['amount'])
+            if record.get('pool') not in (None, ''):
+                row.pool_id = int(record['pool'])
+        except SecretError as e:
+            row.error = f"Invalid row: {e}"
+        except (KeyError, ValueError, OSError, TypeError) as e:
+            row.error = f"Invalid row: {e!r}"
+        rows.append(row)
+    return rows
+
+
+def asa_stake_booking_batch(
+    algod_client: algod.AlgodClient,
+    rows: list[BookingBatchRow],
+) -> list[BookingBatchRow]:
+    """Book and deposit for many accounts: all the groups are built and
+    signed up front, submitted concurrently and confirmed together."""
+    # Apps, or pools of a registry app, by (app_id, pool_id)
+    apps = {}
+    for pool in {(row.app_id, row.pool_id) for row in rows if not row.error}:
+        try:
+            apps[pool], summary = info(algod_client, *pool)
+        except (AlgodHTTPError, StakingStateError):
+            pass
+
+    params = suggested_params(algod_client)
+    bookable_funds = {
+        pool: settings.bookable_funds for pool, settings in apps.items()
+    }
+    booked = set()
+    unsigned = []
+    for row in rows:
+        if row.error:
+            continue
+        pool = (row.app_id, row.pool_id)
+        if pool not in apps:
+            row.error = f"App ID {row.app_id} is not a staking dApp"
+            if row.pool_id is not None:
+                row.error = f"App ID {row.app_id} has no pool {row.pool_id}"
+        elif (row.user.address, pool) in booked:
+            row.error = "Duplicate booking in batch"
+        elif apps[pool].reward(row.amount) > bookable_funds[pool]:
+            row.error = (f"Only {bookable_funds[pool]} still "
+                         f"available for booking")
+        else:
+            bookable_funds[pool] -= apps[pool].reward(row.amount)
+            booked.add((row.user.address, pool))
+            unsigned.append((row, booking_txns(
+                params, row.user, row.app_id, apps[pool], row.amount)))
+
+    with METRICS.phase('batch_sign'):
+        signed_groups = sign_groups(group for row, group in unsigned)
+    for (row, group), signed_group in zip(unsigned, signed_groups):
+        row.signed_group = signed_group
+
+    tracker = ConfirmationTracker(algod_client)
+
+    def submit(row: BookingBatchRow):
+        # Any failure, not only an algod rejection, is the row's own: raised,
+        # it would abort the batch with the other rows left unconfirmed
+        try:
+            row.tx_id = algod_client.send_transactions(row.signed_group)
+        except Exception as e:
+            row.error = str(e) or repr(e)
+            return
+
+        def confirmed(confirmation: Future):
+            if confirmation.exception():
+                row.error = str(confirmation.exception())
+            else:
+                row.confirmed_round = confirmation.result()['confirmed-round']
+
+        tracker.track_signed(row.signed_group[0], callback=confirmed)
+
+    with ThreadPoolExecutor(MAX_SUBMIT_WORKERS) as executor:
+        list(executor.map(submit, [row for row in rows if row.signed_group]))
+
+    tracker.wait()
+    return rows
+
+
+def escrow_account(
+    algod_client: algod.AlgodClient,
+    indexer_client: indexer.IndexerClient,
+    settings: StakingAppState,
+    cache_dir=ESCROW_CACHE_DIR,
+) -> Account:
+    """Staking dApp escrow LogicSig account.
+
+    The escrow is regenerated from escrow_teal(app_id, asa_id) and
+    checked against the AssetEscrow address of the app. The Indexer history
+    is searched only on a mismatch (e.g. escrow compiled by another PyTeal
+    version). Escrow programs are cached on disk by address.
+    """
+    escrow = cached_escrow(settings.escrow, cache_dir)
+    if escrow:
+        return escrow
+
+    if settings.pool_id is None:
+        teal = escrow_teal(settings.app_id, settings.asa_id)
+    else:
+        teal = registry_escrow_teal(settings.app_id)
+    escrow = to_lsig(algod_client, teal)
+    if escrow.address != settings.escrow:
+        escrow = indexer_escrow(indexer_client, settings)
 
-    gtxn_id = algod_client.send_transactions(signed_group)
-    wait_for_confirmation(algod_client, gtxn_id)
+    if cache_dir:
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            with open(os.path.join(cache_dir, escrow.address), 'wb') as f:
+                f.write(escrow.lsig.logic)
+        except OSError:
+            pass
+    return escrow
+
+
+def cached_escrow(address: str, cache_dir=ESCROW_CACHE_DIR):
+    """The cached escrow account for address, if its program matches it."""
+    if not cache_dir:
+        return None
+    try:
+        with open(os.path.join(cache_dir, address), 'rb') as f:
+            lsig = LogicSig(f.read())
+    except OSError:
+        return None
+    if lsig.address() != address:
+        return None
+    return Account(address=address, private_key=None, lsig=lsig)
+
+
+def indexer_escrow(indexer_client: indexer.IndexerClient,
+                   settings: StakingAppState) -> Account:
+    """Escrow LogicSig account found in the escrow transactions history.
+    Raises StakingStateError if it is not found, so that long running
+    commands (e.g. scheduler) can retry."""
+    try:
+        escrow_txns = indexer_client.search_transactions_by_address(
+            address=settings.escrow,
+            asset_id=settings.asa_id,
+        )['transactions']
+    except IndexerHTTPError as e:
+        raise StakingStateError(
+            "Unable to connect to Indexer Client. Check your API token") from e
+
+    lsig = next((txn['signature']['logicsig']['logic']
+                 for txn in escrow_txns if txn['sender'] == settings.escrow),
+                None)
+    if lsig is None:
+        raise StakingStateError(
+            f"No escrow program found in the transactions of "
+            f"{settings.escrow}")
+
+    return Account(
+        address=settings.escrow,
+        private_key=None,
+        lsig=LogicSig(base64.decodebytes(lsig.encode()))
+    )
 
 
 def asa_stake_withdrawal(
@@ -610,85 +2388,1765 @@ def asa_stake_withdrawal(
     indexer_client: indexer.IndexerClient,
     user: Account,
     app_id: int,
+    pool_id: int = None,
 ):
-    settings, summary = info(algod_client, app_id)
-    bookink_status, booking_summary = status(algod_client, user.address, app_id)
+    snapshot = staking_snapshot(algod_client, user.address, app_id, pool_id)
+    settings = snapshot.settings
+    bookink_status, booking_summary = status(
+        algod_client, user.address, app_id, snapshot, pool_id)
+    withdrawal_amount = bookink_status.amount + settings.reward(
+        bookink_status.amount)
 
-    attempts = 1
-    escrow_txns = None
-    while attempts <= MAX_CONNECTION_ATTEMPTS:
-        try:
-            escrow_txns = indexer_client.search_transactions_by_address(
-                address=settings['escrow'],
-                asset_id=settings['asa_id'],
-            )['transactions']
-            break
-        except IndexerHTTPError:
-            print(f'Indexer Client connection attempt '
-                  f'{attempts}/{MAX_CONNECTION_ATTEMPTS}')
-            print('Trying to contact Indexer Client again...')
-            time.sleep(CONNECTION_ATTEMPT_DELAY_SEC)
-        finally:
-            attempts += 1
-    if not escrow_txns:
-        quit("❌ Unable to connect to Indexer Client. Check your API token!")
+    escrow = escrow_account(algod_client, indexer_client, settings)
 
-    lsig = (next(txn['signature']['logicsig']['logic']
-               for txn in escrow_txns if txn['sender'] == settings['escrow']))
+    signed_group = withdrawal_group(
+        suggested_params(algod_client), user, escrow, settings,
+        withdrawal_amount)
 
-    escrow = Account(
-        address=settings['escrow'],
-        private_key=None,
-        lsig=LogicSig(base64.decodebytes(lsig.encode()))
-    )
+    try:
+        prevalidate_group(snapshot, signed_group, escrow)
+    except GroupRejectedError as e:
+        quit(f"\n⚠️  Withdrawal denied: {e}!\n")
+
+    try:
+        with METRICS.phase('withdrawal_confirm'):
+            send_wait(algod_client, signed_group)
+    except (AlgodHTTPError, TransactionRejectedError,
+            ConfirmationTimeoutError):
+        quit("\n⚠️  Withdrawal denied! Check your withdrawl status (--help).\n")
+    print(f"\n🎉  Withdrawal completed: {withdrawal_amount}"
+          f" units of ASA ID: {settings.asa_id}\n")
+
+
+def withdrawal_group(
+    params: SuggestedParams,
+    user: Account,
+    escrow: Account,
+    settings: StakingAppState,
+    withdrawal_amount: int,
+):
+    """Build and sign the Withdrawal call + payout group."""
+    return group_and_sign(*withdrawal_txns(
+        params, user, escrow, settings, withdrawal_amount))
 
-    params = algod_client.suggested_params()
 
+def withdrawal_txns(
+    params: SuggestedParams,
+    user: Account,
+    escrow: Account,
+    settings: StakingAppState,
+    withdrawal_amount: int,
+):
+    """Signers and transactions of the Withdrawal call + payout group."""
     withdrawal_call_txn = ApplicationNoOpTxn(
         sender=user.address,
         sp=params,
-        index=app_id,
-        app_args=[b'Withdrawal'],
+        index=settings.app_id,
+        app_args=settings.app_args(b'Withdrawal'),
     )
 
     withdrawal_txn = AssetTransferTxn(
-        sender=settings['escrow'],
+        sender=settings.escrow,
         sp=params,
         receiver=user.address,
-        amt=int(bookink_status['amount'] * 2),
-        index=settings['asa_id'],
+        amt=withdrawal_amount,
+        index=settings.asa_id,
     )
 
-    signed_group = group_and_sign(
-        [user, escrow],
-        [withdrawal_call_txn, withdrawal_txn],
-    )
+    return [user, escrow], [withdrawal_call_txn, withdrawal_txn]
 
+
+# --- Parallel signing
+def _sign_groups_chunk(groups: list) -> list:
+    return [group_and_sign(signers, txns) for signers, txns in groups]
+
+
+def sign_groups(groups: list, workers: int = SIGNING_WORKERS) -> list:
+    """Group and sign many (signers, transactions) groups, in order.
+
+    Large batches are spread in chunks over a process pool: ed25519
+    signatures and the msgpack encodings behind the group IDs and the
+    signed bytes are CPU bound. Signing is deterministic, so the signed
+    groups are the same as group_and_sign ones, and the group IDs are set
+    on the given transactions as well. Keys only reach the workers, through
+    their pipes.
+    """
+    groups = list(groups)
+    if workers <= 1 or len(groups) < SIGNING_MIN_PARALLEL_GROUPS:
+        return _sign_groups_chunk(groups)
+
+    chunk_size = -(-len(groups) // (workers * SIGNING_CHUNKS_PER_WORKER))
+    chunks = [groups[i:i + chunk_size]
+              for i in range(0, len(groups), chunk_size)]
+    with ProcessPoolExecutor(workers) as executor:
+        signed_groups = [signed_group
+                         for signed_chunk in executor.map(
+                             _sign_groups_chunk, chunks)
+                         for signed_group in signed_chunk]
+
+    for (signers, txns), signed_group in zip(groups, signed_groups):
+        for txn, signed_txn in zip(txns, signed_group):
+            txn.group = signed_txn.transaction.group
+    return signed_groups
+
+
+# --- Pre-validation
+class GroupRejectedError(Exception):
+    """A staking group would be rejected: `condition` names the first
+    failing condition."""
+
+    def __init__(self, condition: str, message: str):
+        super().__init__(f"{message} ({condition})")
+        self.condition = condition
+
+
+def check_staking_group(snapshot: StakingSnapshot, group: list,
+                        round_num: int):
+    """Check a Booking or Withdrawal group (msgpack decoded transactions)
+    against the named conditions of the approval and escrow programs, on
+    the snapshot state at round_num."""
+    settings, booking = snapshot.settings, snapshot.booking
+    registry = settings.pool_id is not None
+    escrow = encoding.decode_address(settings.escrow)
+
+    def require(condition: str, holds: bool, message: str):
+        if not holds:
+            raise GroupRejectedError(condition, message)
+
+    require('group_size', len(group) == 2,
+            f"Group of {len(group)} transactions, not 2")
+    call, xfer = group
+    require('app_call', call.get('type') == 'appl'
+            and call.get('apid') == settings.app_id
+            and call.get('apan', OnComplete.NoOpOC) == OnComplete.NoOpOC,
+            f"First transaction is not a NoOp call to App ID "
+            f"{settings.app_id}")
+    args = call.get('apaa', [])
+    method = args[0] if args else b''
+    require('method', method in (b'Booking', b'Withdrawal'),
+            f"Call method {method!r} is not Booking or Withdrawal")
+    if registry:
+        require('pool', len(args) > 1 and _btoi(args[1]) == settings.pool_id,
+                f"Call does not name pool {settings.pool_id}")
+    require('opted_in', snapshot.opted_in is not False,
+            f"Account not opted in App ID {settings.app_id}: join it first")
+    require('asset_transfer', xfer.get('type') == 'axfer',
+            "Second transaction is not an asset transfer")
+    require('asset_id', xfer.get('xaid', 0) == settings.asa_id,
+            f"Transfer of ASA {xfer.get('xaid', 0)}, not of ASA "
+            f"{settings.asa_id}")
+    amount = xfer.get('aamt', 0)
+
+    if method == b'Booking':
+        require('not_booked', booking is None
+                or (not registry and booking.round == 0),
+                f"Already booked {booking and booking.amount} units at "
+                f"round {booking and booking.round}")
+        require('deposit_sender', xfer.get('snd') == call.get('snd'),
+                "Deposit not sent by the caller")
+        require('deposit_receiver', xfer.get('arcv') == escrow,
+                f"Deposit not sent to the escrow {settings.escrow}")
+        if registry:
+            require('deposit_amount', amount > 0, "Deposit of 0 units")
+        require('bookable_funds',
+                settings.reward(amount) <= settings.bookable_funds,
+                f"Reward of {settings.reward(amount)} units over the "
+                f"{settings.bookable_funds} bookable")
+        return
+
+    require('booked', booking is not None and booking.round > 0
+            and booking.amount > 0, "Not booked, or already withdrawn")
+    unlock_round = booking.round + settings.locking_blocks
+    require('lock_expired', round_num >= unlock_round,
+            f"Locked until round {unlock_round}: "
+            f"{unlock_round - round_num} blocks left")
+    require('payout_sender', xfer.get('snd') == escrow,
+            f"Payout not sent by the escrow {settings.escrow}")
+    expected = booking.amount + settings.reward(booking.amount)
+    require('payout_amount', amount == expected,
+            f"Payout of {amount} units, not {expected}")
+    require('escrow_fee', xfer.get('fee', 0) <= 1000,
+            f"Payout fee {xfer.get('fee', 0)} over 1000 microALGO")
+    require('escrow_close', not xfer.get('aclose'),
+            "Payout closes the escrow ASA holding")
+    require('escrow_rekey', not xfer.get('rekey'), "Payout rekeys the escrow")
+
+
+class SnapshotLedger:
+    """Ledger view of eval_teal rebuilt from a StakingSnapshot: the app
+    global state and the caller local state."""
+
+    def __init__(self, snapshot: StakingSnapshot, address: bytes,
+                 round_num: int):
+        settings, booking = snapshot.settings, snapshot.booking
+        self.round = round_num
+        self.timestamp = int(time.time())
+        self.address = address
+        self.app_id = settings.app_id
+        self.creator = encoding.decode_address(settings.creator)
+        self.opted_in_app = snapshot.opted_in is not False
+        self.global_state = {
+            b'Creator': self.creator,
+            b'AssetEscrow': encoding.decode_address(settings.escrow),
+        }
+        self.local_state = {}
+        if settings.pool_id is None:
+            self.global_state.update({
+                b'AssetID': settings.asa_id,
+                b'WithdrawalProcessingRounds': settings.locking_blocks,
+                b'WithdrawalBookableAmount': settings.bookable_funds,
+            })
+            if booking:
+                self.local_state = {
+                    b'WithdrawalBookingRound': booking.round,
+                    b'WithdrawalBookedAmount': booking.amount,
+                }
+        else:
+            pool_id = settings.pool_id.to_bytes(8, 'big')
+            # Pools up to this one exist, at least
+            self.global_state[b'PoolCount'] = settings.pool_id + 1
+            self.global_state[b'Pool' + pool_id] = b''.join(
+                value.to_bytes(8, 'big') for value in (
+                    settings.asa_id, settings.locking_blocks,
+                    settings.reward_percent, settings.bookable_funds))
+            if booking:
+                self.local_state[b'Booking' + pool_id] = (
+                    booking.round.to_bytes(8, 'big')
+                    + booking.amount.to_bytes(8, 'big'))
+
+    def app_creator(self, app_id: int) -> bytes:
+        return self.creator
+
+    def opted_in(self, address: bytes, app_id: int) -> bool:
+        return (address, app_id) == (self.address, self.app_id) and \
+            self.opted_in_app
+
+    def local_get(self, address: bytes, app_id: int, key: bytes):
+        if not self.opted_in(address, app_id):
+            raise TealReject(f"{encoding.encode_address(address)} is not "
+                             f"opted in to application {app_id}")
+        return self.local_state.get(key)
+
+    def local_put(self, address: bytes, app_id: int, key: bytes, value):
+        self.local_get(address, app_id, key)
+        self.local_state[key] = value
+
+    def local_del(self, address: bytes, app_id: int, key: bytes):
+        self.local_get(address, app_id, key)
+        self.local_state.pop(key, None)
+
+    def global_get(self, app_id: int, key: bytes):
+        return self.global_state.get(key) if app_id == self.app_id else None
+
+    def global_put(self, app_id: int, key: bytes, value):
+        self.global_state[key] = value
+
+    def global_del(self, app_id: int, key: bytes):
+        self.global_state.pop(key, None)
+
+    def balance(self, address: bytes) -> int:
+        raise TealReject("Balances are not in the snapshot")
+
+    min_balance = balance
+
+    def asset_holding(self, address: bytes, asa_id: int, field: str):
+        raise TealReject("Asset holdings are not in the snapshot")
+
+    def asset_params(self, asa_id: int, field: str):
+        raise TealReject("Asset params are not in the snapshot")
+
+
+def prevalidate_group(snapshot: StakingSnapshot, signed_group: list,
+                      escrow: Account = None):
+    """Check a signed Booking or Withdrawal group locally, as at the round
+    after the snapshot, before submitting it. The named conditions give the
+    reason of a rejection; the approval (and escrow) programs are then run
+    on the snapshot state, to catch anything the conditions miss. The
+    approval program is the deployed one, if the settings have it, else the
+    one this version builds.
+
+    Raises GroupRejectedError naming the failing condition.
+    """
+    group = [decode_txn(stxn.transaction) for stxn in signed_group]
+    round_num = snapshot.last_round + 1
+    check_staking_group(snapshot, group, round_num)
+
+    settings = snapshot.settings
+    approval_program = settings.approval_program
+    if approval_program is None and settings.pool_id is None:
+        approval_program = compile_program(None, approval_teal())
+    elif approval_program is None:
+        approval_program = compile_program(None, registry_approval_teal())
+    ledger = SnapshotLedger(snapshot, group[0]['snd'], round_num)
     try:
-        gtxn_id = algod_client.send_transactions(signed_group)
-        wait_for_confirmation(algod_client, gtxn_id)
-        quit(f"\n🎉  Withdrawal completed: {int(bookink_status['amount'] * 2)}"
-              f" units of ASA ID: {settings['asa_id']}\n")
-    except AlgodHTTPError:
-        quit("\n⚠️  Withdrawal denied! Check your withdrawl status (--help).\n")
+        eval_teal(approval_program, group, 0, ledger, settings.app_id)
+    except TealReject as e:
+        raise GroupRejectedError('approval_program', str(e))
+    if escrow is not None:
+        try:
+            eval_teal(escrow.lsig.logic, group, 1)
+        except TealReject as e:
+            raise GroupRejectedError('escrow_program', str(e))
+
+
+# --- Staking index
+# Single pool dApps are indexed as the pool SINGLE_POOL of their app
+SINGLE_POOL = -1
+
+INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS apps (
+    app_id INTEGER PRIMARY KEY,
+    creator TEXT NOT NULL,
+    registry INTEGER NOT NULL,
+    escrow TEXT,
+    pool_count INTEGER NOT NULL DEFAULT 0,
+    synced_round INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS pools (
+    app_id INTEGER NOT NULL,
+    pool_id INTEGER NOT NULL,
+    asa_id INTEGER NOT NULL,
+    locking_blocks INTEGER NOT NULL,
+    reward_percent INTEGER NOT NULL,
+    bookable_funds INTEGER NOT NULL,
+    PRIMARY KEY (app_id, pool_id)
+);
+CREATE TABLE IF NOT EXISTS bookings (
+    app_id INTEGER NOT NULL,
+    pool_id INTEGER NOT NULL,
+    address TEXT NOT NULL,
+    booking_round INTEGER NOT NULL,
+    amount INTEGER NOT NULL,
+    PRIMARY KEY (app_id, pool_id, address)
+);
+CREATE TABLE IF NOT EXISTS withdrawals (
+    tx_id TEXT PRIMARY KEY,
+    app_id INTEGER NOT NULL,
+    pool_id INTEGER NOT NULL,
+    address TEXT NOT NULL,
+    round INTEGER NOT NULL,
+    amount INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS assets (
+    asa_id INTEGER PRIMARY KEY,
+    decimals INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sync (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    last_round INTEGER NOT NULL,
+    synced_at REAL NOT NULL
+);
+"""
 
 
-def main():
-    if len(sys.argv) == 1:
-        # Display help if no arguments, see:
-        # https://github.com/docopt/docopt/issues/420#issuecomment-405018014
-        sys.argv.append('--help')
+def block_groups(block: dict) -> list:
+    """Transaction groups of a (msgpack decoded) block, as lists of
+    (tx_id, txn): ungrouped transactions make a group of their own."""
+    groups = []
+    last_group_id = None
+    for tx_id, stxn in zip(block_tx_ids(block), block.get('txns', [])):
+        group_id = stxn['txn'].get('grp')
+        if group_id is None or group_id != last_group_id:
+            groups.append([])
+        groups[-1].append((tx_id, stxn))
+        last_group_id = group_id
+    return groups
+
+
+class StakingIndex:
+    """SQLite index of the staking dApps pools, bookings and withdrawals.
+
+    Each tracked app is snapshotted once, then kept up to date by replaying
+    the staking calls of the following blocks (see sync). Reads are served
+    with no algod or Indexer call, as long as the index is fresh.
+    """
+
+    def __init__(self, path=INDEX_DB_FILE):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.db = sqlite3.connect(path)
+        # Readers (info, status) do not block the sync daemon writes
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript(INDEX_SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def tracked_apps(self) -> dict:
+        """Synced round of each tracked App ID."""
+        return dict(self.db.execute('SELECT app_id, synced_round FROM apps'))
+
+    def track(self, algod_client: algod.AlgodClient,
+              indexer_client: indexer.IndexerClient, app_id: int,
+              from_round: int = None):
+        """Start tracking App ID: from its current state, or replaying the
+        blocks from `from_round` (that must precede the app creation)."""
+        # The app state and the round it refers to must match
+        while True:
+            last_round = get_last_round(algod_client)
+            params = algod_client.application_info(app_id)['params']
+            if get_last_round(algod_client) == last_round:
+                break
+        global_state = params.get('global-state', [])
+        registry = 'PoolCount' in decode_state(
+            global_state, REGISTRY_STATE_KEYS)
+
+        escrow, pools, bookings = None, [], []
+        if from_round is None:
+            if registry:
+                state = PoolRegistryState.from_global_state(
+                    app_id, global_state)
+                escrow, pools = state.escrow, state.pools
+            else:
+                pools = [StakingAppState.from_global_state(
+                    app_id, global_state)]
+                escrow = pools[0].escrow
+            bookings = self._snapshot_bookings(
+                indexer_client, app_id, pools, last_round)
+            synced_round = last_round
+        else:
+            synced_round = from_round - 1
+
+        with self.db:
+            self._forget(app_id)
+            self.db.execute(
+                'INSERT INTO apps VALUES (?, ?, ?, ?, ?, ?)',
+                (app_id, params['creator'], registry, escrow,
+                 len(pools) if registry else 0, synced_round))
+            for settings in pools:
+                self.db.execute(
+                    'INSERT INTO pools VALUES (?, ?, ?, ?, ?, ?)',
+                    (app_id, self._pool_key(settings.pool_id),
+                     settings.asa_id, settings.locking_blocks,
+                     settings.reward_percent, settings.bookable_funds))
+            self.db.executemany(
+                'INSERT INTO bookings VALUES (?, ?, ?, ?, ?)', bookings)
+
+    @staticmethod
+    def _pool_key(pool_id: int = None) -> int:
+        return SINGLE_POOL if pool_id is None else pool_id
+
+    @staticmethod
+    def _snapshot_bookings(indexer_client: indexer.IndexerClient,
+                           app_id: int, pools: list, last_round: int):
+        """Booking rows of App ID pools, once the Indexer has caught up with
+        the last round: later bookings are replayed from the blocks."""
+        for attempt in range(INDEX_SNAPSHOT_ATTEMPTS):
+            bookings, indexer_round = [], last_round
+            for address, local_state, current_round in app_local_states(
+                    indexer_client, app_id):
+                indexer_round = min(indexer_round, current_round)
+                for settings in pools:
+                    booking = account_booking(
+                        local_state, app_id, settings.pool_id)
+                    if booking:
+                        bookings.append((
+                            app_id, StakingIndex._pool_key(settings.pool_id),
+                            address, booking.round, booking.amount))
+            if indexer_round >= last_round:
+                return bookings
+            time.sleep(1)
+        quit(f"\n⚠️  The Indexer is behind round {last_round}!\n")
+
+    def _forget(self, app_id: int):
+        for table in ('apps', 'pools', 'bookings'):
+            self.db.execute(f'DELETE FROM {table} WHERE app_id = ?',
+                            (app_id,))
+
+    def missing_assets(self) -> list:
+        """ASA IDs of the indexed pools with unknown decimals."""
+        return [asa_id for asa_id, in self.db.execute(
+            'SELECT DISTINCT asa_id FROM pools '
+            'WHERE asa_id NOT IN (SELECT asa_id FROM assets)')]
+
+    def put_asset(self, asa_id: int, decimals: int):
+        with self.db:
+            self.db.execute('INSERT OR REPLACE INTO assets VALUES (?, ?)',
+                            (asa_id, decimals))
+
+    def apply_block(self, round_num: int, block: dict):
+        """Replay the staking calls of a block on the apps synced up to the
+        previous round, in one transaction."""
+        apps = {row[0]: list(row) for row in self.db.execute(
+            'SELECT app_id, creator, registry, escrow, pool_count '
+            'FROM apps WHERE synced_round = ?', (round_num - 1,))}
+        with self.db:
+            for group in block_groups(block):
+                for index, (tx_id, stxn) in enumerate(group):
+                    txn = stxn['txn']
+                    if txn.get('type') == 'appl' and txn.get('apid') in apps:
+                        self._apply_call(apps[txn['apid']], round_num,
+                                         group, index)
+            self.db.executemany(
+                'UPDATE apps SET synced_round = ? WHERE app_id = ?',
+                [(round_num, app_id) for app_id in apps])
+
+    def _apply_call(self, app: list, round_num: int, group: list,
+                    index: int):
+        app_id, creator, registry, escrow, pool_count = app
+        txn = group[index][1]['txn']
+        sender = encoding.encode_address(txn['snd'])
+        on_complete = txn.get('apan', OnComplete.NoOpOC)
+
+        if on_complete in (OnComplete.CloseOutOC, OnComplete.ClearStateOC):
+            self.db.execute(
+                'DELETE FROM bookings WHERE app_id = ? AND address = ?',
+                (app_id, sender))
+            return
+        if on_complete == OnComplete.DeleteApplicationOC:
+            self.db.execute('DELETE FROM pools WHERE app_id = ?', (app_id,))
+            self.db.execute('DELETE FROM bookings WHERE app_id = ?',
+                            (app_id,))
+            return
+        # Accepted staking calls come first in their group
+        if on_complete != OnComplete.NoOpOC or index != 0:
+            return
+        args = txn.get('apaa', [])
+        method = args[0] if args else b''
+        if registry and method == b'Setup':
+            app[3] = encoding.encode_address(args[1])
+            self.db.execute('UPDATE apps SET escrow = ? WHERE app_id = ?',
+                            (app[3], app_id))
+            return
+        if len(group) != 2:
+            return
+
+        xfer_tx_id, xfer_stxn = group[1]
+        xfer = xfer_stxn['txn']
+        xfer_amount = xfer.get('aamt', 0)
+
+        if not registry and sender == creator:
+            escrow = encoding.encode_address(args[0])
+            app[3] = escrow
+            self.db.execute('UPDATE apps SET escrow = ? WHERE app_id = ?',
+                            (escrow, app_id))
+            self.db.execute(
+                'INSERT OR REPLACE INTO pools VALUES (?, ?, ?, ?, ?, ?)',
+                (app_id, SINGLE_POOL, xfer['xaid'], _btoi(args[1]), 100,
+                 xfer_amount))
+            return
+        if registry and method == b'AddPool':
+            app[4] = pool_count + 1
+            self.db.execute(
+                'UPDATE apps SET pool_count = ? WHERE app_id = ?',
+                (app[4], app_id))
+            self.db.execute(
+                'INSERT INTO pools VALUES (?, ?, ?, ?, ?, ?)',
+                (app_id, pool_count, xfer['xaid'], _btoi(args[1]),
+                 _btoi(args[2]), xfer_amount))
+            return
+
+        if method not in (b'FundPool', b'Booking', b'Withdrawal'):
+            return
+        pool_id = _btoi(args[1]) if registry else SINGLE_POOL
+        if method == b'FundPool':
+            self._add_bookable(app_id, pool_id, xfer_amount)
+        elif method == b'Booking':
+            pool = self.db.execute(
+                'SELECT reward_percent FROM pools '
+                'WHERE app_id = ? AND pool_id = ?',
+                (app_id, pool_id)).fetchone()
+            if pool is None:
+                # Pool added before the first indexed round
+                return
+            self._add_bookable(app_id, pool_id,
+                               -(xfer_amount * pool[0] // 100))
+            self.db.execute(
+                'INSERT OR REPLACE INTO bookings VALUES (?, ?, ?, ?, ?)',
+                (app_id, pool_id, sender, round_num, xfer_amount))
+        elif method == b'Withdrawal':
+            if registry:
+                self.db.execute(
+                    'DELETE FROM bookings WHERE app_id = ? AND pool_id = ? '
+                    'AND address = ?', (app_id, pool_id, sender))
+            else:
+                self.db.execute(
+                    'UPDATE bookings SET booking_round = 0, amount = 0 '
+                    'WHERE app_id = ? AND pool_id = ? AND address = ?',
+                    (app_id, pool_id, sender))
+            self.db.execute(
+                'INSERT OR REPLACE INTO withdrawals '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (xfer_tx_id, app_id, pool_id, sender, round_num,
+                 xfer_amount))
+
+    def _add_bookable(self, app_id: int, pool_id: int, amount: int):
+        self.db.execute(
+            'UPDATE pools SET bookable_funds = bookable_funds + ? '
+            'WHERE app_id = ? AND pool_id = ?', (amount, app_id, pool_id))
+
+    def mark_synced(self, last_round: int):
+        with self.db:
+            self.db.execute(
+                'INSERT OR REPLACE INTO sync VALUES (0, ?, ?)',
+                (last_round, time.time()))
+
+    def snapshot(self, app_id: int, pool_id: int = None, address: str = None,
+                 max_age=INDEX_MAX_AGE_SEC) -> StakingSnapshot:
+        """App ID pool (and account booking) snapshot from the index, or
+        None if the index is not fresh for App ID, or has no such pool."""
+        app = self.db.execute(
+            'SELECT creator, registry, escrow, synced_round, last_round, '
+            'synced_at FROM apps, sync WHERE app_id = ?',
+            (app_id,)).fetchone()
+        if app is None:
+            return None
+        creator, registry, escrow, synced_round, last_round, synced_at = app
+        if (time.time() - synced_at > max_age or synced_round < last_round
+                or bool(registry) != (pool_id is not None)):
+            return None
+        pool = self.db.execute(
+            'SELECT asa_id, locking_blocks, reward_percent, bookable_funds, '
+            'decimals FROM pools JOIN assets USING (asa_id) '
+            'WHERE app_id = ? AND pool_id = ?',
+            (app_id, self._pool_key(pool_id))).fetchone()
+        if pool is None:
+            return None
+        asa_id, locking_blocks, reward_percent, bookable_funds, decimals = pool
+
+        booking = None
+        if address is not None:
+            row = self.db.execute(
+                'SELECT booking_round, amount FROM bookings '
+                'WHERE app_id = ? AND pool_id = ? AND address = ?',
+                (app_id, self._pool_key(pool_id), address)).fetchone()
+            if row:
+                booking = StakingBooking(app_id, *row)
+
+        return StakingSnapshot(
+            settings=StakingAppState(
+                app_id=app_id,
+                creator=creator,
+                asa_id=asa_id,
+                escrow=escrow,
+                locking_blocks=locking_blocks,
+                bookable_funds=bookable_funds,
+                pool_id=pool_id,
+                reward_percent=reward_percent,
+            ),
+            asset_decimals=decimals,
+            last_round=synced_round,
+            booking=booking,
+        )
+
+
+def _btoi(value) -> int:
+    """TEAL btoi of an application argument."""
+    return int.from_bytes(value, 'big')
+
+
+def sync(algod_client: algod.AlgodClient,
+         indexer_client: indexer.IndexerClient, index: StakingIndex,
+         app_ids: list = (), from_round: int = None, once=False):
+    """Follow the blocks, keeping the index of App IDs (and of the apps it
+    already tracks) up to date. Yields the last round, each time the index
+    catches up with it."""
+    tracked = index.tracked_apps()
+    for app_id in app_ids:
+        if app_id not in tracked:
+            index.track(algod_client, indexer_client, app_id, from_round)
+    if not index.tracked_apps():
+        quit("\n⚠️  No staking dApp to index!\n")
+
+    last_round = get_last_round(algod_client)
+    while True:
+        first_round = min(index.tracked_apps().values()) + 1
+        for round_num in range(first_round, last_round + 1):
+            block = msgpack.unpackb(
+                algod_client.block_info(
+                    round_num=round_num, response_format='msgpack'),
+                raw=False, strict_map_key=False,
+            )['block']
+            index.apply_block(round_num, block)
+        for asa_id in index.missing_assets():
+            index.put_asset(
+                asa_id, asa_info(algod_client, asa_id)['params']['decimals'])
+        index.mark_synced(last_round)
+        yield last_round
+        if once:
+            return
+        last_round = algod_client.status_after_block(
+            last_round)['last-round']
+        params_cache(algod_client).observe_round(last_round)
+
+
+# --- Offline signing
+@dataclasses.dataclass
+class SignedBatchRow:
+    line: int
+    action: str = None
+    description: str = None
+    groups: list = None
+    confirmed_round: int = None
+    app_id: int = None
+    error: str = None
+
+
+def _record_pool(record: dict):
+    if record.get('pool') in (None, ''):
+        return None
+    return int(record['pool'])
+
+
+def prepare_batch(
+    algod_client: algod.AlgodClient,
+    indexer_client: indexer.IndexerClient,
+    records: list[dict],
+    params: SuggestedParams,
+    index: StakingIndex = None,
+) -> list[SignedBatchRow]:
+    """Build and sign the groups of batch records, with no submission.
+
+    Each record has an `action` (default `booking`) and `mnemonic` or
+    `keyfile`, plus:
+    - booking: `app_id`, `amount` (and `pool`);
+    - withdrawal: `app_id` (and `pool`);
+    - create: nothing, the app ID is known once submitted;
+    - setup: `app_id`, `asset_id`, `locking_blocks`, `amount`.
+
+    The dApps state is read from the staking index, if any, else from
+    algod: with an index and saved params no network call is made.
+    """
+
+    def snapshot(app_id: int, pool_id: int, address: str = None):
+        if index is not None:
+            app_snapshot = index.snapshot(
+                app_id, pool_id, address, max_age=float('inf'))
+            if app_snapshot is None:
+                raise StakingStateError(f"App ID {app_id} is not indexed")
+            return app_snapshot
+        if address is None:
+            return StakingSnapshot(
+                app_settings(algod_client, app_id, pool_id), None, None)
+        return staking_snapshot(algod_client, address, app_id, pool_id)
+
+    bookable_funds = {}
+    rows = []
+    # Booking and withdrawal groups, signed together at the end
+    unsigned = []
+    for line, record in enumerate(records, start=1):
+        row = SignedBatchRow(line, record.get('action') or 'booking')
+        rows.append(row)
+        try:
+            user = account_from_secret(
+                record.get('mnemonic') or record['keyfile'])
+            if row.action == 'booking':
+                app_id, pool_id = int(record['app_id']), _record_pool(record)
+                amount = int(record['amount'])
+                settings = snapshot(app_id, pool_id).settings
+                pool = (app_id, pool_id)
+                bookable_funds.setdefault(pool, settings.bookable_funds)
+                if settings.reward(amount) > bookable_funds[pool]:
+                    row.error = (f"Only {bookable_funds[pool]} still "
+                                 f"available for booking")
+                    continue
+                bookable_funds[pool] -= settings.reward(amount)
+                row.description = (f"{user.address} books {amount} units "
+                                   f"in dApp {app_id}")
+                unsigned.append((row, booking_txns(
+                    params, user, app_id, settings, amount)))
+
+            elif row.action == 'withdrawal':
+                app_id, pool_id = int(record['app_id']), _record_pool(record)
+                app_snapshot = snapshot(app_id, pool_id, user.address)
+                booking, settings = app_snapshot.booking, app_snapshot.settings
+                if not booking or not booking.amount:
+                    row.error = f"Not booked for App ID {app_id}"
+                    continue
+                amount = booking.amount + settings.reward(booking.amount)
+                escrow = escrow_account(
+                    algod_client, indexer_client, settings)
+                row.description = (f"{user.address} withdraws {amount} "
+                                   f"units from dApp {app_id}")
+                unsigned.append((row, withdrawal_txns(
+                    params, user, escrow, settings, amount)))
+
+            elif row.action == 'create':
+                row.description = f"{user.address} creates a staking dApp"
+                row.groups = [[sign(user, application_create_txn(
+                    algod_client, user, params))]]
+
+            elif row.action == 'setup':
+                app_id, asa_id = int(record['app_id']), int(record['asset_id'])
+                escrow, row.groups = setup_groups(
+                    algod_client, params, user, app_id, asa_id,
+                    int(record['locking_blocks']), int(record['amount']))
+                row.description = (f"{user.address} sets up dApp {app_id} "
+                                   f"with escrow {escrow.address}")
+
+            else:
+                row.error = f"Unknown action {row.action}"
+        except SecretError as e:
+            row.error = f"Invalid row: {e}"
+        except (KeyError, ValueError, OSError, TypeError) as e:
+            row.error = f"Invalid row: {e!r}"
+        except (AlgodHTTPError, IndexerHTTPError, StakingStateError) as e:
+            row.error = str(e)
+
+    with METRICS.phase('batch_sign'):
+        signed_groups = sign_groups(group for row, group in unsigned)
+    for (row, group), signed_group in zip(unsigned, signed_groups):
+        row.groups = [signed_group]
+    return rows
+
+
+def write_signed_batch(signed_file: str, rows: list[SignedBatchRow]):
+    """Write the signed groups as JSONL, one row per line: base64 msgpack
+    signed transactions, grouped in submission order."""
+    with open(signed_file, 'w') as f:
+        for row in rows:
+            if row.groups:
+                f.write(json.dumps({
+                    'line': row.line,
+                    'action': row.action,
+                    'description': row.description,
+                    'groups': [[encoding.msgpack_encode(stxn)
+                                for stxn in group] for group in row.groups],
+                }) + '\n')
+
+
+def read_signed_batch(signed_file: str):
+    """Stream the rows of a signed batch file."""
+    with open(signed_file) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            yield SignedBatchRow(
+                line=record['line'],
+                action=record['action'],
+                description=record['description'],
+                groups=[[encoding.future_msgpack_decode(stxn)
+                         for stxn in group] for group in record['groups']],
+            )
+
+
+def save_params(algod_client: algod.AlgodClient, params_file: str):
+    """Save the suggested params, to prepare groups offline: they are valid
+    from their first to their last round."""
+    params = suggested_params(algod_client)
+    with open(params_file, 'w') as f:
+        json.dump(vars(params), f, indent=2)
+    return params
+
+
+def load_params(params_file: str) -> SuggestedParams:
+    with open(params_file) as f:
+        return SuggestedParams(**json.load(f))
+
+
+def submit_batch(
+    algod_client: algod.AlgodClient,
+    rows,
+) -> list[SignedBatchRow]:
+    """Submit the signed groups of many rows concurrently, confirming them
+    together. The groups of a row are submitted in order, each once the
+    previous one is confirmed."""
+    tracker = ConfirmationTracker(algod_client)
+
+    def submit(row: SignedBatchRow, group_index=0):
+        group = row.groups[group_index]
+        try:
+            algod_client.send_transactions(group)
+        except AlgodHTTPError as e:
+            row.error = str(e)
+            return
+
+        def confirmed(confirmation: Future):
+            if confirmation.exception():
+                row.error = str(confirmation.exception())
+            elif group_index + 1 < len(row.groups):
+                submit(row, group_index + 1)
+            else:
+                row.confirmed_round = confirmation.result()['confirmed-round']
+                if row.action == 'create':
+                    row.app_id = algod_client.pending_transaction_info(
+                        group[0].get_txid())['application-index']
+
+        tracker.track_signed(group[0], callback=confirmed)
+
+    with ThreadPoolExecutor(MAX_SUBMIT_WORKERS) as executor:
+        rows = list(rows)
+        list(executor.map(submit, rows))
+
+    tracker.wait()
+    return rows
+
+
+# --- Withdrawal scheduler
+@dataclasses.dataclass
+class ScheduledWithdrawal:
+    address: str
+    app_id: int
+    pool_id: int
+    booking_round: int
+    amount: int
+    unlock_round: int
+    attempts: int = 0
+
+    @property
+    def key(self) -> tuple:
+        return self.address, self.app_id, self.pool_id
+
+    @property
+    def booking(self) -> StakingBooking:
+        return StakingBooking(self.app_id, self.booking_round, self.amount)
+
+    def still_booked(self, algod_client: algod.AlgodClient) -> bool:
+        """Whether the ledger still has this booking, not withdrawn."""
+        local_state = algod_client.account_info(self.address).get(
+            'apps-local-state', [])
+        return account_booking(
+            local_state, self.app_id, self.pool_id) == self.booking
+
+
+class WithdrawalSchedule:
+    """Booked withdrawals in a min-heap by unlock round, persisted as JSON:
+    a restarted scheduler resumes them with no state read."""
+
+    def __init__(self, path: str = SCHEDULE_FILE):
+        self.path = path
+        self.heap = []
+        # Ties on the unlock round pop in scheduling order
+        self.counter = 0
+        try:
+            with open(path) as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            entries = []
+        for entry in entries:
+            self.push(ScheduledWithdrawal(**entry))
+
+    def __len__(self) -> int:
+        return len(self.heap)
+
+    def keys(self) -> set:
+        return {entry.key for unlock_round, n, entry in self.heap}
+
+    def entries(self) -> dict:
+        return {entry.key: entry for unlock_round, n, entry in self.heap}
+
+    def push(self, entry: ScheduledWithdrawal):
+        self.counter += 1
+        heapq.heappush(self.heap, (entry.unlock_round, self.counter, entry))
+
+    def next_round(self) -> int:
+        """The earliest unlock round, if any."""
+        return self.heap[0][0] if self.heap else None
+
+    def pop_due(self, last_round: int) -> list[ScheduledWithdrawal]:
+        """Pop the withdrawals a group submitted after last round would
+        unlock, i.e. due by the next round."""
+        due = []
+        while self.heap and self.heap[0][0] <= last_round + 1:
+            due.append(heapq.heappop(self.heap)[2])
+        return due
+
+    def remove(self, keys: set):
+        self.heap = [item for item in self.heap if item[2].key not in keys]
+        heapq.heapify(self.heap)
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        entries = [dataclasses.asdict(entry) for _, _, entry in self.heap]
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump(entries, f, indent=2)
+        os.replace(self.path + '.tmp', self.path)
+
+
+def read_scheduler_accounts(batch_file: str) -> dict:
+    """Accounts to withdraw for, by (address, app_id, pool_id), with their
+    batch file line: records with `mnemonic` or `keyfile`, `app_id` and,
+    for pool registries, `pool`."""
+    accounts = {}
+    for line, record in enumerate(read_batch_records(batch_file), start=1):
+        try:
+            user = account_from_secret(
+                record.get('mnemonic') or record['keyfile'])
+        except SecretError as e:
+            raise SecretError(f"line {line}: {e}") from None
+        key = (user.address, int(record['app_id']), _record_pool(record))
+        accounts[key] = (line, user)
+    return accounts
+
+
+def schedule_bookings(algod_client: algod.AlgodClient,
+                      schedule: WithdrawalSchedule, accounts: dict,
+                      keys: set = None) -> int:
+    """Schedule the bookings of the accounts (only `keys`, if given),
+    reading each account once and each app (or pool) of a new booking once.
+    Scheduled withdrawals no longer matching the ledger booking, i.e.
+    withdrawn or rebooked meanwhile, are replaced, and the ones of accounts
+    no longer in the batch dropped. Returns the bookings newly scheduled."""
+    schedule.remove(schedule.keys() - accounts.keys())
+    keys = accounts.keys() if keys is None else keys & accounts.keys()
+    scheduled = schedule.entries()
+    addresses = {address for address, app_id, pool_id in keys}
+
+    with ThreadPoolExecutor(MAX_SUBMIT_WORKERS) as executor:
+        local_states = dict(zip(addresses, executor.map(
+            lambda address: algod_client.account_info(
+                address).get('apps-local-state', []), addresses)))
+
+        stale, bookings = set(), {}
+        for key in keys:
+            address, app_id, pool_id = key
+            booking = account_booking(local_states[address], app_id, pool_id)
+            if key in scheduled and scheduled[key].booking == booking:
+                continue
+            if key in scheduled:
+                stale.add(key)
+            if booking is not None and booking.amount:
+                bookings[key] = booking
+        pools = {(app_id, pool_id) for address, app_id, pool_id in bookings}
+        apps = dict(zip(pools, executor.map(
+            lambda pool: app_settings(algod_client, *pool), pools)))
+
+    schedule.remove(stale)
+    for key in sorted(bookings, key=str):
+        address, app_id, pool_id = key
+        booking = bookings[key]
+        schedule.push(ScheduledWithdrawal(
+            address=address,
+            app_id=app_id,
+            pool_id=pool_id,
+            booking_round=booking.round,
+            amount=booking.amount,
+            unlock_round=booking.round + apps[
+                app_id, pool_id].locking_blocks,
+        ))
+    schedule.save()
+    return len(bookings)
+
+
+def withdraw_due(
+    algod_client: algod.AlgodClient,
+    indexer_client: indexer.IndexerClient,
+    due: list[ScheduledWithdrawal],
+    accounts: dict,
+    last_round: int,
+) -> tuple[list[SignedBatchRow], set]:
+    """Build, pre-validate and submit the withdrawal groups of the due
+    bookings together, confirming them with a single tracker. Returns the
+    rows and the keys of the bookings pre-validation rejected."""
+    apps, escrows, errors = {}, {}, {}
+    for pool in {(entry.app_id, entry.pool_id) for entry in due}:
+        try:
+            apps[pool] = app_settings(algod_client, *pool)
+            escrows[pool] = escrow_account(
+                algod_client, indexer_client, apps[pool])
+        except (AlgodHTTPError, StakingStateError) as e:
+            errors[pool] = str(e)
+    params = suggested_params(algod_client)
+
+    rows, unsigned, rejected = [], [], set()
+    for entry in due:
+        line, user = accounts[entry.key]
+        pool = (entry.app_id, entry.pool_id)
+        row = SignedBatchRow(
+            line, 'withdrawal',
+            f"{user.address} withdraws from dApp {entry.app_id}")
+        rows.append(row)
+        if pool in errors:
+            row.error = errors[pool]
+            continue
+        settings, escrow = apps[pool], escrows[pool]
+        amount = entry.amount + settings.reward(entry.amount)
+        row.description = (f"{user.address} withdraws {amount} units "
+                           f"from dApp {entry.app_id}")
+        unsigned.append((row, entry, withdrawal_txns(
+            params, user, escrow, settings, amount)))
+
+    signed_groups = sign_groups(group for row, entry, group in unsigned)
+    for (row, entry, group), signed_group in zip(unsigned, signed_groups):
+        pool = (entry.app_id, entry.pool_id)
+        snapshot = StakingSnapshot(
+            settings=apps[pool],
+            asset_decimals=None,
+            last_round=last_round,
+            booking=entry.booking,
+            opted_in=True,
+        )
+        try:
+            prevalidate_group(snapshot, signed_group, escrows[pool])
+        except GroupRejectedError as e:
+            row.error = str(e)
+            rejected.add(entry.key)
+            continue
+        row.groups = [signed_group]
 
-    args = docopt(__doc__)
+    submit_batch(algod_client, [row for row in rows if row.groups])
+    return rows, rejected
 
-    # Clients
-    if args['<purestake-api-token>']:
+
+def withdrawal_scheduler(
+    algod_client: algod.AlgodClient,
+    indexer_client: indexer.IndexerClient,
+    schedule: WithdrawalSchedule,
+    accounts: dict,
+    rescan_rounds: int = SCHEDULE_RESCAN_ROUNDS,
+):
+    """Withdraw every booking of the accounts as soon as it unlocks.
+
+    Sleeps on one long-poll per round until the earliest unlock round is
+    due, then submits all the due withdrawals together. Every
+    `rescan_rounds` the accounts with no withdrawal scheduled are read
+    again, picking up their new bookings. Failed withdrawals
+    still booked, whether they failed reading the app, on submission or on
+    confirmation, are retried backing off up to SCHEDULE_MAX_RETRY_ROUNDS;
+    only the ones pre-validation rejects, or no longer booked, are dropped.
+    Yields the last round and the rows submitted, each due round, until
+    interrupted.
+    """
+    last_round = get_last_round(algod_client)
+    rescan_round = last_round + rescan_rounds
+    while True:
+        while (last_round < rescan_round and (
+                schedule.next_round() is None
+                or last_round + 1 < schedule.next_round())):
+            last_round = algod_client.status_after_block(
+                last_round)['last-round']
+            params_cache(algod_client).observe_round(last_round)
+
+        if last_round >= rescan_round:
+            try:
+                with METRICS.phase('scheduler_rescan'):
+                    schedule_bookings(
+                        algod_client, schedule, accounts,
+                        accounts.keys() - schedule.keys())
+            except (AlgodHTTPError, StakingStateError):
+                # Read again at the next rescan
+                pass
+            rescan_round = last_round + rescan_rounds
+
+        due = schedule.pop_due(last_round)
+        if not due:
+            continue
+        with METRICS.phase('scheduler_withdraw'):
+            rows, rejected = withdraw_due(
+                algod_client, indexer_client, due, accounts, last_round)
+        for entry, row in zip(due, rows):
+            if row.confirmed_round or entry.key in rejected:
+                continue
+            try:
+                still_booked = entry.still_booked(algod_client)
+            except AlgodHTTPError:
+                still_booked = True
+            if still_booked:
+                entry.attempts += 1
+                entry.unlock_round = last_round + 1 + min(
+                    2 ** (entry.attempts - 1), SCHEDULE_MAX_RETRY_ROUNDS)
+                schedule.push(entry)
+        schedule.save()
+        yield last_round, rows
+        last_round = get_last_round(algod_client)
+
+
+# --- Capacity planning
+@dataclasses.dataclass
+class ArrivalModel:
+    """Bookings arriving as a Poisson process of `rate` bookings per block,
+    with amounts resampled from `amounts` or, if none, exponential with
+    `mean_amount` mean."""
+    rate: float
+    amounts: list = None
+    mean_amount: float = None
+    reward_percent: int = 100
+
+    @classmethod
+    def from_history(cls, bookings: list, last_round: int = None,
+                     reward_percent: int = 100):
+        """Model of past (round, amount) bookings, up to last round."""
+        if not bookings:
+            raise StakingStateError("No booking to model arrivals on")
+        rounds = [booking_round for booking_round, amount in bookings]
+        last_round = max(rounds) if last_round is None else last_round
+        return cls(
+            rate=len(bookings) / (last_round - min(rounds) + 1),
+            amounts=[amount for booking_round, amount in bookings],
+            reward_percent=reward_percent,
+        )
+
+
+def read_booking_history(history_file: str) -> list[tuple[int, int]]:
+    """Past bookings of a CSV (with header) or JSONL file, with fields
+    `round` and `amount`."""
+    return [(int(record['round']), int(record['amount']))
+            for record in read_batch_records(history_file)]
+
+
+def booking_history(indexer_client: indexer.IndexerClient,
+                    settings: StakingAppState,
+                    page_size=INDEXER_PAGE_SIZE) -> list[tuple[int, int]]:
+    """Past bookings of a staking dApp, as the (round, amount) of the ASA
+    deposits to its escrow, the creator funding excluded. Pools of a
+    registry sharing an ASA share the escrow deposits as well."""
+    bookings = []
+    next_page = None
+    while True:
+        page = indexer_client.search_transactions_by_address(
+            address=settings.escrow, asset_id=settings.asa_id,
+            limit=page_size, next_page=next_page)
+        for txn in page['transactions']:
+            xfer = txn.get('asset-transfer-transaction')
+            if (xfer and xfer['receiver'] == settings.escrow
+                    and xfer['amount'] > 0
+                    and txn['sender'] not in (settings.escrow,
+                                              settings.creator)):
+                bookings.append((txn['confirmed-round'], xfer['amount']))
+        next_page = page.get('next-token')
+        if not next_page or not page['transactions']:
+            return bookings
+
+
+def simulate_escrow(
+    model: ArrivalModel,
+    funding_amount: int,
+    locking_blocks: int,
+    horizon: int = SIMULATE_HORIZON_BLOCKS,
+    scenarios: int = SIMULATE_SCENARIOS,
+    withdrawal_delay: float = 0,
+    seed: int = None,
+) -> dict:
+    """Monte Carlo projection of a staking dApp funded with funding amount.
+
+    Each scenario draws the bookings of the horizon; the ones whose reward
+    exceeds the bookable funds left are rejected, as by the approval
+    program. Booked amounts plus rewards are paid out locking blocks later,
+    after an exponential withdrawal delay (mean `withdrawal_delay` blocks).
+    Scenarios run in chunks, vectorized with NumPy: the bookings of a chunk
+    are accepted at once up to the funds exhaustion, then one more per
+    scenario at each step while some still fit.
+
+    Returns per scenario arrays: `demand` (rewards asked), `rewarded`,
+    `bookings`, `rejected`, `exhausted_round` (-1 if never), `peak_escrow`,
+    `peak_liabilities`, `peak_payouts` (in SIMULATE_PAYOUT_WINDOW_BLOCKS)
+    and `last_payout_round`.
+    """
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    counts = rng.poisson(model.rate * horizon, scenarios)
+    max_delay = int(np.ceil(withdrawal_delay * 20))
+    windows = -(-(horizon + locking_blocks + max_delay)
+                // SIMULATE_PAYOUT_WINDOW_BLOCKS)
+    amounts_pool = (np.asarray(model.amounts, dtype=np.int64)
+                    if model.amounts else None)
+
+    results = {name: np.empty(scenarios, dtype=np.int64) for name in (
+        'demand', 'rewarded', 'bookings', 'rejected', 'exhausted_round',
+        'peak_escrow', 'peak_liabilities', 'peak_payouts',
+        'last_payout_round')}
+    chunk = max(SIMULATE_CHUNK_BOOKINGS // max(int(counts.max()), windows),
+                1)
+    for start in range(0, scenarios, chunk):
+        n = counts[start:start + chunk]
+        size = (len(n), max(int(n.max()), 1))
+        # Given their count, Poisson arrivals are uniform in the horizon
+        valid = np.arange(size[1]) < n[:, None]
+        rounds = np.sort(np.where(
+            valid, rng.integers(0, horizon, size), horizon), axis=1)
+        if amounts_pool is not None:
+            amounts = rng.choice(amounts_pool, size)
+        else:
+            amounts = np.maximum(
+                rng.exponential(model.mean_amount, size).round(), 1
+            ).astype(np.int64)
+        amounts = np.where(valid, amounts, 0)
+        rewards = amounts * model.reward_percent // 100
+
+        # Bookings fit until the cumulative rewards exceed the funding...
+        fits = np.cumsum(rewards, axis=1) <= funding_amount
+        accepted = fits & valid
+        exhausted = (~fits & valid).any(axis=1)
+        first_rejected = np.argmin(fits | ~valid, axis=1)
+        bookable = funding_amount - (rewards * accepted).sum(axis=1)
+        # ...then only the smaller ones fitting what is left
+        position = np.where(exhausted, first_rejected, size[1])
+        columns = np.arange(size[1])
+        while True:
+            candidates = (valid & ~accepted & (columns > position[:, None])
+                          & (rewards <= bookable[:, None]))
+            found = candidates.any(axis=1)
+            if not found.any():
+                break
+            rows = np.nonzero(found)[0]
+            position[rows] = np.argmax(candidates[rows], axis=1)
+            accepted[rows, position[rows]] = True
+            bookable[rows] -= rewards[rows, position[rows]]
+
+        payouts = (amounts + rewards) * accepted
+        payout_rounds = rounds + locking_blocks + np.minimum(
+            rng.exponential(withdrawal_delay, size).round().astype(np.int64)
+            if withdrawal_delay else 0, max_delay)
+        # Bookings before payouts of the same round, for the peaks
+        events = np.argsort(np.concatenate(
+            [2 * rounds, 2 * payout_rounds + 1], axis=1), axis=1)
+
+        def peak(booked_values):
+            flows = np.concatenate([booked_values, -payouts], axis=1)
+            return np.maximum(np.cumsum(np.take_along_axis(
+                flows, events, axis=1), axis=1).max(axis=1), 0)
+
+        bins = np.arange(size[0])[:, None] * windows + np.minimum(
+            payout_rounds // SIMULATE_PAYOUT_WINDOW_BLOCKS, windows - 1)
+        paid = np.bincount(
+            bins.ravel(), weights=payouts.ravel(),
+            minlength=size[0] * windows,
+        ).reshape(size[0], windows)
+
+        scenario_slice = slice(start, start + size[0])
+        results['demand'][scenario_slice] = rewards.sum(axis=1)
+        results['rewarded'][scenario_slice] = (rewards * accepted).sum(axis=1)
+        results['bookings'][scenario_slice] = accepted.sum(axis=1)
+        results['rejected'][scenario_slice] = (valid & ~accepted).sum(axis=1)
+        results['exhausted_round'][scenario_slice] = np.where(
+            exhausted, rounds[np.arange(size[0]), first_rejected], -1)
+        results['peak_escrow'][scenario_slice] = funding_amount + peak(
+            amounts * accepted)
+        results['peak_liabilities'][scenario_slice] = peak(payouts)
+        results['peak_payouts'][scenario_slice] = paid.max(axis=1)
+        results['last_payout_round'][scenario_slice] = np.where(
+            accepted, payout_rounds, -1).max(axis=1)
+    return results
+
+
+def simulation_summary(results: dict, funding_amount: int,
+                       locking_blocks: int, horizon: int,
+                       asset_decimals: int = 0) -> str:
+    import numpy as np
+
+    scale = 10 ** asset_decimals
+    digits = min(asset_decimals, 2)
+    scenarios = len(results['demand'])
+
+    def percentiles(values, unit=1):
+        precision = digits if unit > 1 else 0
+        return ''.join(f"{value:>14,.{precision}f}" for value in
+                       np.percentile(values, (5, 50, 95)) / unit)
+
+    exhausted = results['exhausted_round'] >= 0
+    # Scenarios never exhausted count as exhausted after the horizon
+    exhausted_round = np.where(exhausted, results['exhausted_round'],
+                               horizon)
+    demand = results['demand'].sum()
+    rejected_demand = 1 - results['rewarded'].sum() / demand if demand else 0
+    funding = '\n'.join(
+        f"       COVERS {p}% OF SCENARIOS:\t💰 "
+        f"{np.percentile(results['demand'], p) / scale:,.{digits}f}"
+        for p in (50, 90, 95, 99))
+    return f"""
+    * ====================== ESCROW CAPACITY SIMULATION ==================== *
+
+       SCENARIOS:\t{scenarios} over {horizon} blocks
+       FUNDING:\t💰 {funding_amount / scale:,.{digits}f}
+       LOCKING BLOCKS:\t⏳ {locking_blocks}
+
+       FUNDS EXHAUSTED:\t{exhausted.mean():.1%} of scenarios
+       REJECTED DEMAND:\t{rejected_demand:.1%} of the rewards asked
+
+                                        P5            P50           P95
+       EXHAUSTED AT ROUND{percentiles(exhausted_round)}
+       BOOKINGS         {percentiles(results['bookings'])}
+       REJECTED         {percentiles(results['rejected'])}
+       REWARDS PAID     {percentiles(results['rewarded'], scale)}
+       PEAK ESCROW      {percentiles(results['peak_escrow'], scale)}
+       PEAK LIABILITIES {percentiles(results['peak_liabilities'], scale)}
+       PEAK PAYOUTS     {percentiles(results['peak_payouts'], scale)}
+       LAST PAYOUT ROUND{percentiles(results['last_payout_round'])}
+
+       Rounds from now, {horizon} if never exhausted.
+       Payouts per {SIMULATE_PAYOUT_WINDOW_BLOCKS} blocks.
+
+       FUNDING TO SERVE ALL THE DEMAND OF THE HORIZON:
+{funding}
+
+    * ====================================================================== *
+    """
+
+
+# --- Metrics
+METRICS_HELP = {
+    'asa_staking_http_request_seconds':
+        ('histogram', 'Latency of the algod and Indexer calls.'),
+    'asa_staking_http_retries_total':
+        ('counter', 'Retried algod and Indexer requests.'),
+    'asa_staking_phase_seconds':
+        ('histogram', 'Duration of the command phases.'),
+    'asa_staking_command_seconds':
+        ('histogram', 'Duration of the CLI commands.'),
+}
+
+
+def _prometheus_labels(labels: tuple, **extra) -> str:
+    labels = labels + tuple(extra.items())
+    if not labels:
+        return ''
+    return '{' + ','.join(
+        f'{name}="{value}"' for name, value in labels) + '}'
+
+
+class Metrics:
+    """Opt-in counters and latency histograms, labelled by endpoint or
+    phase, to export in Prometheus text format or JSON. Nothing is recorded
+    until enabled."""
+
+    def __init__(self, buckets=METRICS_BUCKETS_SEC):
+        self.enabled = False
+        self.buckets = buckets
+        self.counters = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _key(name: str, labels: dict) -> tuple:
+        # Label values as strings: sortable, whatever their type (e.g. an
+        # HTTP status, or 'error' for a failed request)
+        return name, tuple(sorted(
+            (label, str(value)) for label, value in labels.items()))
+
+    def count(self, name: str, value=1, **labels):
+        if not self.enabled:
+            return
+        key = self._key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels):
+        if not self.enabled:
+            return
+        key = self._key(name, labels)
+        with self.lock:
+            # Per bucket counts (not cumulative), then count and sum
+            histogram = self.histograms.setdefault(
+                key, [0] * len(self.buckets) + [0, 0.0])
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    histogram[i] += 1
+                    break
+            histogram[-2] += 1
+            histogram[-1] += seconds
+
+    @contextlib.contextmanager
+    def timed(self, name: str, **labels):
+        """Observe the duration of a block, labelled with its outcome: an
+        exception is an error, except a successful exit."""
+        started = time.perf_counter()
+        outcome = 'error'
+        try:
+            yield
+            outcome = 'ok'
+        except SystemExit as e:
+            if e.code in (None, 0):
+                outcome = 'ok'
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - started,
+                         outcome=outcome, **labels)
+
+    def phase(self, phase: str):
+        return self.timed('asa_staking_phase_seconds', phase=phase)
+
+    def observe_request(self, service: str, method: str, path: str,
+                        status, seconds: float):
+        self.observe('asa_staking_http_request_seconds', seconds,
+                     service=service, method=method,
+                     endpoint=metrics_endpoint(path), status=status)
+
+    def prometheus(self) -> str:
+        """Metrics in Prometheus text exposition format."""
+        lines = []
+        counters, histograms = self._snapshot()
+        described = set()
+
+        def describe(name):
+            if name not in described and name in METRICS_HELP:
+                kind, description = METRICS_HELP[name]
+                lines.append(f"# HELP {name} {description}")
+                lines.append(f"# TYPE {name} {kind}")
+                described.add(name)
+
+        for (name, labels), value in counters:
+            describe(name)
+            lines.append(f"{name}{_prometheus_labels(labels)} {value}")
+        for (name, labels), (buckets, count, total) in histograms:
+            describe(name)
+            for bound, bucket_count in buckets.items():
+                lines.append(f"{name}_bucket"
+                             f"{_prometheus_labels(labels, le=bound)} "
+                             f"{bucket_count}")
+            lines.append(f"{name}_sum{_prometheus_labels(labels)} "
+                         f"{total:.6f}")
+            lines.append(f"{name}_count{_prometheus_labels(labels)} "
+                         f"{count}")
+        return '\n'.join(lines) + '\n'
+
+    def to_json(self) -> dict:
+        counters, histograms = self._snapshot()
+        return {
+            'counters': [
+                {'name': name, 'labels': dict(labels), 'value': value}
+                for (name, labels), value in counters],
+            'histograms': [
+                {'name': name, 'labels': dict(labels), 'count': count,
+                 'sum': total, 'buckets': buckets}
+                for (name, labels), (buckets, count, total) in histograms],
+        }
+
+    def _snapshot(self):
+        """Sorted counters, and histograms as (cumulative buckets by upper
+        bound, count, sum)."""
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(
+                (key, list(histogram))
+                for key, histogram in self.histograms.items())
+        cumulative_histograms = []
+        for key, histogram in histograms:
+            buckets, cumulative = {}, 0
+            for bound, bucket_count in zip(self.buckets, histogram):
+                cumulative += bucket_count
+                buckets[str(bound)] = cumulative
+            buckets['+Inf'] = histogram[-2]
+            cumulative_histograms.append(
+                (key, (buckets, histogram[-2], histogram[-1])))
+        return counters, cumulative_histograms
+
+    def write(self, path: str):
+        """Dump the metrics to a file: JSON for a .json file, else
+        Prometheus text (e.g. for the node exporter textfile collector)."""
+        if path.endswith('.json'):
+            content = json.dumps(self.to_json(), indent=2)
+        else:
+            content = self.prometheus()
+        # Replace atomically: the file may be scraped while written
+        with open(path + '.tmp', 'w') as f:
+            f.write(content)
+        os.replace(path + '.tmp', path)
+
+
+def metrics_endpoint(path: str) -> str:
+    """Request path with the query and the parameters (IDs, rounds,
+    addresses) replaced, to keep the endpoint labels bounded."""
+    return '/'.join(
+        '{id}' if segment.isdigit() or segment.isupper() else segment
+        for segment in parse.urlsplit(path).path.split('/'))
+
+
+METRICS = Metrics()
+
+
+# --- HTTP transport
+class RetryBudget:
+    """Retries allowed across all the requests of a process: a minimum plus
+    a ratio of the requests made, so an outage does not multiply the load."""
+
+    def __init__(self, minimum=RETRY_BUDGET_MIN, ratio=RETRY_BUDGET_RATIO):
+        self.minimum = minimum
+        self.ratio = ratio
+        self.requests = 0
+        self.retries = 0
+        self.lock = threading.Lock()
+
+    def record_request(self):
+        with self.lock:
+            self.requests += 1
+
+    def withdraw(self) -> bool:
+        """Take a retry from the budget, if any is left."""
+        with self.lock:
+            if self.retries >= self.minimum + self.ratio * self.requests:
+                return False
+            self.retries += 1
+            return True
+
+
+@dataclasses.dataclass
+class HTTPResponse:
+    status: int
+    body: bytes
+    retried: bool
+
+
+class HTTPTransport:
+    """Pool of keep-alive connections to a host, retrying failed requests
+    with jittered exponential backoff within a shared RetryBudget."""
+
+    def __init__(self, base_url: str, budget: RetryBudget = None,
+                 pool_size=HTTP_POOL_SIZE, max_attempts=MAX_CONNECTION_ATTEMPTS,
+                 timeout=HTTP_TIMEOUT_SEC, service: str = None):
+        url = parse.urlsplit(base_url)
+        if url.scheme == 'https':
+            self.connection_class = http.client.HTTPSConnection
+        else:
+            self.connection_class = http.client.HTTPConnection
+        self.host = url.netloc
+        self.base_path = url.path.rstrip('/')
+        self.service = service or url.netloc
+        self.budget = budget or RetryBudget()
+        self.pool_size = pool_size
+        self.max_attempts = max_attempts
+        self.timeout = timeout
+        self.idle = []
+        self.lock = threading.Lock()
+
+    def _connection(self):
+        with self.lock:
+            if self.idle:
+                return self.idle.pop()
+        return self.connection_class(self.host, timeout=self.timeout)
+
+    def _release(self, connection):
+        with self.lock:
+            if len(self.idle) < self.pool_size:
+                self.idle.append(connection)
+                return
+        connection.close()
+
+    @staticmethod
+    def backoff(attempt: int, retry_after=None) -> float:
+        if retry_after and retry_after.isdigit():
+            return min(int(retry_after), RETRY_BACKOFF_MAX_SEC)
+        return random.uniform(0, min(
+            RETRY_BACKOFF_MAX_SEC, RETRY_BACKOFF_BASE_SEC * 2 ** attempt))
+
+    def request(self, method: str, path: str, headers: dict,
+                data: bytes = None) -> HTTPResponse:
+        started = time.perf_counter()
+        status = 'error'
+        try:
+            response = self._request(method, path, headers, data)
+            status = response.status
+            return response
+        finally:
+            METRICS.observe_request(self.service, method, path, status,
+                                    time.perf_counter() - started)
+
+    def _request(self, method: str, path: str, headers: dict,
+                 data: bytes = None) -> HTTPResponse:
+        self.budget.record_request()
+        attempt = 0
+        while True:
+            connection = self._connection()
+            retry_after = None
+            try:
+                connection.request(
+                    method, self.base_path + path, body=data, headers=headers)
+                response = connection.getresponse()
+                body = response.read()
+            except (OSError, http.client.HTTPException) as e:
+                connection.close()
+                failure = e
+            else:
+                if response.will_close:
+                    connection.close()
+                else:
+                    self._release(connection)
+                if response.status not in RETRY_HTTP_STATUSES:
+                    return HTTPResponse(response.status, body, attempt > 0)
+                failure = HTTPResponse(response.status, body, True)
+                retry_after = response.getheader('Retry-After')
+
+            attempt += 1
+            if attempt >= self.max_attempts or not self.budget.withdraw():
+                if isinstance(failure, HTTPResponse):
+                    return failure
+                raise failure
+            METRICS.count('asa_staking_http_retries_total',
+                          service=self.service)
+            time.sleep(self.backoff(attempt, retry_after))
+
+
+def _http_error_message(body: bytes) -> str:
+    message = body.decode('utf-8', errors='replace')
+    try:
+        return json.loads(message)['message']
+    except (ValueError, KeyError, TypeError):
+        return message
+
+
+class PooledAlgodClient(algod.AlgodClient):
+    """AlgodClient sending its requests through an HTTPTransport."""
+
+    def __init__(self, algod_token, algod_address, headers=None,
+                 transport: HTTPTransport = None):
+        super().__init__(algod_token, algod_address, headers)
+        self.transport = transport or HTTPTransport(algod_address)
+
+    def algod_request(self, method, requrl, params=None, data=None,
+                      headers=None, response_format="json"):
+        header = {"User-Agent": "py-algorand-sdk"}
+        if self.headers:
+            header.update(self.headers)
+        if headers:
+            header.update(headers)
+        if requrl not in algosdk_constants.no_auth:
+            header.update({algosdk_constants.algod_auth_header: self.algod_token})
+
+        path = requrl
+        if requrl not in algosdk_constants.unversioned_paths:
+            path = algod.api_version_path_prefix + requrl
+        if params:
+            path = path + "?" + parse.urlencode(params)
+
+        response = self.transport.request(method, path, header, data)
+        if response.status >= 400:
+            message = _http_error_message(response.body)
+            if (response.retried and requrl == "/transactions"
+                    and "already in" in message):
+                # A previous attempt did submit: same bytes, same txid
+                first_txn = next(msgpack.Unpacker(
+                    BytesIO(data), raw=False, strict_map_key=False))
+                return {"txId": txn_id(first_txn['txn'])}
+            raise AlgodHTTPError(message, response.status)
+
+        if response_format == "json":
+            return json.loads(response.body)
+        return response.body
+
+
+class PooledIndexerClient(indexer.IndexerClient):
+    """IndexerClient sending its requests through an HTTPTransport."""
+
+    def __init__(self, indexer_token, indexer_address, headers=None,
+                 transport: HTTPTransport = None):
+        super().__init__(indexer_token, indexer_address, headers)
+        self.transport = transport or HTTPTransport(indexer_address)
+
+    def indexer_request(self, method, requrl, params=None, data=None,
+                        headers=None):
+        header = {"User-Agent": "py-algorand-sdk"}
+        if self.headers:
+            header.update(self.headers)
+        if headers:
+            header.update(headers)
+        if requrl not in algosdk_constants.no_auth and self.indexer_token:
+            header.update(
+                {algosdk_constants.indexer_auth_header: self.indexer_token})
+
+        path = requrl
+        if requrl not in algosdk_constants.unversioned_paths:
+            path = indexer.api_version_path_prefix + requrl
+        if params:
+            path = path + "?" + parse.urlencode(params)
+
+        response = self.transport.request(method, path, header, data)
+        if response.status >= 400:
+            raise IndexerHTTPError(_http_error_message(response.body))
+        return json.loads(response.body)
+
+
+def clients(purestake_token: str, testnet=False):
+    """Algod and Indexer clients for PureStake, or Sandbox if no token."""
+    if purestake_token:
         network = 'mainnet'
-        if args['--test']:
+        if testnet:
             network = 'testnet'
         algod_address = 'https://' + network + '-algorand.api.purestake.io/ps2'
         indexer_address = 'https://' + network + '-algorand.api.purestake.io/idx2'
-        token = args['<purestake-api-token>']
+        token = purestake_token
         header = {'X-Api-key': token}
     else:
         algod_address = 'http://localhost:4001'
@@ -696,26 +4154,317 @@ def main():
         token = 64 * 'a'
         header = {'X-Api-key': token}
 
-    _algod_client = algod.AlgodClient(
+    budget = RetryBudget()
+
+    algod_client = PooledAlgodClient(
         algod_token=token,
         algod_address=algod_address,
-        headers=header
+        headers=header,
+        transport=HTTPTransport(algod_address, budget, service='algod'),
     )
 
-    _indexer_client = indexer.IndexerClient(
+    indexer_client = PooledIndexerClient(
         indexer_token=token,
         indexer_address=indexer_address,
-        headers=header
+        headers=header,
+        transport=HTTPTransport(indexer_address, budget, service='indexer'),
     )
+    return algod_client, indexer_client
+
+
+def command_usage(command: str) -> str:
+    """The usage lines of a command only, with the options, if any."""
+    usage, sections = __doc__.split('Usage:\n', 1)[1].split('\n\n', 1)
+    lines = [line for line in usage.splitlines()
+             if line.split()[1:2] == [command]]
+    if not lines:
+        return None
+    return ('Usage:\n' + '\n'.join(lines) + '\n\n'
+            + sections[sections.index('Options:'):])
+
+
+def parse_args(argv: list) -> dict:
+    """Parse the command line against the usage lines of its command: docopt
+    matching every usage line would cost most of a command startup. Help,
+    and command lines matching no usage, get the full usage. Arguments of
+    the other commands read as None."""
+    usage = command_usage(argv[0]) if argv else None
+    if usage is None or '-h' in argv or '--help' in argv:
+        return docopt(__doc__, argv)
+    try:
+        args = docopt(usage, argv)
+    except DocoptExit:
+        return docopt(__doc__, argv)
+    return defaultdict(lambda: None, args)
+
+
+def main():
+    if len(sys.argv) == 1:
+        # Display help if no arguments, see:
+        # https://github.com/docopt/docopt/issues/420#issuecomment-405018014
+        sys.argv.append('--help')
+
+    args = parse_args(sys.argv[1:])
+
+    if args.get('--metrics'):
+        METRICS.enabled = True
+        atexit.register(METRICS.write, args['--metrics'])
+    command = next(name for name, value in args.items()
+                   if value is True and not name.startswith('-'))
+    with METRICS.timed('asa_staking_command_seconds', command=command):
+        return run_command(args)
+
+
+def run_command(args: dict):
+    if args['profile-contracts']:
+        profiles = profile_contracts()
+        baseline_file = args['<baseline-file>']
+        if args['--save'] and not baseline_file:
+            quit("\n⚠️  --save needs the <baseline-file> to save to!\n")
+        if args['--save']:
+            with open(baseline_file, 'w') as f:
+                json.dump(profiles, f, indent=2)
+            print(profile_summary(profiles))
+            return print(f"\n📝 Contracts profile saved to {baseline_file}\n")
+        baseline = None
+        if baseline_file:
+            try:
+                with open(baseline_file) as f:
+                    baseline = json.load(f)
+            except OSError:
+                quit(f"\n⚠️  Unable to read baseline {baseline_file}!\n")
+        return print(profile_summary(profiles, baseline))
+
+    if args['simulate']:
+        try:
+            import numpy
+        except ImportError:
+            quit("\n⚠️  simulate needs NumPy: pip3 install numpy\n")
+        funding_amount = int(args['<funding-amount>'])
+        locking_blocks = int(args['<locking-blocks>'])
+        asset_decimals = 0
+        if args['<app-id>'] is not None:
+            _algod_client, _indexer_client = clients(
+                args['<purestake-api-token>'], args['--test'])
+            settings = app_settings(
+                _algod_client, int(args['<app-id>']),
+                None if args['--pool'] is None else int(args['--pool']))
+            asset_decimals = asa_info(
+                _algod_client, settings.asa_id)['params']['decimals']
+            model = ArrivalModel.from_history(
+                booking_history(_indexer_client, settings),
+                get_last_round(_algod_client), settings.reward_percent)
+        elif args['--history']:
+            model = ArrivalModel.from_history(
+                read_booking_history(args['--history']))
+        elif args['--rate'] and args['--amount']:
+            model = ArrivalModel(rate=float(args['--rate']),
+                                 mean_amount=float(args['--amount']))
+        else:
+            quit("\n⚠️  Model the arrivals on an App ID, on --history, or "
+                 "on --rate and --amount!\n")
+        horizon = int(args['--horizon'] or SIMULATE_HORIZON_BLOCKS)
+        scenarios = int(args['--scenarios'] or SIMULATE_SCENARIOS)
+        print(f"\n🎲 Simulating {scenarios} scenarios of {model.rate:.4g} "
+              f"bookings per block...")
+        results = simulate_escrow(
+            model, funding_amount, locking_blocks, horizon, scenarios,
+            float(args['--delay'] or 0),
+            None if args['--seed'] is None else int(args['--seed']))
+        return print(simulation_summary(
+            results, funding_amount, locking_blocks, horizon,
+            asset_decimals))
+
+    _algod_client, _indexer_client = clients(
+        args['<purestake-api-token>'], args['--test'])
+
+    pool_id = None
+    if args['--pool'] is not None:
+        pool_id = int(args['--pool'])
+
+    def index_snapshot(app_id: int, address: str = None):
+        """Snapshot from the index if asked with --max-age and fresh."""
+        index_file = args['--index'] or INDEX_DB_FILE
+        if args['--max-age'] is None or not os.path.exists(index_file):
+            return None
+        index = StakingIndex(index_file)
+        try:
+            return index.snapshot(app_id, pool_id, address,
+                                  float(args['--max-age']))
+        finally:
+            index.close()
+
+    def app_summary(app_id: int) -> str:
+        try:
+            settings, summary = info(_algod_client, app_id, pool_id,
+                                     index_snapshot(app_id))
+        except PoolRegistryError:
+            registry, summary = registry_info(_algod_client, app_id)
+        return summary
 
     if args['info']:
-        settings, summary = info(_algod_client, args['<app-id>'])
-        return print(summary)
+        return print(app_summary(int(args['<app-id>'])))
 
     if args['status']:
-        booking_status, booking_summary = status(_algod_client, args['<account>'], int(args['<app-id>']))
+        app_id = int(args['<app-id>'])
+        booking_status, booking_summary = status(
+            _algod_client, args['<account>'], app_id,
+            index_snapshot(app_id, args['<account>']), pool_id)
         return print(booking_summary)
 
+    if args['watch']:
+        app_id = int(args['<app-id>'])
+        user = None
+        if args['--withdraw']:
+            user = account_from_secret(args['--withdraw'])
+            if user.address != args['<account>']:
+                quit(f"\n⚠️  The --withdraw mnemonic is not of account "
+                     f"{args['<account>']}!\n")
+        snapshot = staking_snapshot(
+            _algod_client, args['<account>'], app_id, pool_id)
+        booking_status, booking_summary = status(
+            _algod_client, args['<account>'], app_id, snapshot, pool_id)
+        print(booking_summary)
+        if booking_status.amount == 0:
+            return
+        try:
+            for last_round, blocks_left in watch(_algod_client, snapshot):
+                if blocks_left:
+                    print(f"⏳ Round {last_round}: {blocks_left} blocks left",
+                          flush=True)
+        except KeyboardInterrupt:
+            return
+        print(f"\n🔐 Round {last_round}: withdrawal ready! ⌛\n")
+        if user:
+            print(f"🤑 Withdrawal request...\n")
+            asa_stake_withdrawal(
+                algod_client=_algod_client,
+                indexer_client=_indexer_client,
+                user=user,
+                app_id=app_id,
+                pool_id=pool_id,
+            )
+        return
+
+    if args['scheduler']:
+        try:
+            accounts = read_scheduler_accounts(args['<batch-file>'])
+        except SecretError as e:
+            quit(f"\n⚠️  Invalid batch file {args['<batch-file>']}, {e}!\n")
+        except (KeyError, ValueError, OSError, TypeError) as e:
+            quit(f"\n⚠️  Invalid batch file {args['<batch-file>']}: {e!r}\n")
+        schedule = WithdrawalSchedule(args['--schedule'] or SCHEDULE_FILE)
+        scheduled = schedule_bookings(_algod_client, schedule, accounts)
+        print(f"\n📝 {len(schedule)} withdrawals scheduled "
+              f"({scheduled} new bookings).\n")
+        try:
+            for last_round, rows in withdrawal_scheduler(
+                    _algod_client, _indexer_client, schedule, accounts):
+                for row in rows:
+                    if row.confirmed_round:
+                        print(f"✅ [{row.line}] {row.description} "
+                              f"(round {row.confirmed_round})", flush=True)
+                    else:
+                        print(f"❌ [{row.line}] {row.description}: "
+                              f"{row.error}", flush=True)
+                if args['--metrics']:
+                    METRICS.write(args['--metrics'])
+        except KeyboardInterrupt:
+            pass
+        return
+
+    if args['sync']:
+        from_round = None
+        if args['--from'] is not None:
+            from_round = int(args['--from'])
+        index = StakingIndex(args['--index'] or INDEX_DB_FILE)
+        print(f"\n📝 Indexing staking dApps...\n")
+        try:
+            for last_round in sync(
+                    _algod_client, _indexer_client, index,
+                    [int(app_id) for app_id in args['<app-ids>']],
+                    from_round, args['--once']):
+                print(f"✅ Synced round {last_round}", flush=True)
+                if args['--metrics']:
+                    METRICS.write(args['--metrics'])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            index.close()
+        return
+
+    if args['save-params']:
+        params = save_params(_algod_client, args['<params-file>'])
+        return print(f"\n📝 Suggested params saved to {args['<params-file>']}, "
+                     f"valid from round {params.first} to {params.last}.\n")
+
+    if args['prepare']:
+        if args['--params']:
+            params = load_params(args['--params'])
+        else:
+            params = suggested_params(_algod_client)
+        index = StakingIndex(args['--index']) if args['--index'] else None
+        print(f"\n✍️  Preparing batch {args['<batch-file>']}...\n")
+        try:
+            rows = prepare_batch(
+                algod_client=_algod_client,
+                indexer_client=_indexer_client,
+                records=read_batch_records(args['<batch-file>']),
+                params=params,
+                index=index,
+            )
+        finally:
+            if index:
+                index.close()
+        write_signed_batch(args['<signed-file>'], rows)
+        for row in rows:
+            if row.groups:
+                print(f"✅ [{row.line}] {row.description}")
+            else:
+                print(f"❌ [{row.line}] {row.error}")
+        signed = sum(1 for row in rows if row.groups)
+        return print(f"\n📝 {signed}/{len(rows)} rows signed to "
+                     f"{args['<signed-file>']}: submit them by round "
+                     f"{params.last}.\n")
+
+    if args['submit']:
+        for signed_file in args['<signed-files>']:
+            print(f"\n📡 Submitting {signed_file}...\n")
+            rows = submit_batch(_algod_client, read_signed_batch(signed_file))
+            for row in rows:
+                if row.confirmed_round:
+                    created = f", App ID {row.app_id}" if row.app_id else ''
+                    print(f"✅ [{row.line}] {row.description} "
+                          f"(round {row.confirmed_round}{created})")
+                else:
+                    print(f"❌ [{row.line}] {row.description}: {row.error}")
+            confirmed = sum(1 for row in rows if row.confirmed_round)
+            print(f"\n📝 {confirmed}/{len(rows)} rows confirmed.\n")
+        return
+
+    if args['status-all']:
+        for row in status_all(
+                _algod_client, _indexer_client, int(args['<app-id>']),
+                pool_id):
+            print(json.dumps(row), flush=True)
+        return
+
+    if args['booking-batch']:
+        print(f"\n🔐 Staking batch {args['<batch-file>']}...\n")
+        rows = asa_stake_booking_batch(
+            algod_client=_algod_client,
+            rows=read_booking_batch(args['<batch-file>']),
+        )
+        for row in rows:
+            address = row.user.address if row.user else '-'
+            if row.confirmed_round:
+                print(f"✅ [{row.line}] {address} booked {row.amount} units "
+                      f"in dApp {row.app_id} (round {row.confirmed_round})")
+            else:
+                print(f"❌ [{row.line}] {address}: {row.error}")
+        booked = sum(1 for row in rows if row.confirmed_round)
+        return print(f"\n📝 {booked}/{len(rows)} bookings confirmed.\n")
+
     # Checking mnemonic format
     try:
         assert len(args['<mnemonic>'].split()) == 25
@@ -723,12 +4472,7 @@ def main():
         quit('\n⚠️\tThe mnemonic phrase must contain 25 words, '
              'formatted as: "word_1 word_2 ... word_25"\n')
 
-    private_key = mnemonic.to_private_key(args['<mnemonic>'])
-
-    user = Account(
-        account.address_from_private_key(private_key),
-        private_key
-    )
+    user = account_from_secret(args['<mnemonic>'])
 
     if args['create']:
         print(f"\n[1/4] 💰 Creating new staking dApp for ASA {args['<asset-id>']}...")
@@ -737,11 +4481,47 @@ def main():
             creator=user,
             asa_id=int(args['<asset-id>']),
             locking_blocks=int(args['<locking-blocks>']),
-            asa_funding_amount=int(args['<funding-amount>'])
+            asa_funding_amount=int(args['<funding-amount>']),
+            optimized=args['--optimized'],
         )
         settings, summary = info(_algod_client, app_id)
         return print(summary)
 
+    if args['create-registry']:
+        print(f"\n[1/3] 💰 Creating new staking pool registry...")
+        app_id = pool_registry_init(
+            algod_client=_algod_client,
+            creator=user,
+        )
+        registry, summary = registry_info(_algod_client, app_id)
+        return print(summary)
+
+    if args['add-pool']:
+        print(f"\n📝 Adding ASA {args['<asset-id>']} pool to registry {args['<app-id>']}...\n")
+        pool_id = pool_registry_add_pool(
+            algod_client=_algod_client,
+            creator=user,
+            app_id=int(args['<app-id>']),
+            asa_id=int(args['<asset-id>']),
+            locking_blocks=int(args['<locking-blocks>']),
+            reward_percent=int(args['<reward-percent>']),
+            asa_funding_amount=int(args['<funding-amount>']),
+        )
+        settings, summary = info(_algod_client, int(args['<app-id>']), pool_id)
+        return print(summary)
+
+    if args['fund-pool']:
+        print(f"\n💰 Funding pool {pool_id} with {args['<funding-amount>']} units...\n")
+        pool_registry_fund_pool(
+            algod_client=_algod_client,
+            creator=user,
+            app_id=int(args['<app-id>']),
+            pool_id=pool_id,
+            asa_funding_amount=int(args['<funding-amount>']),
+        )
+        settings, summary = info(_algod_client, int(args['<app-id>']), pool_id)
+        return print(summary)
+
     if args['join']:
         print(f"\n📝 Joining staking dApp {args['<app-id>']}...\n")
         optin_to_application(
@@ -749,8 +4529,7 @@ def main():
             account=user,
             app_id=int(args['<app-id>']),
         )
-        settings, summary = info(_algod_client, int(args['<app-id>']))
-        return print(summary)
+        return print(app_summary(int(args['<app-id>'])))
 
     if args['booking']:
         print(f"\n🔐 Staking {args['<booking-amount>']} units in dApp {args['<app-id>']}...\n")
@@ -758,18 +4537,20 @@ def main():
             algod_client=_algod_client,
             user=user,
             app_id=int(args['<app-id>']),
-            booking_amount=int(args['<booking-amount>'])
+            booking_amount=int(args['<booking-amount>']),
+            pool_id=pool_id,
         )
-        booking_status, booking_summary = status(_algod_client, user.address, int(args['<app-id>']))
+        booking_status, booking_summary = status(_algod_client, user.address, int(args['<app-id>']), pool_id=pool_id)
         return print(booking_summary)
 
     if args['withdraw']:
         print(f"\n🤑 Withdrawal request...\n")
-        asa_stake_withdrawal(
+        return asa_stake_withdrawal(
             algod_client=_algod_client,
             indexer_client=_indexer_client,
             user=user,
-            app_id=int(args['<app-id>'])
+            app_id=int(args['<app-id>']),
+            pool_id=pool_id,
         )
 
     else:
@@ -777,4 +4558,8 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    try:
+        main()
+    except (StakingStateError, SecretError, TransactionRejectedError,
+            ConfirmationTimeoutError) as e:
+        quit(f"\n⚠️  {e}!\n")
@@ -0,0 +1,261 @@
+"""
+Benchmark the ASA staking CLI commands on the local ledger simulator.
+
+Every asa_staking.py command runs end to end (CLI parsing and output
+included) against a LedgerSimulator and an IndexerSimulator, with a latency
+injected in every HTTP request. For each command the HTTP calls, wall time
+and CPU time are reported, medians over the runs. Results can be stored as
+a baseline and later runs compared against it: any extra HTTP call, or time
+over the tolerance, is flagged as a regression. Times are compared relative
+to a fixed CPU workload timed along with them, so a baseline saved on
+another machine still applies.
+
+Usage:
+  benchmark.py [--latency=<ms>] [--runs=<n>] [--stakers=<n>] [--save=<file>] [--compare=<file>] [--tolerance=<pct>] [--verbose]
+  benchmark.py [--help]
+
+Options:
+  -l --latency=<ms>     Latency of every HTTP request [default: 0].
+  -r --runs=<n>         Runs of each command [default: 5].
+  -s --stakers=<n>      Accounts booking with booking-batch [default: 10].
+  --save=<file>         Store the results as baseline.
+  --compare=<file>      Compare the results with a baseline.
+  --tolerance=<pct>     Time increase allowed over the baseline [default: 25].
+  -v --verbose          Show the HTTP calls by endpoint.
+  -h --help
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import tempfile
+import statistics
+import contextlib
+from unittest import mock
+
+from docopt import docopt
+
+import asa_staking
+from asa_staking import (
+    AssetTransferTxn,
+    optin_to_application,
+    optin_to_asset,
+    sign_send_wait,
+    suggested_params,
+)
+from ledger_simulator import IndexerSimulator, LedgerSimulator
+
+# --- Config
+LOCKING_BLOCKS = 10
+FUNDING_AMOUNT = 1_000_000
+STAKER_AMOUNT = 1_000
+BOOKING_AMOUNT = 100
+ASA_TOTAL = 10_000_000
+CALIBRATION_LOOPS = 1_000_000
+
+COMMANDS = [
+    'create', 'info', 'join', 'booking', 'status', 'booking-batch',
+    'status-all', 'withdraw',
+]
+
+
+class CommandFailed(Exception):
+    """A benchmarked command did not complete."""
+
+
+def run_command(ledger: LedgerSimulator, indexer: IndexerSimulator,
+                argv: list, latency: float) -> dict:
+    """Run the CLI with argv on the simulators, measuring it."""
+    ledger.requests.clear()
+    indexer.requests.clear()
+    ledger.latency = indexer.latency = latency
+    output = io.StringIO()
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        with mock.patch.object(sys, 'argv', ['asa_staking.py'] + argv), \
+                contextlib.redirect_stdout(output):
+            asa_staking.main()
+    except SystemExit as e:
+        # Commands report errors with quit()
+        raise CommandFailed(f"{argv[0]}: {str(e).strip()}")
+    finally:
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+        ledger.latency = indexer.latency = 0.0
+
+    return {
+        'calls': sum(ledger.requests.values()) + sum(indexer.requests.values()),
+        'algod': dict(ledger.requests),
+        'indexer': dict(indexer.requests),
+        'wall_ms': wall * 1000,
+        'cpu_ms': cpu * 1000,
+    }
+
+
+def scenario(latency: float, stakers: int, batch_dir: str) -> dict:
+    """One run of every command, on a new ledger. Only the commands are
+    measured: setups run with no latency."""
+    ledger = LedgerSimulator()
+    indexer = IndexerSimulator(ledger)
+    creator = ledger.new_account()
+    user = ledger.new_account()
+    asa_id = ledger.create_asset(creator, total=ASA_TOTAL)
+
+    def give_asa(account):
+        optin_to_asset(ledger, account, asa_id)
+        sign_send_wait(ledger, creator, AssetTransferTxn(
+            sender=creator.address,
+            sp=suggested_params(ledger),
+            receiver=account.address,
+            amt=STAKER_AMOUNT,
+            index=asa_id,
+        ))
+
+    results = {}
+    with mock.patch.object(asa_staking, 'clients',
+                           lambda *args: (ledger, indexer)):
+        def measure(command, *args):
+            results[command] = run_command(
+                ledger, indexer, [command, ''] + [str(a) for a in args],
+                latency)
+
+        measure('create', creator.mnemonic(), asa_id, LOCKING_BLOCKS,
+                FUNDING_AMOUNT)
+        app_id = max(ledger.state.apps)
+        measure('info', app_id)
+
+        give_asa(user)
+        measure('join', user.mnemonic(), app_id)
+        measure('booking', user.mnemonic(), app_id, BOOKING_AMOUNT)
+        measure('status', user.address, app_id)
+
+        batch_file = os.path.join(batch_dir, 'batch.csv')
+        with open(batch_file, 'w') as f:
+            f.write('mnemonic,app_id,amount\n')
+            for _ in range(stakers):
+                staker = ledger.new_account()
+                give_asa(staker)
+                optin_to_application(ledger, staker, app_id)
+                f.write(f'"{staker.mnemonic()}",{app_id},{BOOKING_AMOUNT}\n')
+        measure('booking-batch', batch_file)
+        measure('status-all', app_id)
+
+        ledger.advance(LOCKING_BLOCKS)
+        measure('withdraw', user.mnemonic(), app_id)
+    return results
+
+
+def calibration(runs: int) -> float:
+    """Median time (ms) of a fixed CPU workload, the machine speed unit."""
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        sum(i * i for i in range(CALIBRATION_LOOPS))
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
+
+
+def benchmark(latency: float, runs: int, stakers: int) -> dict:
+    """Median results of every command over the runs."""
+    samples = {command: [] for command in COMMANDS}
+    with tempfile.TemporaryDirectory() as batch_dir, \
+            contextlib.redirect_stdout(io.StringIO()):
+        # An unmeasured run fills the TEAL compile cache, as the first
+        # create on a machine does: created programs come from it after
+        scenario(0, stakers, batch_dir)
+        for _ in range(runs):
+            for command, result in scenario(
+                    latency, stakers, batch_dir).items():
+                samples[command].append(result)
+
+    commands = {}
+    for command, results in samples.items():
+        # Calls are deterministic, but keep the worst run if they were not
+        worst = max(results, key=lambda result: result['calls'])
+        commands[command] = dict(
+            worst,
+            wall_ms=statistics.median(r['wall_ms'] for r in results),
+            cpu_ms=statistics.median(r['cpu_ms'] for r in results),
+        )
+    return {
+        'latency_ms': latency * 1000,
+        'runs': runs,
+        'stakers': stakers,
+        'calibration_ms': calibration(runs),
+        'commands': commands,
+    }
+
+
+def regressions(results: dict, baseline: dict, tolerance: float) -> list:
+    """Regressions of the results against the baseline, as messages. The
+    baseline times are scaled by the calibration ratio of the machines,
+    unscaled for a baseline saved with no calibration."""
+    found = []
+    same_setup = all(results[key] == baseline.get(key)
+                     for key in ('latency_ms', 'stakers'))
+    scale = results['calibration_ms'] / baseline.get(
+        'calibration_ms', results['calibration_ms'])
+    for command, result in results['commands'].items():
+        reference = baseline['commands'].get(command)
+        if reference is None:
+            continue
+        if result['calls'] > reference['calls']:
+            found.append(f"{command}: {result['calls']} HTTP calls, "
+                         f"baseline {reference['calls']}")
+        if not same_setup:
+            continue
+        for metric in ('wall_ms', 'cpu_ms'):
+            limit = reference[metric] * scale * (1 + tolerance)
+            if result[metric] > limit:
+                found.append(f"{command}: {metric} {result[metric]:.1f}, "
+                             f"baseline {reference[metric] * scale:.1f} "
+                             f"(scaled)")
+    return found
+
+
+def main():
+    args = docopt(__doc__)
+    latency = float(args['--latency']) / 1000
+    results = benchmark(latency, int(args['--runs']), int(args['--stakers']))
+
+    baseline = None
+    if args['--compare']:
+        with open(args['--compare']) as f:
+            baseline = json.load(f)
+
+    print(f"\n⏱  Latency {results['latency_ms']:g} ms, "
+          f"{results['runs']} runs, {results['stakers']} batch stakers, "
+          f"calibration {results['calibration_ms']:.1f} ms\n")
+    print(f"{'COMMAND':<15}{'CALLS':>7}{'WALL ms':>11}{'CPU ms':>10}"
+          f"{'BASELINE CALLS':>16}")
+    for command, result in results['commands'].items():
+        reference = ''
+        if baseline and command in baseline['commands']:
+            reference = baseline['commands'][command]['calls']
+        print(f"{command:<15}{result['calls']:>7}{result['wall_ms']:>11.1f}"
+              f"{result['cpu_ms']:>10.1f}{reference:>16}")
+        if args['--verbose']:
+            for endpoint, calls in sorted({**result['algod'],
+                                           **result['indexer']}.items()):
+                print(f"    {endpoint:<50}{calls:>5}")
+
+    if args['--save']:
+        with open(args['--save'], 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\n📝 Baseline saved to {args['--save']}")
+
+    if baseline:
+        found = regressions(
+            results, baseline, float(args['--tolerance']) / 100)
+        if found:
+            print()
+            for regression in found:
+                print(f"❌ {regression}")
+            quit(f"\n⚠️  {len(found)} regression(s) against "
+                 f"{args['--compare']}!\n")
+        print("\n✅ No regressions against the baseline.\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Benchmark the parallel signing of asa_staking.py against the serial path.
+
+Builds a batch of Booking groups for distinct accounts, as booking-batch and
+prepare do, then signs it with group_and_sign one group after another and
+with sign_groups on a process pool. Reports the throughput of both, medians
+over the runs, and checks the signed groups are the same: same group IDs,
+same order, same bytes.
+
+Usage:
+  benchmark_signing.py [--groups=<n>] [--workers=<n>] [--runs=<n>]
+  benchmark_signing.py [--help]
+
+Options:
+  -g --groups=<n>   Groups in the batch [default: 5000].
+  -w --workers=<n>  Signing processes (default: CPU count).
+  -r --runs=<n>     Runs of each signing path [default: 3].
+  -h --help
+"""
+
+import time
+import statistics
+
+from docopt import docopt
+
+from algosdk import encoding
+
+from asa_staking import (
+    SIGNING_WORKERS,
+    Account,
+    StakingAppState,
+    SuggestedParams,
+    booking_txns,
+    group_and_sign,
+    sign_groups,
+)
+
+# --- Config
+APP_ID = 123456789
+ASSET_ID = 987654321
+BOOKING_AMOUNT = 100
+GENESIS_HASH = 'SGO1GKSzyE7IEPItTxCByw9x8FmnrCDexi9/cOUJOiI='
+
+
+def batch(users: list[Account], settings: StakingAppState) -> list:
+    """Fresh Booking groups of the users, as (signers, transactions):
+    signing sets the group IDs of the transactions."""
+    params = SuggestedParams(
+        fee=1000, first=1, last=1001, gh=GENESIS_HASH, gen='testnet-v1.0',
+        flat_fee=True)
+    return [booking_txns(params, user, APP_ID, settings, BOOKING_AMOUNT)
+            for user in users]
+
+
+def measure(sign, users: list[Account], settings: StakingAppState,
+            runs: int):
+    """Median throughput (groups/s) of a signing path, with the encoded
+    signed groups of its last run."""
+    times = []
+    for _ in range(runs):
+        groups = batch(users, settings)
+        start = time.perf_counter()
+        signed_groups = sign(groups)
+        times.append(time.perf_counter() - start)
+    encoded = [[encoding.msgpack_encode(stxn) for stxn in signed_group]
+               for signed_group in signed_groups]
+    return len(users) / statistics.median(times), encoded
+
+
+def main():
+    args = docopt(__doc__)
+    runs = int(args['--runs'])
+    workers = int(args['--workers'] or SIGNING_WORKERS)
+
+    users = [Account.create_account() for _ in range(int(args['--groups']))]
+    settings = StakingAppState(
+        app_id=APP_ID,
+        creator=Account.create_account().address,
+        asa_id=ASSET_ID,
+        escrow=Account.create_account().address,
+        locking_blocks=10,
+        bookable_funds=10 ** 9,
+    )
+
+    serial, serial_groups = measure(
+        lambda groups: [group_and_sign(*group) for group in groups],
+        users, settings, runs)
+    parallel, parallel_groups = measure(
+        lambda groups: sign_groups(groups, workers), users, settings, runs)
+
+    print(f"\n🖋️  {len(users)} groups, {workers} worker(s):\n")
+    print(f"   serial   {serial:>10.0f} groups/s")
+    print(f"   parallel {parallel:>10.0f} groups/s "
+          f"({parallel / serial:.2f}x)")
+
+    if parallel_groups != serial_groups:
+        quit("\n⚠️  Parallel signing differs from the serial one!\n")
+    print("\n✅ Same signed groups, in the same order.\n")
+
+
+if __name__ == "__main__":
+    main()
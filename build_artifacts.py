@@ -0,0 +1,108 @@
+"""
+Build the prebuilt TEAL artifacts of asa_staking.py.
+
+Generates the approval, clear and escrow (template) programs of the staking
+dApp and of the pool registry with PyTeal into the artifacts folder and
+prints their SHA-256, to be pinned in the PROGRAM_ARTIFACTS of
+asa_staking.py. With --check, verifies instead that the
+artifacts are up to date with the PyTeal programs and the pinned hashes.
+
+Usage:
+  build_artifacts.py [--check]
+  build_artifacts.py [--help]
+
+Options:
+  -c --check  Verify the artifacts, without writing them.
+  -h --help
+"""
+
+import os
+import hashlib
+
+from docopt import docopt
+
+from asa_staking import (
+    ARTIFACTS_DIR,
+    PROGRAM_ARTIFACTS,
+    escrow_teal,
+    registry_approval,
+    registry_escrow,
+    registry_escrow_teal,
+    withdrawal_approval,
+    withdrawal_clear,
+    withdrawal_escrow,
+)
+
+# Placeholder values, unlikely in any other escrow constant
+TMPL_APP_ID = 2 ** 64 - 59
+TMPL_ASSET_ID = 2 ** 64 - 83
+
+# Sample values to check the escrow template
+CHECK_APP_ID = 123456789
+CHECK_ASSET_ID = 987654321
+
+
+def artifacts():
+    escrow = withdrawal_escrow(TMPL_APP_ID, TMPL_ASSET_ID)
+    escrow = escrow.replace(f"int {TMPL_APP_ID}", "int TMPL_APP_ID").replace(
+        f"int {TMPL_ASSET_ID}", "int TMPL_ASSET_ID")
+    registry_escrow_template = registry_escrow(TMPL_APP_ID).replace(
+        f"int {TMPL_APP_ID}", "int TMPL_APP_ID")
+    return {
+        'withdrawal_approval.teal': withdrawal_approval(),
+        'withdrawal_clear.teal': withdrawal_clear(),
+        'withdrawal_escrow.teal': escrow,
+        'registry_approval.teal': registry_approval(),
+        'registry_escrow.teal': registry_escrow_template,
+    }
+
+
+def check():
+    failures = 0
+    for name, teal in artifacts().items():
+        path = os.path.join(ARTIFACTS_DIR, name)
+        try:
+            with open(path) as f:
+                artifact = f.read()
+        except OSError:
+            artifact = None
+        digest = hashlib.sha256(teal.encode()).hexdigest()
+        if artifact != teal:
+            failures += 1
+            print(f"❌ {name}: out of date with PyTeal")
+        elif digest != PROGRAM_ARTIFACTS[name]:
+            failures += 1
+            print(f"❌ {name}: hash {digest} not pinned")
+        else:
+            print(f"✅ {name}: {digest}")
+
+    if escrow_teal(CHECK_APP_ID, CHECK_ASSET_ID) != withdrawal_escrow(
+            CHECK_APP_ID, CHECK_ASSET_ID):
+        failures += 1
+        print("❌ withdrawal_escrow.teal: template differs from PyTeal")
+    if registry_escrow_teal(CHECK_APP_ID) != registry_escrow(CHECK_APP_ID):
+        failures += 1
+        print("❌ registry_escrow.teal: template differs from PyTeal")
+    return failures
+
+
+def main():
+    args = docopt(__doc__)
+
+    if args['--check']:
+        failures = check()
+        if failures:
+            quit(f"\n⚠️  {failures} artifact(s) to rebuild!\n")
+        return
+
+    os.makedirs(ARTIFACTS_DIR, exist_ok=True)
+    print("PROGRAM_ARTIFACTS = {")
+    for name, teal in artifacts().items():
+        with open(os.path.join(ARTIFACTS_DIR, name), 'w') as f:
+            f.write(teal)
+        print(f"    '{name}': '{hashlib.sha256(teal.encode()).hexdigest()}',")
+    print("}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Check the offline TEAL assembler of teal_vm.py against algod compile.
+
+Assembles the checked-in TEAL files and the PyTeal generated programs both
+offline and through the algod /teal/compile endpoint, then compares the
+bytecode.
+
+Usage:
+  check_assembler.py <purestake-api-token> [--test]
+  check_assembler.py [--help]
+
+Options:
+  -t --test   Use Algorand TestNet.
+  -h --help
+"""
+
+import base64
+
+from docopt import docopt
+
+from asa_staking import (
+    clients,
+    registry_approval,
+    registry_escrow,
+    withdrawal_approval,
+    withdrawal_approval_optimized,
+    withdrawal_clear,
+    withdrawal_escrow,
+)
+from teal_vm import assemble
+
+# Template values for the checked-in escrow program
+TMPL_APP_ID = 123456789
+TMPL_ASSET_ID = 987654321
+
+
+def programs():
+    with open('withdrawal_escrow.teal') as f:
+        escrow_template = f.read()
+    escrow_teal = escrow_template.replace(
+        'TMPL_APP_ID', str(TMPL_APP_ID)).replace(
+        'TMPL_ASSET_ID', str(TMPL_ASSET_ID))
+
+    sources = {}
+    for name in ('withdrawal_approval.teal', 'withdrawal_clear.teal'):
+        with open(name) as f:
+            sources[name] = f.read()
+    sources['withdrawal_escrow.teal'] = escrow_teal
+
+    sources['withdrawal_approval()'] = withdrawal_approval()
+    sources['withdrawal_approval_optimized()'] = (
+        withdrawal_approval_optimized())
+    sources['withdrawal_clear()'] = withdrawal_clear()
+    sources['withdrawal_escrow()'] = withdrawal_escrow(
+        TMPL_APP_ID, TMPL_ASSET_ID)
+    sources['registry_approval()'] = registry_approval()
+    sources['registry_escrow()'] = registry_escrow(TMPL_APP_ID)
+    return sources
+
+
+def main():
+    args = docopt(__doc__)
+    algod_client, _ = clients(args['<purestake-api-token>'], args['--test'])
+
+    mismatches = 0
+    for name, teal in programs().items():
+        offline = assemble(teal)
+        online = base64.b64decode(algod_client.compile(teal)['result'])
+        if offline == online:
+            print(f"✅ {name}: {len(offline)} bytes")
+        else:
+            mismatches += 1
+            print(f"❌ {name}: offline {offline.hex()}")
+            print(f"   {' ' * len(name)}  algod   {online.hex()}")
+
+    if mismatches:
+        quit(f"\n⚠️  {mismatches} program(s) differ from algod!\n")
+
+
+if __name__ == "__main__":
+    main()
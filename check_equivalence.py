@@ -0,0 +1,334 @@
+"""
+Check the optimized approval program of asa_staking.py against the PyTeal one.
+
+Creates the staking dApp twice, on two forks of the same LedgerSimulator:
+with the PyTeal approval program and with the optimized TEAL v8 one. Then
+submits the same random transaction groups to both ledgers: well formed and
+malformed Setup, Booking and Withdrawal groups, opt-ins, close-outs, clear
+states, updates and deletes, with rounds passing in between. Each group must
+be accepted or rejected by both ledgers, leaving them in the same state.
+
+Usage:
+  check_equivalence.py [--groups=<n>] [--seed=<n>]
+  check_equivalence.py [--help]
+
+Options:
+  -g --groups=<n>   Random groups to submit [default: 2000].
+  -s --seed=<n>     Seed of the random groups [default: 0].
+  -h --help
+"""
+
+import io
+import random
+import contextlib
+import dataclasses
+
+from docopt import docopt
+
+from algosdk import encoding
+from algosdk.error import AlgodHTTPError
+from algosdk.future.transaction import (
+    ApplicationClearStateTxn,
+    ApplicationCloseOutTxn,
+    ApplicationDeleteTxn,
+    ApplicationNoOpTxn,
+    ApplicationOptInTxn,
+    ApplicationUpdateTxn,
+    AssetTransferTxn,
+    PaymentTxn,
+)
+
+from asa_staking import (
+    Account,
+    asa_staking_init,
+    clear_teal,
+    escrow_teal,
+    group_and_sign,
+    optin_to_application,
+    optin_to_asset,
+    sign,
+    sign_send_wait,
+    to_lsig,
+)
+from ledger_simulator import LedgerSimulator
+from teal_vm import assemble
+
+# --- Config
+USERS = 4
+ASA_TOTAL = 10_000_000
+USER_AMOUNT = 100_000
+LOCKING_BLOCKS = 5
+FUNDING_AMOUNT = 500_000
+ADVANCE_PROBABILITY = 0.2
+MUTATION_PROBABILITY = 0.3
+
+
+@dataclasses.dataclass
+class Scenario:
+    creator: Account
+    users: list
+    asa_id: int
+    other_asa_id: int
+    app_id: int = None
+    escrow: Account = None
+
+
+def setup(ledger: LedgerSimulator) -> Scenario:
+    """Creator and users, holding two ASAs."""
+    creator = ledger.new_account()
+    scenario = Scenario(
+        creator=creator,
+        users=[ledger.new_account() for _ in range(USERS)],
+        asa_id=ledger.create_asset(creator, total=ASA_TOTAL),
+        other_asa_id=ledger.create_asset(creator, total=ASA_TOTAL),
+    )
+    for user in scenario.users:
+        for asa_id in (scenario.asa_id, scenario.other_asa_id):
+            optin_to_asset(ledger, user, asa_id)
+            sign_send_wait(ledger, creator, AssetTransferTxn(
+                sender=creator.address,
+                sp=ledger.suggested_params(),
+                receiver=user.address,
+                amt=USER_AMOUNT,
+                index=asa_id,
+            ))
+    return scenario
+
+
+def booked_amount(ledger: LedgerSimulator, scenario: Scenario,
+                  user: Account) -> int:
+    local_state = ledger.state.account(
+        encoding.decode_address(user.address)).local_state
+    return local_state.get(scenario.app_id, {}).get(
+        b'WithdrawalBookedAmount', 0)
+
+
+def setup_group(rng, ledger, scenario, params):
+    sender = rng.choice([scenario.creator] * 3 + scenario.users)
+    escrow = rng.choice([scenario.escrow] * 3 + scenario.users)
+    call = ApplicationNoOpTxn(
+        sender=sender.address,
+        sp=params,
+        index=scenario.app_id,
+        app_args=[encoding.decode_address(escrow.address),
+                  rng.choice([LOCKING_BLOCKS, 0, 1])],
+    )
+    funding = AssetTransferTxn(
+        sender=scenario.creator.address,
+        sp=params,
+        receiver=scenario.escrow.address,
+        amt=rng.choice([FUNDING_AMOUNT] * 3 + [1, 0]),
+        index=rng.choice([scenario.asa_id] * 3 + [scenario.other_asa_id]),
+    )
+    return [sender, scenario.creator], [call, funding]
+
+
+def booking_group(rng, ledger, scenario, params):
+    user = rng.choice(scenario.users)
+    call = ApplicationNoOpTxn(
+        sender=user.address,
+        sp=params,
+        index=scenario.app_id,
+        app_args=[b'Booking'],
+    )
+    deposit = AssetTransferTxn(
+        sender=user.address,
+        sp=params,
+        receiver=scenario.escrow.address,
+        amt=rng.choice([0, 1, rng.randint(1, USER_AMOUNT // 10),
+                        FUNDING_AMOUNT + 1]),
+        index=scenario.asa_id,
+    )
+    return [user, user], [call, deposit]
+
+
+def withdrawal_group(rng, ledger, scenario, params):
+    user = rng.choice(scenario.users)
+    booked = booked_amount(ledger, scenario, user)
+    call = ApplicationNoOpTxn(
+        sender=user.address,
+        sp=params,
+        index=scenario.app_id,
+        app_args=[b'Withdrawal'],
+    )
+    payout = AssetTransferTxn(
+        sender=scenario.escrow.address,
+        sp=params,
+        receiver=rng.choice([user] * 3 + scenario.users).address,
+        amt=rng.choice([2 * booked] * 3 + [booked, 2 * booked + 1]),
+        index=scenario.asa_id,
+    )
+    return [user, scenario.escrow], [call, payout]
+
+
+def optin_group(rng, ledger, scenario, params):
+    user = rng.choice(scenario.users)
+    return [user], [ApplicationOptInTxn(user.address, params,
+                                        scenario.app_id)]
+
+
+def closeout_group(rng, ledger, scenario, params):
+    user = rng.choice(scenario.users)
+    return [user], [ApplicationCloseOutTxn(user.address, params,
+                                           scenario.app_id)]
+
+
+def clear_group(rng, ledger, scenario, params):
+    user = rng.choice(scenario.users)
+    return [user], [ApplicationClearStateTxn(user.address, params,
+                                             scenario.app_id)]
+
+
+def update_group(rng, ledger, scenario, params):
+    # Only users: an accepted update would make both approvals the same
+    user = rng.choice(scenario.users)
+    program = assemble(clear_teal())
+    return [user], [ApplicationUpdateTxn(user.address, params,
+                                         scenario.app_id, program, program)]
+
+
+def delete_group(rng, ledger, scenario, params):
+    user = rng.choice(scenario.users)
+    return [user], [ApplicationDeleteTxn(user.address, params,
+                                         scenario.app_id)]
+
+
+GROUPS = [
+    (setup_group, 1),
+    (booking_group, 6),
+    (withdrawal_group, 6),
+    (optin_group, 2),
+    (closeout_group, 1),
+    (clear_group, 1),
+    (update_group, 1),
+    (delete_group, 1),
+]
+
+
+def mutate(rng, scenario, params, signers: list, txns: list):
+    """Break a group in one of many ways."""
+    user = rng.choice(scenario.users)
+    mutation = rng.choice([
+        'args', 'order', 'extra', 'single', 'asset', 'sender', 'receiver',
+    ])
+    if mutation == 'args' and hasattr(txns[0], 'app_args'):
+        txns[0].app_args = rng.choice([
+            [], [b'booking'], [b'Withdrawal', b'Booking'],
+            [b'Booking', b'Withdrawal'], [b'Setup'],
+        ])
+    elif mutation == 'order':
+        signers.reverse()
+        txns.reverse()
+    elif mutation == 'extra':
+        signers.append(user)
+        txns.append(PaymentTxn(user.address, params, user.address, 0))
+    elif mutation == 'single' and len(txns) > 1:
+        del signers[1:], txns[1:]
+    elif len(txns) > 1 and isinstance(txns[1], AssetTransferTxn):
+        if mutation == 'asset':
+            txns[1].index = scenario.other_asa_id
+        elif mutation == 'sender' and signers[1] is not scenario.escrow:
+            signers[1] = user
+            txns[1].sender = user.address
+        elif mutation == 'receiver':
+            txns[1].receiver = user.address
+
+
+def ledger_view(ledger: LedgerSimulator, app_id: int):
+    """The ledger state the approval programs can affect."""
+    app = ledger.state.apps.get(app_id)
+    return (
+        app and app.global_state,
+        {address: (account.amount, account.assets, account.local_state)
+         for address, account in ledger.state.accounts.items()},
+    )
+
+
+def submit(ledger: LedgerSimulator, signed_group: list):
+    try:
+        ledger.send_transactions(signed_group)
+        return True, ''
+    except AlgodHTTPError as e:
+        return False, str(e)
+
+
+def main():
+    args = docopt(__doc__)
+    rng = random.Random(int(args['--seed']))
+
+    ledger = LedgerSimulator()
+    scenario = setup(ledger)
+    original, optimized = ledger.fork(), ledger.fork()
+    with contextlib.redirect_stdout(io.StringIO()):
+        app_ids = {
+            asa_staking_init(fork, scenario.creator, scenario.asa_id,
+                             LOCKING_BLOCKS, FUNDING_AMOUNT,
+                             optimized=is_optimized)
+            for fork, is_optimized in ((original, False), (optimized, True))
+        }
+    if len(app_ids) != 1:
+        quit("\n⚠️  The dApps have different app IDs!\n")
+    scenario.app_id = app_ids.pop()
+    scenario.escrow = to_lsig(
+        original, escrow_teal(scenario.app_id, scenario.asa_id))
+    for user in scenario.users[1:]:
+        optin_to_application(original, user, scenario.app_id)
+        optin_to_application(optimized, user, scenario.app_id)
+
+    builders, weights = zip(*GROUPS)
+    outcomes = {}
+    for n in range(int(args['--groups'])):
+        if rng.random() < ADVANCE_PROBABILITY:
+            rounds = rng.randint(1, LOCKING_BLOCKS)
+            original.advance(rounds)
+            optimized.advance(rounds)
+
+        builder = rng.choices(builders, weights)[0]
+        params = original.suggested_params()
+        signers, txns = builder(rng, original, scenario, params)
+        name = builder.__name__
+        if rng.random() < MUTATION_PROBABILITY:
+            mutate(rng, scenario, params, signers, txns)
+            name += ' (mutated)'
+        for txn in txns:
+            txn.note = n.to_bytes(8, 'big')
+        if len(txns) > 1:
+            signed_group = group_and_sign(signers, txns)
+        else:
+            signed_group = [sign(signers[0], txns[0])]
+
+        accepted, error = submit(original, signed_group)
+        optimized_accepted, optimized_error = submit(optimized, signed_group)
+        if accepted != optimized_accepted:
+            print(f"❌ Group {n}, {name}: original "
+                  f"{error or 'accepted'}, optimized "
+                  f"{optimized_error or 'accepted'}")
+            quit("\n⚠️  The approval programs are not equivalent!\n")
+        if ledger_view(original, scenario.app_id) != ledger_view(
+                optimized, scenario.app_id):
+            print(f"❌ Group {n}, {name}: ledger states differ")
+            quit("\n⚠️  The approval programs are not equivalent!\n")
+
+        key = (builder.__name__, accepted)
+        outcomes[key] = outcomes.get(key, 0) + 1
+
+    # Last, the creator deletes the dApp
+    signed_delete = [sign(scenario.creator, ApplicationDeleteTxn(
+        scenario.creator.address, original.suggested_params(),
+        scenario.app_id))]
+    if submit(original, signed_delete)[0] != submit(
+            optimized, signed_delete)[0]:
+        print("❌ Creator delete: different outcome")
+        quit("\n⚠️  The approval programs are not equivalent!\n")
+
+    print(f"\n✅ {int(args['--groups'])} groups, same outcome and state:\n")
+    for builder in builders:
+        accepted = outcomes.get((builder.__name__, True), 0)
+        rejected = outcomes.get((builder.__name__, False), 0)
+        print(f"   {builder.__name__:<18}{accepted:>6} accepted"
+              f"{rejected:>6} rejected")
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+"""
+Check the local pre-validation of asa_staking.py against the ledger.
+
+Creates on a LedgerSimulator a staking dApp, an optimized one and a pool
+registry with two pools, then builds random Booking and Withdrawal groups
+for all of them, with rounds passing in between. Most groups are well
+formed, from the user bookings: bookings by users not booked yet and
+withdrawals of bookings, mostly waiting for their lock to expire. The others
+are malformed, in their calls, transfers or amounts. Each group is
+pre-validated on a fresh staking snapshot, then submitted: pre-validation
+must reject exactly the groups the ledger rejects.
+
+The ledger simulator runs the programs with the same TEAL evaluator as
+pre-validation, so the named conditions must agree with the ledger on their
+own: a group only the approval or escrow program rejects fails the check.
+Pre-validation does not check ALGO balances, so the escrows are funded for
+the payout fees of all the groups.
+
+Usage:
+  check_prevalidation.py [--groups=<n>] [--seed=<n>]
+  check_prevalidation.py [--help]
+
+Options:
+  -g --groups=<n>   Random groups to submit [default: 1000].
+  -s --seed=<n>     Seed of the random groups [default: 0].
+  -h --help
+"""
+
+import io
+import random
+import contextlib
+import dataclasses
+
+from docopt import docopt
+
+from asa_staking import (
+    Account,
+    GroupRejectedError,
+    account_booking,
+    app_settings,
+    asa_staking_init,
+    booking_txns,
+    escrow_teal,
+    fund,
+    get_last_round,
+    group_and_sign,
+    optin_to_application,
+    pool_registry_add_pool,
+    pool_registry_init,
+    prevalidate_group,
+    registry_escrow_teal,
+    sign,
+    staking_snapshot,
+    to_lsig,
+    withdrawal_txns,
+)
+from check_equivalence import (
+    ADVANCE_PROBABILITY,
+    FUNDING_AMOUNT,
+    LOCKING_BLOCKS,
+    MUTATION_PROBABILITY,
+    USER_AMOUNT,
+    Scenario,
+    booking_group,
+    mutate,
+    setup,
+    submit,
+    withdrawal_group,
+)
+from ledger_simulator import LedgerSimulator
+
+# --- Config
+POOL_REWARD_PERCENT = 50
+# Withdrawals of locked bookings first wait for the lock to expire
+UNLOCK_PROBABILITY = 0.8
+PROGRAM_CONDITIONS = ('approval_program', 'escrow_program')
+ESCROW_FEE_ALGOS = 10_000_000
+
+
+@dataclasses.dataclass
+class Target:
+    """A dApp, or a registry pool, groups are built for."""
+    name: str
+    app_id: int
+    escrow: Account
+    pool_id: int = None
+
+
+def user_bookings(ledger: LedgerSimulator, scenario: Scenario,
+                  target: Target) -> dict:
+    """Bookings of the users who joined, by address (None if not booked)."""
+    bookings = {}
+    for user in scenario.users[1:]:
+        local_state = ledger.account_info(user.address).get(
+            'apps-local-state', [])
+        bookings[user.address] = account_booking(
+            local_state, target.app_id, target.pool_id)
+    return bookings
+
+
+def booked_users(ledger: LedgerSimulator, scenario: Scenario,
+                 target: Target) -> dict:
+    """Bookings of the users who joined, by address, not withdrawn yet."""
+    return {address: booking for address, booking in user_bookings(
+        ledger, scenario, target).items()
+        if booking is not None and booking.round and booking.amount}
+
+
+def valid_booking(rng, ledger, scenario, target, params):
+    """Booking of a user not booked yet: if all are, a withdrawal, if
+    any."""
+    settings = app_settings(ledger, target.app_id, target.pool_id)
+    # Booking 0 units of a single pool dApp keeps the user booked for good
+    bookings = user_bookings(ledger, scenario, target)
+    users = [user for user in scenario.users[1:]
+             if bookings[user.address] is None or (
+                 target.pool_id is None
+                 and bookings[user.address].round == 0)]
+    if not users and booked_users(ledger, scenario, target):
+        return valid_withdrawal(rng, ledger, scenario, target, params)
+    return booking_txns(params, rng.choice(users or scenario.users[1:]),
+                        target.app_id, settings,
+                        rng.randint(1, USER_AMOUNT // 10))
+
+
+def valid_withdrawal(rng, ledger, scenario, target, params):
+    """Withdrawal of a booking, mostly once unlocked: if none, a
+    booking."""
+    settings = app_settings(ledger, target.app_id, target.pool_id)
+    booked = booked_users(ledger, scenario, target)
+    if not booked:
+        return valid_booking(rng, ledger, scenario, target, params)
+    user = rng.choice([user for user in scenario.users[1:]
+                       if user.address in booked])
+    booking = booked[user.address]
+    locked_rounds = (booking.round + settings.locking_blocks
+                     - get_last_round(ledger) - 1)
+    if locked_rounds > 0 and rng.random() < UNLOCK_PROBABILITY:
+        ledger.advance(locked_rounds)
+        params = ledger.suggested_params()
+    return withdrawal_txns(
+        params, user, target.escrow, settings,
+        booking.amount + settings.reward(booking.amount))
+
+
+def random_booking(rng, ledger, scenario, target, params):
+    return booking_group(rng, ledger, scenario, params)
+
+
+def random_withdrawal(rng, ledger, scenario, target, params):
+    return withdrawal_group(rng, ledger, scenario, params)
+
+
+# Random groups of check_equivalence only target its single pool dApp
+GROUPS = [
+    (valid_booking, 4, False),
+    (valid_withdrawal, 4, False),
+    (random_booking, 1, True),
+    (random_withdrawal, 1, True),
+]
+
+
+def mutate_amount(rng, txns: list):
+    """Deposit or payout off by one, zero or tenfold."""
+    transfer = txns[1]
+    transfer.amount = rng.choice([
+        0, max(transfer.amount - 1, 0), transfer.amount + 1,
+        10 * transfer.amount])
+
+
+def setup_targets(ledger: LedgerSimulator, scenario: Scenario) -> list:
+    """The staking dApp, the optimized one and the two pools of a registry,
+    all joined by the users but one."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        app_id = asa_staking_init(
+            ledger, scenario.creator, scenario.asa_id, LOCKING_BLOCKS,
+            FUNDING_AMOUNT)
+        optimized_app_id = asa_staking_init(
+            ledger, scenario.creator, scenario.asa_id, LOCKING_BLOCKS,
+            FUNDING_AMOUNT, optimized=True)
+        registry_id = pool_registry_init(ledger, scenario.creator)
+        pools = [
+            pool_registry_add_pool(
+                ledger, scenario.creator, registry_id, asa_id,
+                locking_blocks, POOL_REWARD_PERCENT, FUNDING_AMOUNT)
+            for asa_id, locking_blocks in (
+                (scenario.asa_id, LOCKING_BLOCKS),
+                (scenario.other_asa_id, 2 * LOCKING_BLOCKS))
+        ]
+    registry_escrow = to_lsig(ledger, registry_escrow_teal(registry_id))
+
+    # One user never joins
+    for target_app_id in (app_id, optimized_app_id, registry_id):
+        for user in scenario.users[1:]:
+            optin_to_application(ledger, user, target_app_id)
+
+    scenario.app_id = app_id
+    scenario.escrow = to_lsig(ledger, escrow_teal(app_id, scenario.asa_id))
+    optimized_escrow = to_lsig(
+        ledger, escrow_teal(optimized_app_id, scenario.asa_id))
+    with contextlib.redirect_stdout(io.StringIO()):
+        for escrow in (scenario.escrow, optimized_escrow, registry_escrow):
+            fund(ledger, scenario.creator, escrow, amount=ESCROW_FEE_ALGOS)
+    return [
+        Target('single', app_id, scenario.escrow),
+        Target('optimized', optimized_app_id, optimized_escrow),
+    ] + [Target(f'pool {pool_id}', registry_id, registry_escrow, pool_id)
+         for pool_id in pools]
+
+
+def main():
+    args = docopt(__doc__)
+    rng = random.Random(int(args['--seed']))
+
+    ledger = LedgerSimulator()
+    scenario = setup(ledger)
+    targets = setup_targets(ledger, scenario)
+
+    builders, weights, single_only = zip(*GROUPS)
+    outcomes, accepted = {}, {target.name: 0 for target in targets}
+    for n in range(int(args['--groups'])):
+        if rng.random() < ADVANCE_PROBABILITY:
+            ledger.advance(rng.randint(1, LOCKING_BLOCKS))
+
+        index = rng.choices(range(len(builders)), weights)[0]
+        builder = builders[index]
+        target = targets[0] if single_only[index] else rng.choice(targets)
+        params = ledger.suggested_params()
+        signers, txns = builder(rng, ledger, scenario, target, params)
+        name = f"{builder.__name__} ({target.name})"
+        if rng.random() < MUTATION_PROBABILITY:
+            if rng.random() < 0.5:
+                mutate(rng, scenario, params, signers, txns)
+            elif len(txns) > 1:
+                mutate_amount(rng, txns)
+            name += ' (mutated)'
+        for txn in txns:
+            txn.note = n.to_bytes(8, 'big')
+        if len(txns) > 1:
+            signed_group = group_and_sign(signers, txns)
+        else:
+            signed_group = [sign(signers[0], txns[0])]
+
+        snapshot = staking_snapshot(
+            ledger, signers[0].address, target.app_id, target.pool_id)
+        try:
+            prevalidate_group(snapshot, signed_group, target.escrow)
+            condition = None
+        except GroupRejectedError as e:
+            condition = e.condition
+
+        group_accepted, error = submit(ledger, signed_group)
+        if group_accepted != (condition is None):
+            print(f"❌ Group {n}, {name}: ledger "
+                  f"{error or 'accepted'}, pre-validation "
+                  f"{condition or 'accepted'}")
+            quit("\n⚠️  Pre-validation disagrees with the ledger!\n")
+        if condition in PROGRAM_CONDITIONS:
+            print(f"❌ Group {n}, {name}: only the {condition} rejects it "
+                  f"({error})")
+            quit("\n⚠️  The named conditions miss a rejection!\n")
+
+        key = condition or 'accepted'
+        outcomes[key] = outcomes.get(key, 0) + 1
+        if group_accepted:
+            accepted[target.name] += 1
+
+    print(f"\n✅ {int(args['--groups'])} groups, same outcome as the "
+          f"ledger:\n")
+    for condition, count in sorted(outcomes.items()):
+        print(f"   {condition:<18}{count:>6}")
+    print("\n   Accepted: " + ", ".join(
+        f"{name} {count}" for name, count in accepted.items()))
+    print()
+
+
+if __name__ == "__main__":
+    main()
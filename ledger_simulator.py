@@ -0,0 +1,878 @@
+"""
+In-process Algorand ledger for the ASA Staking dApp.
+
+LedgerSimulator is an algod client serving from memory the algod endpoints
+used by asa_staking.py: submitted groups are checked (signatures, LogicSigs,
+validity window, fees, balances, state schemas) and applied all or nothing,
+running the approval, clear and escrow programs with the teal_vm TEAL
+evaluator. Whole create/join/booking/withdraw flows run in milliseconds,
+with no node.
+
+Each accepted group makes a new block, as on an algod dev mode network.
+With `dev_mode=False` transactions stay pending until advance() is called.
+IndexerSimulator serves the Indexer lookups on the same ledger. Both can
+inject a fixed latency in every request, to model a remote node.
+
+Example:
+    ledger = LedgerSimulator()
+    creator = ledger.new_account()
+    asa_id = ledger.create_asset(creator, total=1_000_000)
+    app_id = asa_staking_init(ledger, creator, asa_id, 100, 500_000)
+    ledger.advance(100)
+"""
+
+import re
+import copy
+import time
+import base64
+import hashlib
+import threading
+import dataclasses
+from io import BytesIO
+from collections import Counter
+
+import msgpack
+from nacl.exceptions import BadSignatureError
+from nacl.signing import VerifyKey
+
+from algosdk import account, encoding
+from algosdk.error import AlgodHTTPError, IndexerHTTPError
+from algosdk.v2client import algod, indexer
+
+from accounts import Account
+from teal_vm import (
+    TealAssemblyError,
+    TealReject,
+    _teal_read_varint,
+    assemble,
+    eval_teal,
+    txn_id,
+)
+
+# --- Config
+GENESIS_ID = 'simnet-v1'
+GENESIS_HASH = hashlib.sha256(b'asa-staking-simnet').digest()
+GENESIS_TIMESTAMP = 1_600_000_000
+ROUND_SECONDS = 4
+CONSENSUS_VERSION = 'simnet'
+MIN_TXN_FEE = 1000
+MIN_BALANCE = 100_000
+ASSET_MIN_BALANCE = 100_000
+APP_MIN_BALANCE = 100_000
+SCHEMA_UINT_MIN_BALANCE = 28_500
+SCHEMA_BYTES_MIN_BALANCE = 50_000
+MAX_GROUP_SIZE = 16
+MAX_TXN_LIFE = 1000
+MAX_KEY_LEN = 64
+MAX_KEY_VALUE_LEN = 128
+# From this version approval and clear programs must have the same version
+SYNC_PROGRAMS_VERSION = 6
+DEFAULT_ACCOUNT_FUNDS = 100_000_000
+
+ON_COMPLETE = ('NoOp', 'OptIn', 'CloseOut', 'ClearState', 'UpdateApplication',
+               'DeleteApplication')
+
+
+class LedgerError(Exception):
+    """A transaction group was rejected by the simulated ledger."""
+
+
+def _check_program_versions(approval: bytes, clear: bytes):
+    approval_version = _teal_read_varint(approval, 0)[0] if approval else 0
+    clear_version = _teal_read_varint(clear, 0)[0] if clear else 0
+    if (max(approval_version, clear_version) >= SYNC_PROGRAMS_VERSION
+            and approval_version != clear_version):
+        raise LedgerError(
+            f"program version mismatch: {approval_version} != "
+            f"{clear_version}")
+
+
+@dataclasses.dataclass
+class SimAccount:
+    amount: int = 0
+    assets: dict = dataclasses.field(default_factory=dict)
+    local_state: dict = dataclasses.field(default_factory=dict)
+    # Local schemas of the opted in apps, kept when an app is deleted
+    local_schemas: dict = dataclasses.field(default_factory=dict)
+    created_apps: set = dataclasses.field(default_factory=set)
+    created_assets: set = dataclasses.field(default_factory=set)
+
+
+@dataclasses.dataclass
+class SimApp:
+    creator: bytes
+    approval: bytes
+    clear: bytes
+    global_schema: tuple
+    local_schema: tuple
+    global_state: dict = dataclasses.field(default_factory=dict)
+
+
+@dataclasses.dataclass
+class SimAsset:
+    creator: bytes
+    params: dict
+
+
+def _schema_counts(state: dict) -> tuple[int, int]:
+    uints = sum(1 for value in state.values() if isinstance(value, int))
+    return uints, len(state) - uints
+
+
+def _check_key_value(key: bytes, value):
+    if len(key) > MAX_KEY_LEN:
+        raise TealReject(f"Key too long: {len(key)}")
+    if isinstance(value, bytes) and len(key) + len(value) > MAX_KEY_VALUE_LEN:
+        raise TealReject(f"Key and value too long: {len(key) + len(value)}")
+
+
+class LedgerState:
+    """Accounts, apps and assets of the ledger. It is also the ledger view
+    of the TEAL evaluator, at the round being assembled."""
+
+    def __init__(self):
+        self.accounts = {}
+        self.apps = {}
+        self.assets = {}
+        self.next_index = 1
+        self.round = 1
+        self.timestamp = GENESIS_TIMESTAMP
+
+    def account(self, address: bytes) -> SimAccount:
+        if address not in self.accounts:
+            self.accounts[address] = SimAccount()
+        return self.accounts[address]
+
+    def app(self, app_id: int) -> SimApp:
+        if app_id not in self.apps:
+            raise LedgerError(f"application {app_id} does not exist")
+        return self.apps[app_id]
+
+    def asset(self, asa_id: int) -> SimAsset:
+        if asa_id not in self.assets:
+            raise LedgerError(f"asset {asa_id} does not exist")
+        return self.assets[asa_id]
+
+    def new_index(self) -> int:
+        index = self.next_index
+        self.next_index += 1
+        return index
+
+    # Ledger view of eval_teal
+    def app_creator(self, app_id: int) -> bytes:
+        return self.app(app_id).creator
+
+    def balance(self, address: bytes) -> int:
+        return self.account(address).amount
+
+    def min_balance(self, address: bytes) -> int:
+        sim_account = self.account(address)
+        min_balance = MIN_BALANCE + ASSET_MIN_BALANCE * len(sim_account.assets)
+        schemas = [self.apps[app_id].global_schema
+                   for app_id in sim_account.created_apps]
+        schemas += list(sim_account.local_schemas.values())
+        for uints, byte_slices in schemas:
+            min_balance += (APP_MIN_BALANCE
+                            + SCHEMA_UINT_MIN_BALANCE * uints
+                            + SCHEMA_BYTES_MIN_BALANCE * byte_slices)
+        return min_balance
+
+    def opted_in(self, address: bytes, app_id: int) -> bool:
+        return app_id in self.account(address).local_state
+
+    def _local(self, address: bytes, app_id: int) -> dict:
+        local_state = self.account(address).local_state
+        if app_id not in local_state:
+            raise TealReject(
+                f"{encoding.encode_address(address)} is not opted in to "
+                f"application {app_id}")
+        return local_state[app_id]
+
+    def local_get(self, address: bytes, app_id: int, key: bytes):
+        return self._local(address, app_id).get(key)
+
+    def local_put(self, address: bytes, app_id: int, key: bytes, value):
+        _check_key_value(key, value)
+        local_state = self._local(address, app_id)
+        local_state[key] = value
+        self._check_schema(local_state, self.app(app_id).local_schema,
+                           "local")
+
+    def local_del(self, address: bytes, app_id: int, key: bytes):
+        self._local(address, app_id).pop(key, None)
+
+    def global_get(self, app_id: int, key: bytes):
+        return self.app(app_id).global_state.get(key)
+
+    def global_put(self, app_id: int, key: bytes, value):
+        _check_key_value(key, value)
+        app = self.app(app_id)
+        app.global_state[key] = value
+        self._check_schema(app.global_state, app.global_schema, "global")
+
+    def global_del(self, app_id: int, key: bytes):
+        self.app(app_id).global_state.pop(key, None)
+
+    @staticmethod
+    def _check_schema(state: dict, schema: tuple, kind: str):
+        uints, byte_slices = _schema_counts(state)
+        if uints > schema[0] or byte_slices > schema[1]:
+            raise TealReject(
+                f"{kind} state {uints} uints, {byte_slices} byte slices "
+                f"exceed schema {schema}")
+
+    def asset_holding(self, address: bytes, asa_id: int, field: str):
+        holding = self.account(address).assets.get(asa_id)
+        if holding is None:
+            return None
+        return {'AssetBalance': holding, 'AssetFrozen': 0}[field]
+
+    def asset_params(self, asa_id: int, field: str):
+        if asa_id not in self.assets:
+            return None
+        params = self.assets[asa_id].params
+        key = {
+            'AssetTotal': 't', 'AssetDecimals': 'dc',
+            'AssetDefaultFrozen': 'df', 'AssetUnitName': 'un',
+            'AssetName': 'an', 'AssetURL': 'au', 'AssetMetadataHash': 'am',
+            'AssetManager': 'm', 'AssetReserve': 'r', 'AssetFreeze': 'f',
+            'AssetClawback': 'c',
+        }[field]
+        value = params.get(key)
+        if value is None:
+            return bytes(32) if key in ('am', 'm', 'r', 'f', 'c') else (
+                b'' if key in ('un', 'an', 'au') else 0)
+        if isinstance(value, str):
+            return value.encode()
+        return int(value) if isinstance(value, bool) else value
+
+
+def _b64(value: bytes) -> str:
+    return base64.b64encode(value).decode()
+
+
+def _teal_key_values(state: dict) -> list:
+    """TEAL key-value state as returned by the algod REST API."""
+    return [
+        {
+            'key': _b64(key),
+            'value': (
+                {'type': 2, 'bytes': '', 'uint': value}
+                if isinstance(value, int) else
+                {'type': 1, 'bytes': _b64(value), 'uint': 0}
+            ),
+        }
+        for key, value in state.items()
+    ]
+
+
+def _schema(schema: tuple) -> dict:
+    return {'num-uint': schema[0], 'num-byte-slice': schema[1]}
+
+
+def _to_json(value):
+    """JSON form of msgpack decoded values: bytes as base64."""
+    if isinstance(value, bytes):
+        return _b64(value)
+    if isinstance(value, dict):
+        return {key: _to_json(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_to_json(item) for item in value]
+    return value
+
+
+def _route_match(routes: list, method: str, requrl: str):
+    """(route, handler, path parameters) of the route matching a request."""
+    for route_method, route, handler in routes:
+        pattern = re.sub(r'{[\w-]+}', r'(\\w+)', route)
+        match = re.fullmatch(pattern, requrl)
+        if route_method == method and match:
+            return route, handler, match.groups()
+    return None, None, ()
+
+
+def group_id(txns: list) -> bytes:
+    """Group ID of (msgpack decoded) transactions."""
+    txlist = [base64.b32decode(txn_id(txn) + '====') for txn in txns]
+    packed = msgpack.packb({'txlist': txlist}, use_bin_type=True)
+    return encoding.checksum(b'TG' + packed)
+
+
+class LedgerSimulator(algod.AlgodClient):
+    """Algod client backed by an in-memory ledger.
+
+    `requests` counts the algod calls by endpoint, each delayed by `latency`
+    seconds.
+    """
+
+    ROUTES = [
+        ('GET', '/status', 'status'),
+        ('GET', '/status/wait-for-block-after/{round}', 'wait_for_block'),
+        ('GET', '/transactions/params', 'params'),
+        ('POST', '/transactions', 'submit'),
+        ('GET', '/transactions/pending/{txid}', 'pending'),
+        ('GET', '/accounts/{address}', 'account_json'),
+        ('GET', '/applications/{app-id}', 'application_json'),
+        ('GET', '/assets/{asset-id}', 'asset_json'),
+        ('GET', '/blocks/{round}', 'block'),
+        ('POST', '/teal/compile', 'compile_teal'),
+    ]
+
+    def __init__(self, dev_mode=True, latency=0.0):
+        super().__init__('', 'http://simulator')
+        self.dev_mode = dev_mode
+        self.latency = latency
+        self.state = LedgerState()
+        self.last_round = 0
+        self.blocks = {}
+        self.block_txns = []
+        self.transactions = {}
+        self.requests = Counter()
+        self.lock = threading.RLock()
+
+    # --- Test helpers
+    def new_account(self, amount=DEFAULT_ACCOUNT_FUNDS) -> Account:
+        """A new account, funded out of thin air with `amount` microAlgos."""
+        private_key, address = account.generate_account()
+        with self.lock:
+            self.state.account(encoding.decode_address(address)).amount = (
+                amount)
+        return Account(address=address, private_key=private_key)
+
+    def create_asset(self, creator: Account, total: int, decimals=0,
+                     unit_name='ASA', name='Staking ASA') -> int:
+        """Create an ASA held by its creator, with no transaction."""
+        with self.lock:
+            asa_id = self.state.new_index()
+            creator_address = encoding.decode_address(creator.address)
+            self.state.assets[asa_id] = SimAsset(creator_address, {
+                't': total, 'dc': decimals, 'un': unit_name, 'an': name,
+                'm': creator_address,
+            })
+            creator_account = self.state.account(creator_address)
+            creator_account.assets[asa_id] = total
+            creator_account.created_assets.add(asa_id)
+        return asa_id
+
+    def advance(self, rounds=1):
+        """Make `rounds` new blocks, the first holding the pending txns."""
+        with self.lock:
+            for _ in range(rounds):
+                self._make_block()
+
+    def fork(self) -> 'LedgerSimulator':
+        """A new simulator on a copy of this ledger, evolving on its own."""
+        forked = LedgerSimulator(self.dev_mode, self.latency)
+        with self.lock:
+            forked.state = copy.deepcopy(self.state)
+            forked.last_round = self.last_round
+            forked.blocks = copy.deepcopy(self.blocks)
+            forked.block_txns = copy.deepcopy(self.block_txns)
+            forked.transactions = copy.deepcopy(self.transactions)
+        return forked
+
+    # --- algod API
+    def algod_request(self, method, requrl, params=None, data=None,
+                      headers=None, response_format="json"):
+        route, handler, path_params = _route_match(
+            self.ROUTES, method, requrl)
+        if route is None:
+            raise AlgodHTTPError(f"Not found: {method} {requrl}", 404)
+        self.requests[f"{method} {route}"] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            return getattr(self, '_' + handler)(*path_params, data=data)
+
+    def _status(self, data=None):
+        return {
+            'last-round': self.last_round,
+            'last-version': CONSENSUS_VERSION,
+            'time-since-last-round': 0,
+            'catchup-time': 0,
+        }
+
+    def _wait_for_block(self, round_num, data=None):
+        # Nothing else makes blocks: waiting is advancing
+        while self.last_round <= int(round_num):
+            self._make_block()
+        return self._status()
+
+    def _params(self, data=None):
+        return {
+            'fee': 0,
+            'min-fee': MIN_TXN_FEE,
+            'last-round': self.last_round,
+            'genesis-id': GENESIS_ID,
+            'genesis-hash': _b64(GENESIS_HASH),
+            'consensus-version': CONSENSUS_VERSION,
+        }
+
+    def _pending(self, tx_id, data=None):
+        if tx_id not in self.transactions:
+            raise AlgodHTTPError(f"txn {tx_id} not found", 404)
+        return self.transactions[tx_id]
+
+    def _account_json(self, address, data=None):
+        try:
+            raw_address = encoding.decode_address(address)
+        except Exception:
+            raise AlgodHTTPError(f"Invalid address {address}", 400)
+        sim_account = self.state.accounts.get(raw_address, SimAccount())
+        apps_local_state = []
+        for app_id, local_state in sim_account.local_state.items():
+            app_local_state = {
+                'id': app_id,
+                'schema': _schema(sim_account.local_schemas[app_id]),
+            }
+            if local_state:
+                app_local_state['key-value'] = _teal_key_values(local_state)
+            apps_local_state.append(app_local_state)
+        return {
+            'address': address,
+            'amount': sim_account.amount,
+            'amount-without-pending-rewards': sim_account.amount,
+            'min-balance': self.state.min_balance(raw_address),
+            'assets': [
+                {'asset-id': asa_id, 'amount': amount, 'is-frozen': False}
+                for asa_id, amount in sim_account.assets.items()
+            ],
+            'apps-local-state': apps_local_state,
+            'created-apps': [self._application_json(app_id)
+                             for app_id in sim_account.created_apps],
+            'created-assets': [self._asset_json(asa_id)
+                               for asa_id in sim_account.created_assets],
+            'round': self.last_round,
+            'status': 'Offline',
+        }
+
+    def _application_json(self, app_id, data=None):
+        app = self.state.apps.get(int(app_id))
+        if app is None:
+            raise AlgodHTTPError("application does not exist", 404)
+        params = {
+            'creator': encoding.encode_address(app.creator),
+            'approval-program': _b64(app.approval),
+            'clear-state-program': _b64(app.clear),
+            'global-state-schema': _schema(app.global_schema),
+            'local-state-schema': _schema(app.local_schema),
+        }
+        if app.global_state:
+            params['global-state'] = _teal_key_values(app.global_state)
+        return {'id': int(app_id), 'params': params}
+
+    def _asset_json(self, asa_id, data=None):
+        asset = self.state.assets.get(int(asa_id))
+        if asset is None:
+            raise AlgodHTTPError("asset does not exist", 404)
+        names = {'t': 'total', 'dc': 'decimals', 'df': 'default-frozen',
+                 'un': 'unit-name', 'an': 'name', 'au': 'url',
+                 'am': 'metadata-hash', 'm': 'manager', 'r': 'reserve',
+                 'f': 'freeze', 'c': 'clawback'}
+        params = {'creator': encoding.encode_address(asset.creator),
+                  'decimals': 0, 'default-frozen': False}
+        for key, value in asset.params.items():
+            if key in ('m', 'r', 'f', 'c'):
+                value = encoding.encode_address(value)
+            elif key == 'am':
+                value = _b64(value)
+            params[names[key]] = value
+        return {'index': int(asa_id), 'params': params}
+
+    def _block(self, round_num, data=None):
+        round_num = int(round_num)
+        if round_num > self.last_round:
+            raise AlgodHTTPError(f"ledger does not have entry {round_num}",
+                                 404)
+        block = self.blocks.get(round_num) or {
+            'rnd': round_num,
+            'ts': GENESIS_TIMESTAMP + ROUND_SECONDS * round_num,
+            'gen': GENESIS_ID,
+            'gh': GENESIS_HASH,
+        }
+        return msgpack.packb({'block': block, 'cert': {}}, use_bin_type=True)
+
+    def _compile_teal(self, data=None):
+        try:
+            program = assemble(data.decode())
+        except TealAssemblyError as e:
+            raise AlgodHTTPError(str(e), 400)
+        return {
+            'hash': encoding.encode_address(
+                encoding.checksum(b'Program' + program)),
+            'result': _b64(program),
+        }
+
+    def _submit(self, data=None):
+        signed_group = list(msgpack.Unpacker(
+            BytesIO(data), raw=False, strict_map_key=False))
+        group = [stxn['txn'] for stxn in signed_group]
+        tx_ids = [txn_id(txn) for txn in group]
+        try:
+            self._check_group(signed_group, tx_ids)
+            state = copy.deepcopy(self.state)
+            results = [self._apply(state, group, index)
+                       for index in range(len(group))]
+            self._check_min_balances(state)
+        except (LedgerError, TealReject) as e:
+            raise AlgodHTTPError(
+                f"TransactionPool.Remember: transaction {tx_ids[0]}: {e}",
+                400)
+
+        self.state = state
+        for tx_id, stxn, result in zip(tx_ids, signed_group, results):
+            self.transactions[tx_id] = dict(
+                result, **{'pool-error': '', 'txn': _to_json(stxn)})
+            self.block_txns.append((tx_id, stxn))
+        if self.dev_mode:
+            self._make_block()
+        return {'txId': tx_ids[0]}
+
+    # --- Ledger
+    def _make_block(self):
+        round_num = self.last_round + 1
+        txns = []
+        for tx_id, stxn in self.block_txns:
+            stxn = dict(stxn, txn=dict(stxn['txn']))
+            stxn['txn'].pop('gh', None)
+            if stxn['txn'].pop('gen', None) is not None:
+                stxn['hgi'] = True
+            txns.append(stxn)
+            self.transactions[tx_id]['confirmed-round'] = round_num
+        self.block_txns = []
+        self.blocks[round_num] = {
+            'rnd': round_num,
+            'ts': GENESIS_TIMESTAMP + ROUND_SECONDS * round_num,
+            'gen': GENESIS_ID,
+            'gh': GENESIS_HASH,
+            'txns': txns,
+        }
+        self.last_round = round_num
+        self.state.round = round_num + 1
+        self.state.timestamp = GENESIS_TIMESTAMP + ROUND_SECONDS * round_num
+
+    def _check_group(self, signed_group: list, tx_ids: list):
+        group = [stxn['txn'] for stxn in signed_group]
+        if len(group) > MAX_GROUP_SIZE:
+            raise LedgerError(f"group of {len(group)} transactions too large")
+        if len(group) > 1:
+            expected = group_id([
+                {key: value for key, value in txn.items() if key != 'grp'}
+                for txn in group
+            ])
+            if any(txn.get('grp') != expected for txn in group):
+                raise LedgerError("incomplete or invalid transaction group")
+        elif 'grp' in group[0]:
+            raise LedgerError("incomplete transaction group")
+
+        if sum(txn.get('fee', 0) for txn in group) < MIN_TXN_FEE * len(group):
+            raise LedgerError("group fees below the minimum")
+
+        next_round = self.last_round + 1
+        for index, (stxn, tx_id) in enumerate(zip(signed_group, tx_ids)):
+            txn = stxn['txn']
+            if tx_id in self.transactions:
+                raise LedgerError(f"transaction already in ledger: {tx_id}")
+            if txn.get('gh') != GENESIS_HASH:
+                raise LedgerError("genesis hash mismatch")
+            if txn.get('gen', GENESIS_ID) != GENESIS_ID:
+                raise LedgerError("genesis ID mismatch")
+            first, last = txn.get('fv', 0), txn.get('lv', 0)
+            if not first <= next_round <= last:
+                raise LedgerError(
+                    f"txn dead: round {next_round} outside {first}-{last}")
+            if last - first > MAX_TXN_LIFE:
+                raise LedgerError("validity window too long")
+            self._check_signature(stxn, group, index)
+
+    def _check_signature(self, stxn: dict, group: list, index: int):
+        txn = stxn['txn']
+        signer = txn['snd']
+        if stxn.get('sgnr', signer) != signer:
+            # No rekeying: senders are their own authorizers
+            raise LedgerError("should have been authorized by the sender")
+        if 'sig' in stxn:
+            message = b'TX' + msgpack.packb(
+                dict(sorted(txn.items())), use_bin_type=True)
+            self._verify(signer, message, stxn['sig'])
+        elif 'lsig' in stxn:
+            lsig = stxn['lsig']
+            program = lsig['l']
+            if 'sig' in lsig:
+                self._verify(signer, b'Program' + program, lsig['sig'])
+            elif 'msig' in lsig:
+                raise LedgerError("multisig LogicSigs are not supported")
+            elif encoding.checksum(b'Program' + program) != signer:
+                raise LedgerError("LogicSig program is not the sender")
+            try:
+                eval_teal(program, group, index)
+            except TealReject as e:
+                raise LedgerError(f"rejected by logic: {e}")
+        elif 'msig' in stxn:
+            raise LedgerError("multisig transactions are not supported")
+        else:
+            raise LedgerError("transaction is not signed")
+
+    @staticmethod
+    def _verify(address: bytes, message: bytes, signature: bytes):
+        try:
+            VerifyKey(address).verify(message, signature)
+        except BadSignatureError:
+            raise LedgerError("invalid signature")
+
+    def _check_min_balances(self, state: LedgerState):
+        for address, sim_account in state.accounts.items():
+            if (sim_account.amount or sim_account.assets
+                    or sim_account.local_state or sim_account.created_apps):
+                min_balance = state.min_balance(address)
+                if sim_account.amount < min_balance:
+                    raise LedgerError(
+                        f"account {encoding.encode_address(address)} "
+                        f"balance {sim_account.amount} below min "
+                        f"{min_balance}")
+
+    def _apply(self, state: LedgerState, group: list, index: int) -> dict:
+        txn = group[index]
+        sender = state.account(txn['snd'])
+        fee = txn.get('fee', 0)
+        if sender.amount < fee:
+            raise LedgerError("overspend: fee")
+        sender.amount -= fee
+
+        if txn.get('rekey'):
+            raise LedgerError("rekeying is not supported")
+        apply = {
+            'pay': self._apply_payment,
+            'axfer': self._apply_asset_transfer,
+            'acfg': self._apply_asset_config,
+            'appl': self._apply_application_call,
+        }.get(txn.get('type'))
+        if apply is None:
+            raise LedgerError(f"unsupported txn type {txn.get('type')}")
+        return apply(state, group, index) or {}
+
+    def _apply_payment(self, state: LedgerState, group: list, index: int):
+        txn = group[index]
+        sender = state.account(txn['snd'])
+        amount = txn.get('amt', 0)
+        if sender.amount < amount:
+            raise LedgerError(
+                f"overspend: {sender.amount} < {amount} microAlgos")
+        sender.amount -= amount
+        state.account(txn.get('rcv', bytes(32))).amount += amount
+
+        if 'close' in txn:
+            if (sender.assets or sender.local_state or sender.created_apps
+                    or sender.created_assets):
+                raise LedgerError("cannot close an account holding assets "
+                                  "or applications")
+            state.account(txn['close']).amount += sender.amount
+            del state.accounts[txn['snd']]
+
+    def _apply_asset_transfer(self, state: LedgerState, group: list,
+                              index: int):
+        txn = group[index]
+        asa_id = txn.get('xaid', 0)
+        state.asset(asa_id)
+        if 'asnd' in txn:
+            raise LedgerError("clawback transfers are not supported")
+        sender = state.account(txn['snd'])
+        receiver_address = txn.get('arcv', bytes(32))
+        amount = txn.get('aamt', 0)
+
+        if receiver_address == txn['snd'] and amount == 0:
+            # Opt-in
+            sender.assets.setdefault(asa_id, 0)
+            return
+        receiver = state.account(receiver_address)
+        if asa_id not in sender.assets:
+            raise LedgerError(f"sender not opted in to asset {asa_id}")
+        if asa_id not in receiver.assets:
+            raise LedgerError(f"receiver not opted in to asset {asa_id}")
+        if sender.assets[asa_id] < amount:
+            raise LedgerError(
+                f"underflow on asset {asa_id}: "
+                f"{sender.assets[asa_id]} < {amount}")
+        sender.assets[asa_id] -= amount
+        receiver.assets[asa_id] += amount
+
+        if 'aclose' in txn:
+            if asa_id in sender.created_assets:
+                raise LedgerError("the creator cannot close out its asset")
+            close_to = state.account(txn['aclose'])
+            if asa_id not in close_to.assets:
+                raise LedgerError(f"close-to not opted in to asset {asa_id}")
+            close_to.assets[asa_id] += sender.assets.pop(asa_id)
+
+    def _apply_asset_config(self, state: LedgerState, group: list,
+                            index: int):
+        txn = group[index]
+        if txn.get('caid'):
+            raise LedgerError("asset reconfiguration is not supported")
+        params = txn.get('apar', {})
+        asa_id = state.new_index()
+        state.assets[asa_id] = SimAsset(txn['snd'], params)
+        sender = state.account(txn['snd'])
+        sender.assets[asa_id] = params.get('t', 0)
+        sender.created_assets.add(asa_id)
+        return {'asset-index': asa_id}
+
+    def _apply_application_call(self, state: LedgerState, group: list,
+                                index: int):
+        txn = group[index]
+        sender_address = txn['snd']
+        sender = state.account(sender_address)
+        on_complete = ON_COMPLETE[txn.get('apan', 0)]
+        app_id = txn.get('apid', 0)
+        result = {}
+
+        if app_id == 0:
+            _check_program_versions(txn.get('apap', b''), txn.get('apsu', b''))
+            global_schema = txn.get('apgs', {})
+            local_schema = txn.get('apls', {})
+            app_id = state.new_index()
+            state.apps[app_id] = SimApp(
+                creator=sender_address,
+                approval=txn.get('apap', b''),
+                clear=txn.get('apsu', b''),
+                global_schema=(global_schema.get('nui', 0),
+                               global_schema.get('nbs', 0)),
+                local_schema=(local_schema.get('nui', 0),
+                              local_schema.get('nbs', 0)),
+            )
+            sender.created_apps.add(app_id)
+            result['application-index'] = app_id
+        app = state.app(app_id)
+
+        if on_complete == 'ClearState':
+            if app_id not in sender.local_state:
+                raise LedgerError(f"not opted in to application {app_id}")
+            # Clear state succeeds anyway, discarding failed program effects
+            cleared = copy.deepcopy(state)
+            try:
+                eval_teal(app.clear, group, index, cleared, app_id)
+                state.__dict__.update(cleared.__dict__)
+            except TealReject:
+                pass
+            del sender.local_state[app_id], sender.local_schemas[app_id]
+            return result
+
+        if on_complete == 'OptIn':
+            if app_id in sender.local_state:
+                raise LedgerError(
+                    f"already opted in to application {app_id}")
+            sender.local_state[app_id] = {}
+            sender.local_schemas[app_id] = app.local_schema
+        elif (on_complete == 'CloseOut'
+                and app_id not in sender.local_state):
+            raise LedgerError(f"not opted in to application {app_id}")
+
+        try:
+            eval_teal(app.approval, group, index, state, app_id)
+        except TealReject as e:
+            raise LedgerError(f"rejected by ApprovalProgram: {e}")
+
+        if on_complete == 'CloseOut':
+            del sender.local_state[app_id], sender.local_schemas[app_id]
+        elif on_complete == 'UpdateApplication':
+            _check_program_versions(txn.get('apap', b''), txn.get('apsu', b''))
+            app.approval = txn.get('apap', b'')
+            app.clear = txn.get('apsu', b'')
+        elif on_complete == 'DeleteApplication':
+            del state.apps[app_id]
+            state.account(app.creator).created_apps.discard(app_id)
+        return result
+
+
+class IndexerSimulator(indexer.IndexerClient):
+    """Indexer client reading the confirmed state of a LedgerSimulator.
+
+    `requests` counts the Indexer calls by endpoint, each delayed by
+    `latency` seconds.
+    """
+
+    ROUTES = [
+        ('GET', '/accounts', 'accounts'),
+        ('GET', '/accounts/{address}/transactions', 'account_transactions'),
+    ]
+
+    def __init__(self, ledger: LedgerSimulator, latency=0.0):
+        super().__init__('', 'http://simulator')
+        self.ledger = ledger
+        self.latency = latency
+        self.requests = Counter()
+
+    def indexer_request(self, method, requrl, params=None, data=None,
+                        headers=None):
+        route, handler, path_params = _route_match(
+            self.ROUTES, method, requrl)
+        if route is None:
+            raise IndexerHTTPError(f"Not found: {method} {requrl}")
+        self.requests[f"{method} {route}"] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        with self.ledger.lock:
+            return getattr(self, '_' + handler)(*path_params, **params or {})
+
+    def _accounts(self, **query):
+        limit, next_token = int(query.get('limit', 100)), query.get('next')
+        app_id = query.get('application-id')
+        asa_id = query.get('asset-id')
+        state = self.ledger.state
+        # Accounts are paged in address order, the next token is the last one
+        addresses = sorted(
+            encoding.encode_address(address)
+            for address, sim_account in state.accounts.items()
+            if (app_id is None or app_id in sim_account.local_state)
+            and (asa_id is None or asa_id in sim_account.assets)
+        )
+        if next_token:
+            addresses = [address for address in addresses
+                         if address > next_token]
+        page = addresses[:limit]
+        response = {
+            'accounts': [self.ledger._account_json(address)
+                         for address in page],
+            'current-round': self.ledger.last_round,
+        }
+        if len(page) == limit:
+            response['next-token'] = page[-1]
+        return response
+
+    def _account_transactions(self, address, **query):
+        limit = int(query.get('limit', 1000))
+        raw_address = encoding.decode_address(address)
+        asa_id = query.get('asset-id')
+        transactions = []
+        for round_num, block in sorted(self.ledger.blocks.items()):
+            for stxn in block['txns']:
+                txn = stxn['txn']
+                parties = (txn.get('snd'), txn.get('rcv'), txn.get('close'),
+                           txn.get('arcv'), txn.get('aclose'))
+                if raw_address not in parties:
+                    continue
+                if asa_id is not None and txn.get('xaid') != asa_id:
+                    continue
+                signature = {}
+                if 'sig' in stxn:
+                    signature['sig'] = _b64(stxn['sig'])
+                elif 'lsig' in stxn:
+                    signature['logicsig'] = {'logic': _b64(stxn['lsig']['l'])}
+                indexer_txn = {
+                    'sender': encoding.encode_address(txn['snd']),
+                    'tx-type': txn.get('type'),
+                    'confirmed-round': round_num,
+                    'signature': signature,
+                }
+                if txn.get('type') == 'axfer':
+                    indexer_txn['asset-transfer-transaction'] = {
+                        'amount': txn.get('aamt', 0),
+                        'asset-id': txn.get('xaid'),
+                        'receiver': encoding.encode_address(txn['arcv'])
+                        if 'arcv' in txn else None,
+                    }
+                transactions.append(indexer_txn)
+        return {
+            'transactions': transactions[:limit],
+            'current-round': self.ledger.last_round,
+        }
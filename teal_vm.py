@@ -0,0 +1,1092 @@
+"""
+Offline TEAL tooling for the ASA Staking dApp.
+
+assemble() turns TEAL source into the bytecode algod compiles it to, for the
+opcodes of the staking contracts. eval_teal() runs bytecode against a
+transaction group and a ledger view, as the AVM does, and the profiler sizes
+it and costs its Cond branches. asa_staking.py compiles, pre-validates and
+profiles its programs with them and ledger_simulator.py runs its ledger on
+them, without importing the CLI.
+"""
+
+import base64
+import hashlib
+
+import msgpack
+
+from algosdk import encoding
+from algosdk.future.transaction import Transaction
+
+# --- TEAL assembler
+# Offline assembler for the TEAL opcodes used by the staking contracts. It
+# follows algod's assembler, so its bytecode is byte-identical to the result
+# of the /teal/compile endpoint for the same source.
+# Algod reorders `int`/`byte` constants by frequency from TEAL v4 on: such
+# programs are rejected here and compile_program falls back to algod.
+OPTIMIZED_CONSTANTS_VERSION = 4
+
+TEAL_OPCODES = {
+    # name: (opcode, immediates, min TEAL version)
+    'err': (0x00, '', 1),
+    'sha256': (0x01, '', 1),
+    'keccak256': (0x02, '', 1),
+    'sha512_256': (0x03, '', 1),
+    'ed25519verify': (0x04, '', 1),
+    '+': (0x08, '', 1),
+    '-': (0x09, '', 1),
+    '/': (0x0a, '', 1),
+    '*': (0x0b, '', 1),
+    '<': (0x0c, '', 1),
+    '>': (0x0d, '', 1),
+    '<=': (0x0e, '', 1),
+    '>=': (0x0f, '', 1),
+    '&&': (0x10, '', 1),
+    '||': (0x11, '', 1),
+    '==': (0x12, '', 1),
+    '!=': (0x13, '', 1),
+    '!': (0x14, '', 1),
+    'len': (0x15, '', 1),
+    'itob': (0x16, '', 1),
+    'btoi': (0x17, '', 1),
+    '%': (0x18, '', 1),
+    '|': (0x19, '', 1),
+    '&': (0x1a, '', 1),
+    '^': (0x1b, '', 1),
+    '~': (0x1c, '', 1),
+    'mulw': (0x1d, '', 1),
+    'addw': (0x1e, '', 2),
+    'intcblock': (0x20, 'ints', 1),
+    'intc': (0x21, 'u', 1),
+    'intc_0': (0x22, '', 1),
+    'intc_1': (0x23, '', 1),
+    'intc_2': (0x24, '', 1),
+    'intc_3': (0x25, '', 1),
+    'bytecblock': (0x26, 'bytes', 1),
+    'bytec': (0x27, 'u', 1),
+    'bytec_0': (0x28, '', 1),
+    'bytec_1': (0x29, '', 1),
+    'bytec_2': (0x2a, '', 1),
+    'bytec_3': (0x2b, '', 1),
+    'arg': (0x2c, 'u', 1),
+    'arg_0': (0x2d, '', 1),
+    'arg_1': (0x2e, '', 1),
+    'arg_2': (0x2f, '', 1),
+    'arg_3': (0x30, '', 1),
+    'txn': (0x31, 'f', 1),
+    'global': (0x32, 'g', 1),
+    'gtxn': (0x33, 'uf', 1),
+    'load': (0x34, 'u', 1),
+    'store': (0x35, 'u', 1),
+    'txna': (0x36, 'fu', 2),
+    'gtxna': (0x37, 'ufu', 2),
+    'gtxns': (0x38, 'f', 3),
+    'gtxnsa': (0x39, 'fu', 3),
+    'bnz': (0x40, 'l', 1),
+    'bz': (0x41, 'l', 2),
+    'b': (0x42, 'l', 2),
+    'return': (0x43, '', 2),
+    'assert': (0x44, '', 3),
+    'pop': (0x48, '', 1),
+    'dup': (0x49, '', 1),
+    'dup2': (0x4a, '', 2),
+    'dig': (0x4b, 'u', 3),
+    'swap': (0x4c, '', 3),
+    'select': (0x4d, '', 3),
+    'concat': (0x50, '', 2),
+    'substring': (0x51, 'uu', 2),
+    'substring3': (0x52, '', 2),
+    'getbit': (0x53, '', 3),
+    'setbit': (0x54, '', 3),
+    'getbyte': (0x55, '', 3),
+    'setbyte': (0x56, '', 3),
+    'balance': (0x60, '', 2),
+    'app_opted_in': (0x61, '', 2),
+    'app_local_get': (0x62, '', 2),
+    'app_local_get_ex': (0x63, '', 2),
+    'app_global_get': (0x64, '', 2),
+    'app_global_get_ex': (0x65, '', 2),
+    'app_local_put': (0x66, '', 2),
+    'app_global_put': (0x67, '', 2),
+    'app_local_del': (0x68, '', 2),
+    'app_global_del': (0x69, '', 2),
+    'asset_holding_get': (0x70, 'h', 2),
+    'asset_params_get': (0x71, 'p', 2),
+    'min_balance': (0x78, '', 3),
+    'pushbytes': (0x80, 'b', 3),
+    'pushint': (0x81, 'i', 3),
+    'switch': (0x8d, 'L', 8),
+    'match': (0x8e, 'L', 8),
+}
+
+TEAL_TXN_FIELDS = {
+    name: index for index, name in enumerate([
+        'Sender', 'Fee', 'FirstValid', 'FirstValidTime', 'LastValid', 'Note',
+        'Lease', 'Receiver', 'Amount', 'CloseRemainderTo', 'VotePK',
+        'SelectionPK', 'VoteFirst', 'VoteLast', 'VoteKeyDilution', 'Type',
+        'TypeEnum', 'XferAsset', 'AssetAmount', 'AssetSender',
+        'AssetReceiver', 'AssetCloseTo', 'GroupIndex', 'TxID',
+        'ApplicationID', 'OnCompletion', 'ApplicationArgs', 'NumAppArgs',
+        'Accounts', 'NumAccounts', 'ApprovalProgram', 'ClearStateProgram',
+        'RekeyTo', 'ConfigAsset', 'ConfigAssetTotal', 'ConfigAssetDecimals',
+        'ConfigAssetDefaultFrozen', 'ConfigAssetUnitName', 'ConfigAssetName',
+        'ConfigAssetURL', 'ConfigAssetMetadataHash', 'ConfigAssetManager',
+        'ConfigAssetReserve', 'ConfigAssetFreeze', 'ConfigAssetClawback',
+        'FreezeAsset', 'FreezeAssetAccount', 'FreezeAssetFrozen', 'Assets',
+        'NumAssets', 'Applications', 'NumApplications', 'GlobalNumUint',
+        'GlobalNumByteSlice', 'LocalNumUint', 'LocalNumByteSlice',
+    ])
+}
+
+TEAL_GLOBAL_FIELDS = {
+    name: index for index, name in enumerate([
+        'MinTxnFee', 'MinBalance', 'MaxTxnLife', 'ZeroAddress', 'GroupSize',
+        'LogicSigVersion', 'Round', 'LatestTimestamp', 'CurrentApplicationID',
+        'CreatorAddress',
+    ])
+}
+
+TEAL_ASSET_HOLDING_FIELDS = {'AssetBalance': 0, 'AssetFrozen': 1}
+
+TEAL_ASSET_PARAMS_FIELDS = {
+    name: index for index, name in enumerate([
+        'AssetTotal', 'AssetDecimals', 'AssetDefaultFrozen', 'AssetUnitName',
+        'AssetName', 'AssetURL', 'AssetMetadataHash', 'AssetManager',
+        'AssetReserve', 'AssetFreeze', 'AssetClawback',
+    ])
+}
+
+TEAL_NAMED_INTS = {
+    # OnCompletion
+    'NoOp': 0, 'OptIn': 1, 'CloseOut': 2, 'ClearState': 3,
+    'UpdateApplication': 4, 'DeleteApplication': 5,
+    # TypeEnum
+    'unknown': 0, 'pay': 1, 'keyreg': 2, 'acfg': 3, 'axfer': 4, 'afrz': 5,
+    'appl': 6,
+}
+
+
+def teal_version(source_code: str) -> int:
+    """Return the TEAL version declared by the program pragma."""
+    first_line = source_code.lstrip().split('\n', 1)[0].split()
+    if first_line[:2] == ['#pragma', 'version']:
+        return int(first_line[2])
+    return 1
+
+
+class TealAssemblyError(ValueError):
+    """The TEAL source can not be assembled offline."""
+
+
+def _varint(value: int) -> bytes:
+    out = bytearray()
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _teal_tokens(line: str) -> list[str]:
+    """Split a TEAL line in tokens, honouring quotes and `//` comments."""
+    tokens, token, in_string, i = [], '', False, 0
+    while i < len(line):
+        char = line[i]
+        if in_string:
+            token += char
+            if char == '\\' and i + 1 < len(line):
+                token += line[i + 1]
+                i += 1
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            token += char
+            in_string = True
+        elif line.startswith('//', i):
+            break
+        elif char.isspace():
+            if token:
+                tokens.append(token)
+            token = ''
+        else:
+            token += char
+        i += 1
+    if in_string:
+        raise TealAssemblyError(f"Unterminated string: {line}")
+    if token:
+        tokens.append(token)
+    return tokens
+
+
+def _teal_int(token: str) -> int:
+    if token in TEAL_NAMED_INTS:
+        return TEAL_NAMED_INTS[token]
+    try:
+        value = int(token, 0)
+    except ValueError:
+        raise TealAssemblyError(f"Invalid integer: {token}")
+    if not 0 <= value < 2 ** 64:
+        raise TealAssemblyError(f"Integer out of range: {token}")
+    return value
+
+
+def _teal_string(token: str) -> bytes:
+    body, out, i = token[1:-1], bytearray(), 0
+    escapes = {'n': b'\n', 'r': b'\r', 't': b'\t', '\\': b'\\', '"': b'"'}
+    while i < len(body):
+        char = body[i]
+        if char != '\\':
+            out += char.encode()
+        elif body[i + 1] == 'x':
+            out.append(int(body[i + 2:i + 4], 16))
+            i += 2
+        elif body[i + 1] in escapes:
+            out += escapes[body[i + 1]]
+        else:
+            raise TealAssemblyError(f"Invalid escape in string: {token}")
+        i += 1 + (char == '\\')
+    return bytes(out)
+
+
+def _teal_bytes(args: list[str]) -> tuple[bytes, int]:
+    """Parse a byte constant, returning its value and the tokens consumed."""
+    if not args:
+        raise TealAssemblyError("Missing byte constant")
+    first = args[0]
+    for encoding_name, decode in (('base64', base64.b64decode),
+                                  ('b64', base64.b64decode),
+                                  ('base32', base64.b32decode),
+                                  ('b32', base64.b32decode)):
+        if first == encoding_name and len(args) > 1:
+            return decode(args[1]), 2
+        if first.startswith(encoding_name + '(') and first.endswith(')'):
+            return decode(first[len(encoding_name) + 1:-1]), 1
+    if first.startswith('0x'):
+        return bytes.fromhex(first[2:]), 1
+    if first.startswith('"') and first.endswith('"') and len(first) > 1:
+        return _teal_string(first), 1
+    raise TealAssemblyError(f"Invalid byte constant: {' '.join(args)}")
+
+
+def _teal_field(fields: dict, token: str) -> int:
+    try:
+        return fields[token]
+    except KeyError:
+        raise TealAssemblyError(f"Unknown field: {token}")
+
+
+def assemble(source_code: str) -> bytes:
+    """Assemble TEAL source into bytecode, like algod /teal/compile."""
+    version = teal_version(source_code)
+    code = bytearray()
+    intc, bytec = [], []
+    explicit_cblocks = False
+    labels, branches = {}, []
+
+    def push_const(table, value, op_0, op_n):
+        if explicit_cblocks:
+            raise TealAssemblyError(
+                "Pseudo-ops mixed with explicit constant blocks")
+        if value not in table:
+            table.append(value)
+        index = table.index(value)
+        code.extend([op_0 + index] if index < 4 else [op_n, index])
+
+    for line_number, line in enumerate(source_code.splitlines(), start=1):
+        tokens = _teal_tokens(line)
+        if tokens[:2] == ['#pragma', 'version']:
+            continue
+        while tokens and tokens[0].endswith(':'):
+            labels[tokens.pop(0)[:-1]] = len(code)
+        if not tokens:
+            continue
+
+        op, args = tokens[0], tokens[1:]
+        if op in ('int', 'byte', 'addr'):
+            if version >= OPTIMIZED_CONSTANTS_VERSION:
+                raise TealAssemblyError(
+                    f"TEAL v{version} constants are optimized by algod")
+            if op == 'byte':
+                value, used = _teal_bytes(args)
+                if used != len(args):
+                    raise TealAssemblyError(f"Line {line_number}: {line}")
+                push_const(bytec, value, 0x28, 0x27)
+            elif len(args) != 1:
+                raise TealAssemblyError(f"Line {line_number}: {line}")
+            elif op == 'int':
+                push_const(intc, _teal_int(args[0]), 0x22, 0x21)
+            else:
+                push_const(bytec, encoding.decode_address(args[0]),
+                           0x28, 0x27)
+            continue
+
+        # `txn F i` and `gtxn g F i` are shorthands for txna and gtxna
+        if {'txn': 2, 'gtxn': 3}.get(op) == len(args):
+            op += 'a'
+        if op not in TEAL_OPCODES:
+            raise TealAssemblyError(f"Line {line_number}: unknown op {op}")
+        opcode, immediates, min_version = TEAL_OPCODES[op]
+        if version < min_version:
+            raise TealAssemblyError(
+                f"Line {line_number}: {op} requires TEAL v{min_version}")
+
+        if op in ('intcblock', 'bytecblock'):
+            if intc or bytec:
+                raise TealAssemblyError(
+                    "Pseudo-ops mixed with explicit constant blocks")
+            explicit_cblocks = True
+            code.append(opcode)
+            code += _varint(len(args))
+            for arg in args:
+                if op == 'intcblock':
+                    code += _varint(_teal_int(arg))
+                else:
+                    value = _teal_bytes([arg])[0]
+                    code += _varint(len(value)) + value
+            continue
+        if op == 'pushbytes':
+            value, used = _teal_bytes(args)
+            if used != len(args):
+                raise TealAssemblyError(f"Line {line_number}: {line}")
+            code.append(opcode)
+            code += _varint(len(value)) + value
+            continue
+
+        if immediates == 'L':
+            # Label list, offsets relative to the instruction end
+            if len(args) > 255:
+                raise TealAssemblyError(f"Line {line_number}: too many labels")
+            code += bytes([opcode, len(args)])
+            end = len(code) + 2 * len(args)
+            for arg in args:
+                branches.append((len(code), arg, line_number, end))
+                code += b'\x00\x00'
+            continue
+
+        if len(args) != len(immediates):
+            raise TealAssemblyError(
+                f"Line {line_number}: {op} expects {len(immediates)} "
+                f"immediate(s)")
+        code.append(opcode)
+        for kind, arg in zip(immediates, args):
+            if kind == 'u':
+                value = _teal_int(arg)
+                if value > 255:
+                    raise TealAssemblyError(
+                        f"Line {line_number}: immediate out of range")
+                code.append(value)
+            elif kind == 'i':
+                code += _varint(_teal_int(arg))
+            elif kind in ('f', 'g'):
+                fields, v3_from = {
+                    'f': (TEAL_TXN_FIELDS, TEAL_TXN_FIELDS['Assets']),
+                    'g': (TEAL_GLOBAL_FIELDS,
+                          TEAL_GLOBAL_FIELDS['CreatorAddress']),
+                }[kind]
+                field = _teal_field(fields, arg)
+                if field >= v3_from and version < 3:
+                    raise TealAssemblyError(
+                        f"Line {line_number}: {arg} requires TEAL v3")
+                code.append(field)
+            elif kind == 'h':
+                code.append(_teal_field(TEAL_ASSET_HOLDING_FIELDS, arg))
+            elif kind == 'p':
+                code.append(_teal_field(TEAL_ASSET_PARAMS_FIELDS, arg))
+            elif kind == 'l':
+                branches.append((len(code), arg, line_number, len(code) + 2))
+                code += b'\x00\x00'
+
+    for position, label, line_number, end in branches:
+        if label not in labels:
+            raise TealAssemblyError(
+                f"Line {line_number}: reference to undefined label {label}")
+        offset = labels[label] - end
+        if offset < 0 and version < 4:
+            raise TealAssemblyError(
+                f"Line {line_number}: backward branch to {label}")
+        code[position:position + 2] = (offset & 0xffff).to_bytes(2, 'big')
+
+    prefix = _varint(version)
+    if intc:
+        prefix += bytes([0x20]) + _varint(len(intc))
+        prefix += b''.join(_varint(value) for value in intc)
+    if bytec:
+        prefix += bytes([0x26]) + _varint(len(bytec))
+        prefix += b''.join(_varint(len(value)) + value for value in bytec)
+    return prefix + bytes(code)
+
+
+# --- TEAL evaluator
+# Evaluates assembled TEAL against a transaction group of msgpack decoded
+# transactions (canonical keys, as in blocks), and a ledger view for the
+# stateful opcodes. Used to simulate and pre-validate the dApp locally.
+APP_COST_BUDGET = 700
+LSIG_COST_BUDGET = 20000
+ZERO_ADDRESS = bytes(32)
+
+TEAL_OPS_BY_CODE = {
+    opcode: (name, immediates)
+    for name, (opcode, immediates, _) in TEAL_OPCODES.items()
+}
+
+TEAL_OP_COSTS = {
+    'sha256': 35, 'keccak256': 130, 'sha512_256': 45, 'ed25519verify': 1900,
+}
+
+TEAL_TXN_KEYS = {
+    'Sender': 'snd', 'Fee': 'fee', 'FirstValid': 'fv', 'LastValid': 'lv',
+    'Note': 'note', 'Lease': 'lx', 'Receiver': 'rcv', 'Amount': 'amt',
+    'CloseRemainderTo': 'close', 'VotePK': 'votekey', 'SelectionPK': 'selkey',
+    'VoteFirst': 'votefst', 'VoteLast': 'votelst', 'VoteKeyDilution': 'votekd',
+    'Type': 'type', 'XferAsset': 'xaid', 'AssetAmount': 'aamt',
+    'AssetSender': 'asnd', 'AssetReceiver': 'arcv', 'AssetCloseTo': 'aclose',
+    'ApplicationID': 'apid', 'OnCompletion': 'apan',
+    'ApplicationArgs': 'apaa', 'Accounts': 'apat', 'ApprovalProgram': 'apap',
+    'ClearStateProgram': 'apsu', 'RekeyTo': 'rekey', 'ConfigAsset': 'caid',
+    'FreezeAsset': 'faid', 'FreezeAssetAccount': 'fadd',
+    'FreezeAssetFrozen': 'afrz', 'Assets': 'apas', 'Applications': 'apfa',
+}
+
+TEAL_ASSET_CONFIG_KEYS = {
+    'ConfigAssetTotal': 't', 'ConfigAssetDecimals': 'dc',
+    'ConfigAssetDefaultFrozen': 'df', 'ConfigAssetUnitName': 'un',
+    'ConfigAssetName': 'an', 'ConfigAssetURL': 'au',
+    'ConfigAssetMetadataHash': 'am', 'ConfigAssetManager': 'm',
+    'ConfigAssetReserve': 'r', 'ConfigAssetFreeze': 'f',
+    'ConfigAssetClawback': 'c',
+}
+
+TEAL_ADDRESS_FIELDS = {
+    'Sender', 'Receiver', 'CloseRemainderTo', 'AssetSender', 'AssetReceiver',
+    'AssetCloseTo', 'RekeyTo', 'FreezeAssetAccount', 'ConfigAssetManager',
+    'ConfigAssetReserve', 'ConfigAssetFreeze', 'ConfigAssetClawback',
+}
+
+TEAL_BYTES_FIELDS = TEAL_ADDRESS_FIELDS | {
+    'Note', 'Lease', 'VotePK', 'SelectionPK', 'Type', 'TxID',
+    'ApprovalProgram', 'ClearStateProgram', 'ConfigAssetUnitName',
+    'ConfigAssetName', 'ConfigAssetURL', 'ConfigAssetMetadataHash',
+}
+
+TEAL_TYPE_ENUMS = {
+    b'pay': 1, b'keyreg': 2, b'acfg': 3, b'axfer': 4, b'afrz': 5, b'appl': 6,
+}
+
+
+class TealReject(Exception):
+    """A TEAL program rejected, or failed on, a transaction."""
+
+    def __init__(self, message: str, pc: int = None):
+        super().__init__(message if pc is None else f"pc={pc}: {message}")
+        self.pc = pc
+
+
+def txn_id(txn: dict) -> str:
+    """ID of a (msgpack decoded) transaction."""
+    packed = msgpack.packb(dict(sorted(txn.items())), use_bin_type=True)
+    tx_id = base64.b32encode(encoding.checksum(b'TX' + packed)).decode()
+    return tx_id.rstrip('=')
+
+
+def decode_txn(txn: Transaction) -> dict:
+    """Msgpack decoded (canonical keys) form of an SDK transaction."""
+    return msgpack.unpackb(
+        base64.b64decode(encoding.msgpack_encode(txn)), raw=False)
+
+
+def teal_txn_field(group: list, group_index: int, field: str,
+                   index: int = None):
+    """Value of a TEAL transaction field of group[group_index]."""
+    txn = group[group_index]
+    if field == 'GroupIndex':
+        return group_index
+    if field == 'TxID':
+        return base64.b32decode(txn_id(txn) + '====')
+    if field == 'TypeEnum':
+        return TEAL_TYPE_ENUMS.get(txn.get('type', '').encode(), 0)
+    if field == 'NumAppArgs':
+        return len(txn.get('apaa', []))
+    if field in ('NumAccounts', 'NumAssets', 'NumApplications'):
+        return len(txn.get(TEAL_TXN_KEYS[field[3:]], []))
+    if field in ('ApplicationArgs', 'Accounts', 'Assets', 'Applications'):
+        values = list(txn.get(TEAL_TXN_KEYS[field], []))
+        if field == 'Accounts':
+            values = [txn.get('snd', ZERO_ADDRESS)] + values
+        elif field == 'Applications':
+            values = [txn.get('apid', 0)] + values
+        if index is None or index >= len(values):
+            raise TealReject(f"{field} index {index} out of range")
+        return values[index]
+
+    if field in TEAL_ASSET_CONFIG_KEYS:
+        value = txn.get('apar', {}).get(TEAL_ASSET_CONFIG_KEYS[field])
+    elif field in ('GlobalNumUint', 'GlobalNumByteSlice', 'LocalNumUint',
+                   'LocalNumByteSlice'):
+        schema = txn.get('apgs' if field.startswith('Global') else 'apls', {})
+        value = schema.get('nui' if field.endswith('Uint') else 'nbs')
+    elif field in TEAL_TXN_KEYS:
+        value = txn.get(TEAL_TXN_KEYS[field])
+    else:
+        raise TealReject(f"Unsupported txn field {field}")
+
+    if value is None:
+        if field in TEAL_ADDRESS_FIELDS or field == 'Lease':
+            return ZERO_ADDRESS
+        return b'' if field in TEAL_BYTES_FIELDS else 0
+    if isinstance(value, str):
+        return value.encode()
+    if isinstance(value, bool):
+        return int(value)
+    return value
+
+
+def _teal_read_varint(program: bytes, pc: int) -> tuple[int, int]:
+    value, shift = 0, 0
+    while True:
+        if pc >= len(program):
+            raise TealReject("Truncated varint", pc)
+        byte = program[pc]
+        value |= (byte & 0x7f) << shift
+        pc += 1
+        if not byte & 0x80:
+            return value, pc
+        shift += 7
+
+
+def teal_decode(program: bytes):
+    """Decode bytecode in (pc, op name, immediates, next pc) instructions."""
+    version, pc = _teal_read_varint(program, 0)
+    instructions = []
+    while pc < len(program):
+        start = pc
+        if program[pc] not in TEAL_OPS_BY_CODE:
+            raise TealReject(f"Unknown opcode {program[pc]:#04x}", pc)
+        name, immediates = TEAL_OPS_BY_CODE[program[pc]]
+        pc += 1
+        args = []
+        if immediates == 'ints':
+            count, pc = _teal_read_varint(program, pc)
+            for _ in range(count):
+                value, pc = _teal_read_varint(program, pc)
+                args.append(value)
+        elif immediates in ('bytes', 'b'):
+            count = 1
+            if immediates == 'bytes':
+                count, pc = _teal_read_varint(program, pc)
+            for _ in range(count):
+                length, pc = _teal_read_varint(program, pc)
+                args.append(program[pc:pc + length])
+                pc += length
+        elif immediates == 'i':
+            value, pc = _teal_read_varint(program, pc)
+            args.append(value)
+        elif immediates == 'L':
+            count = program[pc] if pc < len(program) else 0
+            pc += 1
+            for _ in range(count):
+                args.append(int.from_bytes(program[pc:pc + 2], 'big',
+                                           signed=True))
+                pc += 2
+        else:
+            for kind in immediates:
+                if kind == 'l':
+                    offset = int.from_bytes(
+                        program[pc:pc + 2], 'big', signed=version >= 4)
+                    args.append(offset)
+                    pc += 2
+                else:
+                    args.append(program[pc])
+                    pc += 1
+        if pc > len(program):
+            raise TealReject(f"Truncated {name} immediates", start)
+        instructions.append((start, name, args, pc))
+    return version, instructions
+
+
+def _field_name(fields: dict, index: int) -> str:
+    for name, value in fields.items():
+        if value == index:
+            return name
+    raise TealReject(f"Unknown field {index}")
+
+
+def eval_teal(program: bytes, group: list, group_index: int,
+              ledger=None, app_id: int = None) -> bool:
+    """Run a program on group[group_index]: in application mode if app_id is
+    given (stateful opcodes go through `ledger`), else in signature mode.
+
+    Returns True if approved, raises TealReject otherwise.
+    """
+    version, instructions = teal_decode(program)
+    by_pc = {pc: i for i, (pc, _, _, _) in enumerate(instructions)}
+    budget = LSIG_COST_BUDGET if app_id is None else APP_COST_BUDGET
+    if version < 4:
+        # Before TEAL v4 the cost is the static sum of all the opcodes
+        static_cost = sum(TEAL_OP_COSTS.get(name, 1)
+                          for _, name, _, _ in instructions)
+        if static_cost > budget:
+            raise TealReject(f"Static cost {static_cost} over {budget}")
+        budget = static_cost
+    stack, scratch = [], [0] * 256
+    intc, bytec = [], []
+    cost, i = 0, 0
+
+    def pop(kind=None):
+        if not stack:
+            raise TealReject("Stack underflow", pc)
+        value = stack.pop()
+        if kind is not None and not isinstance(value, kind):
+            raise TealReject(
+                f"{name} expects {kind.__name__}, got {value!r}", pc)
+        return value
+
+    def push(value):
+        if isinstance(value, bool):
+            value = int(value)
+        if isinstance(value, int) and not 0 <= value < 2 ** 64:
+            raise TealReject(f"{name} overflow", pc)
+        stack.append(value)
+
+    def stateful():
+        if app_id is None or ledger is None:
+            raise TealReject(f"{name} not allowed in signature mode", pc)
+
+    def account(index):
+        txn = group[group_index]
+        if isinstance(index, bytes) and version >= 4:
+            return index
+        accounts = [txn.get('snd', ZERO_ADDRESS)] + list(txn.get('apat', []))
+        if not isinstance(index, int) or index >= len(accounts):
+            raise TealReject(f"Invalid account reference {index!r}", pc)
+        return accounts[index]
+
+    def application(reference):
+        foreign = group[group_index].get('apfa', [])
+        if reference == 0:
+            return app_id
+        if version >= 4 and reference <= len(foreign):
+            return foreign[reference - 1]
+        if reference != app_id and reference not in foreign:
+            raise TealReject(f"Unavailable application {reference}", pc)
+        return reference
+
+    binary_ops = {
+        '+': lambda a, b: a + b,
+        '-': lambda a, b: a - b,
+        '*': lambda a, b: a * b,
+        '/': lambda a, b: a // b,
+        '%': lambda a, b: a % b,
+        '<': lambda a, b: a < b,
+        '>': lambda a, b: a > b,
+        '<=': lambda a, b: a <= b,
+        '>=': lambda a, b: a >= b,
+        '&&': lambda a, b: bool(a and b),
+        '||': lambda a, b: bool(a or b),
+        '|': lambda a, b: a | b,
+        '&': lambda a, b: a & b,
+        '^': lambda a, b: a ^ b,
+    }
+
+    while i < len(instructions):
+        pc, name, args, next_pc = instructions[i]
+        cost += TEAL_OP_COSTS.get(name, 1)
+        if cost > budget:
+            raise TealReject(f"Cost budget {budget} exceeded", pc)
+        i += 1
+
+        if name in binary_ops:
+            b, a = pop(int), pop(int)
+            if name == '-' and b > a:
+                raise TealReject("- underflow", pc)
+            if name in ('/', '%') and b == 0:
+                raise TealReject(f"{name} by zero", pc)
+            push(binary_ops[name](a, b))
+        elif name in ('==', '!='):
+            b, a = pop(), pop()
+            if type(a) is not type(b):
+                raise TealReject(f"{name} on mixed types", pc)
+            push((a == b) == (name == '=='))
+        elif name == '!':
+            push(pop(int) == 0)
+        elif name == '~':
+            push(pop(int) ^ (2 ** 64 - 1))
+        elif name == 'len':
+            push(len(pop(bytes)))
+        elif name == 'itob':
+            push(pop(int).to_bytes(8, 'big'))
+        elif name == 'btoi':
+            value = pop(bytes)
+            if len(value) > 8:
+                raise TealReject("btoi arg too long", pc)
+            push(int.from_bytes(value, 'big'))
+        elif name == 'mulw':
+            b, a = pop(int), pop(int)
+            push((a * b) >> 64)
+            push((a * b) & (2 ** 64 - 1))
+        elif name == 'addw':
+            b, a = pop(int), pop(int)
+            push((a + b) >> 64)
+            push((a + b) & (2 ** 64 - 1))
+        elif name == 'sha256':
+            push(hashlib.sha256(pop(bytes)).digest())
+        elif name == 'sha512_256':
+            push(encoding.checksum(pop(bytes)))
+        elif name == 'intcblock':
+            intc = args
+        elif name == 'bytecblock':
+            bytec = args
+        elif name.startswith('intc'):
+            index = args[0] if name == 'intc' else int(name[-1])
+            if index >= len(intc):
+                raise TealReject(f"intc {index} beyond intcblock", pc)
+            push(intc[index])
+        elif name.startswith('bytec'):
+            index = args[0] if name == 'bytec' else int(name[-1])
+            if index >= len(bytec):
+                raise TealReject(f"bytec {index} beyond bytecblock", pc)
+            push(bytec[index])
+        elif name in ('pushint', 'pushbytes'):
+            push(args[0])
+        elif name.startswith('arg'):
+            raise TealReject("LogicSig arguments are not supported", pc)
+        elif name in ('txn', 'txna', 'gtxn', 'gtxna', 'gtxns', 'gtxnsa'):
+            if name.startswith('gtxns'):
+                target = pop(int)
+                field, index = args[0], (args[1] if len(args) > 1 else None)
+            elif name.startswith('gtxn'):
+                target, field = args[0], args[1]
+                index = args[2] if len(args) > 2 else None
+            else:
+                target = group_index
+                field, index = args[0], (args[1] if len(args) > 1 else None)
+            if target >= len(group):
+                raise TealReject(f"Group index {target} out of range", pc)
+            push(teal_txn_field(
+                group, target, _field_name(TEAL_TXN_FIELDS, field), index))
+        elif name == 'global':
+            field = _field_name(TEAL_GLOBAL_FIELDS, args[0])
+            if field in ('Round', 'LatestTimestamp', 'CurrentApplicationID',
+                         'CreatorAddress'):
+                stateful()
+            push({
+                'MinTxnFee': lambda: 1000,
+                'MinBalance': lambda: 100_000,
+                'MaxTxnLife': lambda: 1000,
+                'ZeroAddress': lambda: ZERO_ADDRESS,
+                'GroupSize': lambda: len(group),
+                'LogicSigVersion': lambda: 8,
+                'Round': lambda: ledger.round,
+                'LatestTimestamp': lambda: ledger.timestamp,
+                'CurrentApplicationID': lambda: app_id,
+                'CreatorAddress': lambda: ledger.app_creator(app_id),
+            }[field]())
+        elif name == 'load':
+            push(scratch[args[0]])
+        elif name == 'store':
+            scratch[args[0]] = pop()
+        elif name in ('bnz', 'bz', 'b'):
+            if name == 'b' or (pop(int) != 0) == (name == 'bnz'):
+                target = next_pc + args[0]
+                if target == len(program):
+                    break
+                if target not in by_pc:
+                    raise TealReject(f"Branch to invalid pc {target}", pc)
+                i = by_pc[target]
+        elif name in ('switch', 'match'):
+            if name == 'switch':
+                selected = pop(int)
+            else:
+                value = pop()
+                cases = [pop() for _ in args][::-1]
+                selected = next((index for index, case in enumerate(cases)
+                                 if type(case) is type(value)
+                                 and case == value), len(args))
+            if selected < len(args):
+                target = next_pc + args[selected]
+                if target == len(program):
+                    break
+                if target not in by_pc:
+                    raise TealReject(f"Branch to invalid pc {target}", pc)
+                i = by_pc[target]
+        elif name == 'return':
+            value = pop(int)
+            stack[:] = [value]
+            break
+        elif name == 'assert':
+            if pop(int) == 0:
+                raise TealReject("assert failed", pc)
+        elif name == 'err':
+            raise TealReject("err opcode executed", pc)
+        elif name == 'pop':
+            pop()
+        elif name == 'dup':
+            value = pop()
+            push(value)
+            push(value)
+        elif name == 'dup2':
+            b, a = pop(), pop()
+            for value in (a, b, a, b):
+                push(value)
+        elif name == 'dig':
+            if args[0] >= len(stack):
+                raise TealReject("dig beyond stack", pc)
+            push(stack[-1 - args[0]])
+        elif name == 'swap':
+            b, a = pop(), pop()
+            push(b)
+            push(a)
+        elif name == 'select':
+            c, b, a = pop(int), pop(), pop()
+            push(b if c else a)
+        elif name == 'concat':
+            b, a = pop(bytes), pop(bytes)
+            push(a + b)
+        elif name in ('substring', 'substring3'):
+            if name == 'substring':
+                start, end = args
+            else:
+                end, start = pop(int), pop(int)
+            value = pop(bytes)
+            if not start <= end <= len(value):
+                raise TealReject(f"{name} out of range", pc)
+            push(value[start:end])
+        elif name == 'balance':
+            stateful()
+            push(ledger.balance(account(pop())))
+        elif name == 'min_balance':
+            stateful()
+            push(ledger.min_balance(account(pop())))
+        elif name == 'app_opted_in':
+            stateful()
+            app, address = pop(int), account(pop())
+            push(ledger.opted_in(address, application(app)))
+        elif name == 'app_local_get':
+            stateful()
+            key, address = pop(bytes), account(pop())
+            value = ledger.local_get(address, app_id, key)
+            push(0 if value is None else value)
+        elif name == 'app_local_get_ex':
+            stateful()
+            key, app, address = pop(bytes), pop(int), account(pop())
+            value = ledger.local_get(address, application(app), key)
+            push(0 if value is None else value)
+            push(value is not None)
+        elif name == 'app_global_get':
+            stateful()
+            value = ledger.global_get(app_id, pop(bytes))
+            push(0 if value is None else value)
+        elif name == 'app_global_get_ex':
+            stateful()
+            key, app = pop(bytes), pop(int)
+            value = ledger.global_get(application(app), key)
+            push(0 if value is None else value)
+            push(value is not None)
+        elif name == 'app_local_put':
+            stateful()
+            value, key, address = pop(), pop(bytes), account(pop())
+            ledger.local_put(address, app_id, key, value)
+        elif name == 'app_global_put':
+            stateful()
+            value, key = pop(), pop(bytes)
+            ledger.global_put(app_id, key, value)
+        elif name == 'app_local_del':
+            stateful()
+            key, address = pop(bytes), account(pop())
+            ledger.local_del(address, app_id, key)
+        elif name == 'app_global_del':
+            stateful()
+            ledger.global_del(app_id, pop(bytes))
+        elif name in ('asset_holding_get', 'asset_params_get'):
+            stateful()
+            asset = pop(int)
+            if name == 'asset_holding_get':
+                address = account(pop())
+                field = _field_name(TEAL_ASSET_HOLDING_FIELDS, args[0])
+                value = ledger.asset_holding(address, asset, field)
+            else:
+                field = _field_name(TEAL_ASSET_PARAMS_FIELDS, args[0])
+                value = ledger.asset_params(asset, field)
+            push(0 if value is None else value)
+            push(value is not None)
+        else:
+            raise TealReject(f"Unsupported opcode {name}", pc)
+
+    if len(stack) != 1 or not isinstance(stack[0], int):
+        raise TealReject(f"Program ended with stack {stack!r}")
+    if stack[0] == 0:
+        raise TealReject("Program rejected (zero on stack)")
+    return True
+
+
+# --- TEAL profiler
+# Static size and cost of TEAL programs. Worst case costs are the most
+# expensive path through the program control flow graph: for each Cond
+# branch, from the program start, through the branch dispatch, to its end.
+def teal_successors(instructions: list, index: int, by_pc: dict) -> list:
+    """Indexes of the instructions following instructions[index], where
+    len(instructions) is the program end."""
+    end = len(instructions)
+    pc, name, args, next_pc = instructions[index]
+    if name in ('return', 'err'):
+        return [end]
+    following = [by_pc.get(next_pc, end)]
+    if name in ('bnz', 'bz', 'b', 'switch', 'match'):
+        offsets = args if name in ('switch', 'match') else args[:1]
+        if name == 'b':
+            following = []
+        for offset in offsets:
+            target = next_pc + offset
+            if target not in by_pc and target != instructions[-1][3]:
+                raise TealReject(f"Branch to invalid pc {target}", pc)
+            following.append(by_pc.get(target, end))
+    return following
+
+
+def teal_worst_case(instructions: list) -> list[int]:
+    """Worst case cost from each instruction to the program end."""
+    by_pc = {pc: i for i, (pc, _, _, _) in enumerate(instructions)}
+    end = len(instructions)
+    worst = [None] * end + [0]
+    on_path = set()
+    for root in range(end):
+        # Iterative depth first search: successors are costed first
+        stack = [root]
+        while stack:
+            index = stack[-1]
+            if worst[index] is not None:
+                stack.pop()
+                continue
+            following = teal_successors(instructions, index, by_pc)
+            pending = [i for i in following if worst[i] is None]
+            if not pending:
+                cost = TEAL_OP_COSTS.get(instructions[index][1], 1)
+                worst[index] = cost + max(worst[i] for i in following)
+                on_path.discard(index)
+                stack.pop()
+                continue
+            if any(i in on_path for i in pending):
+                raise TealReject("Unbounded cost: the program loops",
+                                 instructions[index][0])
+            on_path.add(index)
+            stack += pending
+    return worst
+
+
+def teal_cond_arms(instructions: list, start: int) -> list:
+    """(dispatch cost, branch start) of the arms of the Cond compiled at
+    `start`: a chain of tests, each branching to its arms (bnz, bz, switch
+    or match), ending in err."""
+    by_pc = {pc: i for i, (pc, _, _, _) in enumerate(instructions)}
+    arms, cost = [], 0
+    for index in range(start, len(instructions)):
+        pc, name, args, next_pc = instructions[index]
+        cost += TEAL_OP_COSTS.get(name, 1)
+        if name in ('bnz', 'bz', 'switch', 'match'):
+            offsets = args if name in ('switch', 'match') else args[:1]
+            arms += [(cost, by_pc.get(next_pc + offset, len(instructions)))
+                     for offset in offsets]
+        elif name == 'err':
+            return arms
+        elif name in ('b', 'return'):
+            break
+    raise TealReject("No Cond found", instructions[start][0])
+
+
+def teal_branch_costs(program: bytes, branches: list) -> dict:
+    """Worst case cost of each named Cond branch of a program."""
+    _, instructions = teal_decode(program)
+    worst = teal_worst_case(instructions)
+    # Skip the constant blocks, before the program logic
+    start = 0
+    while instructions[start][1] in ('intcblock', 'bytecblock'):
+        start += 1
+    prefix = sum(TEAL_OP_COSTS.get(name, 1)
+                 for _, name, _, _ in instructions[:start])
+
+    costs = {}
+
+    def visit(branches, start, prefix):
+        arms = teal_cond_arms(instructions, start)
+        if len(arms) != len(branches):
+            raise TealReject(f"Cond of {len(arms)} branches, expected "
+                             f"{len(branches)}", instructions[start][0])
+        for branch, (dispatch_cost, arm_start) in zip(branches, arms):
+            if isinstance(branch, tuple):
+                name, nested = branch
+                visit(nested, arm_start, prefix + dispatch_cost)
+            else:
+                costs[branch] = prefix + dispatch_cost + worst[arm_start]
+
+    visit(branches, start, prefix)
+    return costs
+
+
+def profile_program(source_code: str, branches: list = None) -> dict:
+    """Bytecode size, opcode counts and costs of a TEAL program."""
+    program = assemble(source_code)
+    version, instructions = teal_decode(program)
+    opcodes = {}
+    for _, name, _, _ in instructions:
+        opcodes[name] = opcodes.get(name, 0) + 1
+    profile = {
+        'version': version,
+        'size': len(program),
+        'static_cost': sum(TEAL_OP_COSTS.get(name, 1)
+                           for _, name, _, _ in instructions),
+        'worst_case_cost': teal_worst_case(instructions)[0],
+        'opcodes': dict(sorted(opcodes.items(),
+                               key=lambda item: (-item[1], item[0]))),
+    }
+    if branches:
+        profile['branches'] = teal_branch_costs(program, branches)
+    return profile
+
+
+def _profile_delta(value: int, baseline_value) -> str:
+    if baseline_value is None or value == baseline_value:
+        return f"{value}"
+    return f"{value} ({value - baseline_value:+d})"
+
+
+def profile_summary(profiles: dict, baseline: dict = None) -> str:
+    """Profiles as text, diffed against a baseline profile if any."""
+    baseline = baseline or {}
+    lines = []
+    for name, profile in profiles.items():
+        reference = baseline.get(name, {})
+        budget = (LSIG_COST_BUDGET if name.endswith('_escrow')
+                  else APP_COST_BUDGET)
+
+        def delta(key, sub_key=None):
+            value, base = profile[key], reference.get(key)
+            if sub_key is not None:
+                value, base = value[sub_key], (base or {}).get(sub_key)
+            return _profile_delta(value, base)
+
+        # The budget bounds the static cost before TEAL v4, then the
+        # executed one
+        static_budget = worst_budget = f" / {budget}"
+        if profile['version'] < 4:
+            worst_budget = ''
+        else:
+            static_budget = ''
+        lines += [
+            f"\n{name} (TEAL v{profile['version']})",
+            f"   SIZE:\t{delta('size')} bytes",
+            f"   STATIC COST:\t{delta('static_cost')}{static_budget}",
+            f"   WORST CASE:\t{delta('worst_case_cost')}{worst_budget}",
+        ]
+        if 'branches' in profile:
+            lines.append("   BRANCHES (worst case cost):")
+            for branch in profile['branches']:
+                lines.append(
+                    f"      {branch:<12}{delta('branches', branch)}")
+        lines.append("   OPCODES:")
+        opcodes = set(profile['opcodes']) | set(reference.get('opcodes', {}))
+        for opcode in sorted(opcodes, key=lambda op: (
+                -profile['opcodes'].get(op, 0), op)):
+            count = profile['opcodes'].get(opcode, 0)
+            base = reference.get('opcodes', {}).get(opcode)
+            if reference and base is None:
+                base = 0
+            lines.append(f"      {opcode:<20}{_profile_delta(count, base)}")
+    return '\n'.join(lines)